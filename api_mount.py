@@ -0,0 +1,23 @@
+import importlib
+import os
+import sys
+import types
+
+# Name of the package the repository modules are mounted as when there is no deployed API package
+MOUNTED_PACKAGE = "buddy_bench"
+
+
+# Import the API's matching_algorithm. Given the package it is deployed in, that package (and its
+# models.Buddy) is used; otherwise the repository modules are mounted as a package whose models
+# module is standin_api, which has the same Buddy columns.
+# Returns (matching_algorithm, models).
+def load_api_matcher(package=None):
+    if package:
+        return importlib.import_module(f"{package}.matching_algorithm"), importlib.import_module(f"{package}.models")
+    import standin_api
+    if MOUNTED_PACKAGE not in sys.modules:
+        mounted = types.ModuleType(MOUNTED_PACKAGE)
+        mounted.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[MOUNTED_PACKAGE] = mounted
+        sys.modules[f"{MOUNTED_PACKAGE}.models"] = standin_api
+    return importlib.import_module(f"{MOUNTED_PACKAGE}.matching_algorithm"), standin_api
@@ -1,108 +1,304 @@
+import os
+import numpy as np
 import pandas as pd
 import logging
 from sklearn.model_selection import train_test_split
+from fuzzy_index import FuzzyIndex
+from keyword_index import SYNONYMS
+from keyword_scoring import BATCH_WEIGHTS
+from parallel_eval import ProfilePool, parallel_top_indices
+from partitions import ProfilePartitions
+from profile_cache import DEFAULT_CACHE_DIR, read_excel_cached
+from scenario_stream import iter_scenario_chunks, write_metric_rows
+from scoring_engine import (CATEGORY_FIELDS, DEAD_SCORE, NO_MATCH, REQUEST_KEYS, batch_top_indices, category_scores,
+                            compact_profiles, encode_profiles, frame_nbytes, max_keyword_points, pruned_top_positions, score_profiles,
+                            split_keywords, top_indices, top_k_positions)
+from stage_metrics import NO_METRICS, StageMetrics
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load buddy profiles and test scenarios
-def load_data():
+# Load buddy profiles and test scenarios (from the columnar snapshot unless the spreadsheet changed)
+def load_data(cache_dir=DEFAULT_CACHE_DIR, metrics=NO_METRICS):
     try:
-        buddy_profiles = pd.read_excel("Dummy-Buddy-Profiles-Batch1.xlsx")
-        test_scenarios = pd.read_excel("Buddy-Matching-Test-Scenarios.xlsx")
+        with metrics.stage("load"):
+            buddy_profiles = read_excel_cached("Dummy-Buddy-Profiles-Batch1.xlsx", cache_dir)
+            test_scenarios = read_excel_cached("Buddy-Matching-Test-Scenarios.xlsx", cache_dir)
         logger.info("Loaded buddy profiles and test scenarios successfully.")
         return buddy_profiles, test_scenarios
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
         raise
 
-# Data Transformation
-def preprocess_data(buddy_profiles):
-    buddy_profiles_expanded = buddy_profiles.copy()
+# Data Transformation: store the repetitive text columns as Categoricals instead of copying the table
+def preprocess_data(buddy_profiles, metrics=NO_METRICS):
+    with metrics.stage("preprocess"):
+        buddy_profiles_expanded = compact_profiles(buddy_profiles)
+    # Deep memory accounting walks every string; only pay for it when the line is logged
+    if logger.isEnabledFor(logging.INFO):
+        bytes_before = frame_nbytes(buddy_profiles)
+        bytes_after = frame_nbytes(buddy_profiles_expanded)
+        logger.info(f"Compacted buddy profiles from {bytes_before:,} to {bytes_after:,} bytes")
     return buddy_profiles_expanded
 
 # Split dataset into training and testing sets (80/20 split)
 def split_data(buddy_profiles_expanded):
     return train_test_split(buddy_profiles_expanded, test_size=0.2, random_state=42)
 
-# Helper function to retrieve synonyms (simplified example)
+# Helper function to retrieve synonyms (the table lives in keyword_index, shared with the API matcher)
 def get_synonyms(keyword):
-    synonyms = {
-        "weed": ["420 friendly", "cannabis"],
-        "music": ["nightlife", "concert"]
-        # Add more synonym mappings here if needed
-    }
-    return synonyms.get(keyword, [keyword])
+    return SYNONYMS.get(keyword, [keyword])
+
+# Partition profile row positions by destination (and optionally user language) for candidate pre-filtering
+def build_partitions(profiles, by_language=False):
+    if by_language and "User Language" in profiles.columns:
+        languages = profiles["User Language"]
+    else:
+        languages = [None] * len(profiles)
+    return ProfilePartitions.build(zip(range(len(profiles)), profiles["Destination"], languages))
+
+# Trigram index over the encoded profiles' distinct destinations, events, packages and keywords,
+# for fuzzy requests (see fuzzy_request). Rebuild it when the profiles gain new values.
+def build_fuzzy_index(encoded):
+    return FuzzyIndex.from_values({
+        "destination": encoded.categories.get("Destination", []),
+        "event": encoded.categories.get("Event", []),
+        "package": encoded.categories.get("Package", []),
+        "keywords": list(encoded.vocabulary),
+    })
+
+# The scorer only counts exact matches, so a fuzzy request is one whose destination, event, package
+# and keywords are replaced by the closest values the profiles hold ("NYC" -> "New York", "musci" ->
+# "music"). Values the profiles hold exactly, and values nothing is similar to, are left alone.
+def fuzzy_request(request, encoded, fuzzy):
+    request = {key: request.get(key) for key in REQUEST_KEYS}
+    for key, column in (("destination", "Destination"), ("event", "Event"), ("package", "Package")):
+        value = request[key]
+        if pd.notna(value) and encoded.code_for(column, value) == NO_MATCH:
+            request[key] = fuzzy.closest(key, value) or value
+    if pd.notna(request["keywords"]):
+        request["keywords"] = ",".join(
+            token if token in encoded.vocabulary else fuzzy.closest("keywords", token) or token
+            for token in split_keywords(request["keywords"]))
+    return request
+
+# Partition blocks worth scoring before every profile, narrowest first, as (sorted row positions,
+# best score a profile outside the block can reach). Every profile whose destination equals the
+# request's is in its destination block (blocks hold every spelling that normalizes alike), so one
+# outside loses at least the destination points; outside a language block, at least the smaller of
+# the destination and language points. Nothing is returned when those points are not on offer
+# (no profile has the value, or a zero or negative weight), as the bound would not prune anything.
+def partition_blocks(request, encoded, partitions, weights=BATCH_WEIGHTS):
+    if any(getattr(weights, key) < 0 for key in weights.FIELDS):
+        return []
+    points = {key: getattr(weights, key) if request.codes[column] != NO_MATCH else 0
+              for key, column, _ in CATEGORY_FIELDS}
+    best = sum(points.values()) + max_keyword_points(request, weights)
+    destination_block = partitions.sorted_candidates(request['destination'])
+    if destination_block is None or not points["destination"]:
+        return []
+    blocks = []
+    block = partitions.sorted_candidates(request['destination'], request['language'])
+    if len(block) < len(destination_block) and points["language"]:
+        blocks.append((block, best - min(points["destination"], points["language"])))
+    blocks.append((destination_block, best - points["destination"]))
+    return blocks
 
 # Define the matching function
-def find_best_buddies(request, profiles):
-    matching_scores = []
-    for idx, profile in profiles.iterrows():
-        score = 0
-        
-        # Scoring based on each field in the request (simplified)
-        if request['destination'] == profile.get('Destination'):
-            score += 20
-        if request['language'] == profile.get('User Language'):
-            score += 20
-        if request['local_language'] == profile.get('Local Language'):
-            score += 20
-        
-        # Handling NaN values in 'Keywords' and scoring based on keywords
-        request_keywords = str(request['keywords']).split(',') if pd.notna(request['keywords']) else []
-        profile_keywords = str(profile.get('Keywords', '')).split(',') if pd.notna(profile.get('Keywords')) else []
-        
-        for keyword in request_keywords:
-            if keyword in profile_keywords:
-                score += 20
-        
-        if request['event'] == profile.get('Event'):
-            score += 10
-        if request['package'] == profile.get('Package'):
-            score += 10
-        
-        matching_scores.append((idx, score))
-
-    # Sort by score in descending order and pick the top matches
-    top_matches = sorted(matching_scores, key=lambda x: x[1], reverse=True)[:5]
-    return [idx for idx, score in top_matches]
+# weights (a keyword_scoring.ScoringWeights) sets the points per matched field
+# With fuzzy (from build_fuzzy_index) the request is matched fuzzily, see fuzzy_request
+def find_best_buddies(request, profiles, encoded=None, partitions=None, top_k=5, metrics=NO_METRICS,
+                      weights=BATCH_WEIGHTS, fuzzy=None, prune=False):
+    if encoded is None:
+        with metrics.stage("preprocess"):
+            encoded = encode_profiles(profiles)
+
+    with metrics.stage("filter"):
+        if fuzzy is not None:
+            request = fuzzy_request(request, encoded, fuzzy)
+        # Translate the request into the encoded profiles' integer codes once (memoized per request)
+        request = encoded.compile(request)
+
+        blocks = partition_blocks(request, encoded, partitions, weights) if partitions is not None else []
+
+    # Destination is a scored field here, not a filter, so a block's top k only stands when no profile
+    # outside the block can outscore its k-th best; otherwise every profile is scored
+    k = min(top_k, len(encoded) - len(encoded.dead))
+    keyword_bound = max_keyword_points(request, weights)
+    for positions, outside_bound in blocks:
+        with metrics.stage("score"):
+            # Cheap check first: enough rows must be able to beat the bound on category points plus
+            # every keyword, or the block cannot stand and its keywords are not worth scoring
+            if k == 0 or np.count_nonzero(
+                    category_scores(request, encoded, positions, weights) + keyword_bound > outside_bound) < k:
+                continue
+            scores = score_profiles(request, encoded, positions, weights)
+        metrics.count("candidates_scanned", len(scores))
+        if np.count_nonzero(scores != DEAD_SCORE) < k:
+            continue
+        with metrics.stage("topk"):
+            top = top_k_positions(scores[None, :], k)[0]
+        if scores[top[-1]] > outside_bound:
+            top_buddies = encoded.index[positions[top]].tolist()
+            metrics.count("candidates_returned", len(top_buddies))
+            return top_buddies
+
+    # With prune, only the profiles whose best possible score can still reach the top k are scored
+    # (see scoring_engine.pruned_top_positions); the result is the same
+    if prune:
+        with metrics.stage("score"):
+            top = pruned_top_positions(request, encoded, top_k, weights=weights, metrics=metrics)
+            top_buddies = encoded.index[top].tolist()
+        metrics.count("candidates_returned", len(top_buddies))
+        return top_buddies
+
+    # Score the candidates at once on integer-coded columns (see scoring_engine for the weights)
+    with metrics.stage("score"):
+        scores = score_profiles(request, encoded, weights=weights)
+    metrics.count("candidates_scanned", len(scores))
+
+    # Pick the top matches, highest score first
+    with metrics.stage("topk"):
+        if len(encoded.dead):
+            top_k = min(top_k, int(np.count_nonzero(scores != DEAD_SCORE)))
+        top_buddies = top_indices(scores, encoded.index, k=top_k)
+    metrics.count("candidates_returned", len(top_buddies))
+    return top_buddies
+
+# Match every scenario at once: scenarios x profiles score matrix, scored in memory-bounded chunks.
+# With workers > 1 the chunks are spread over a process pool sharing the encoded profiles; pass an
+# open parallel_eval.ProfilePool as pool to reuse one across calls (workers is then the pool's).
+# Scoring and top-k run inside the workers there, so the parallel path reports them as one "score" stage.
+def find_best_buddies_batch(test_scenarios, profiles, top_k=5, encoded=None, max_cells=8_000_000, workers=1,
+                            metrics=NO_METRICS, weights=BATCH_WEIGHTS, fuzzy=None, pool=None):
+    if pool is not None:
+        encoded, workers = pool.encoded, pool.workers
+    if encoded is None:
+        with metrics.stage("preprocess"):
+            encoded = encode_profiles(profiles)
+    if fuzzy is not None:
+        with metrics.stage("filter"):
+            test_scenarios = pd.DataFrame(
+                [fuzzy_request(scenario, encoded, fuzzy) for scenario in test_scenarios[REQUEST_KEYS].to_dict("records")],
+                index=test_scenarios.index)
+    if workers > 1:
+        with metrics.stage("score"):
+            if pool is not None:
+                results = pool.top_indices(test_scenarios, k=top_k, max_cells=max_cells, weights=weights)
+            else:
+                results = parallel_top_indices(test_scenarios, encoded, k=top_k, workers=workers, max_cells=max_cells,
+                                               weights=weights)
+        metrics.count("candidates_scanned", len(test_scenarios) * len(encoded))
+        metrics.count("candidates_returned", sum(map(len, results)))
+        return results
+    return batch_top_indices(test_scenarios, encoded, k=top_k, max_cells=max_cells, metrics=metrics, weights=weights)
+
+# Top k for every scenario, batched. A malformed scenario fails the whole batch, so then they are
+# matched one at a time instead: the failures are logged and come back as None, the rest as usual.
+def match_scenarios(test_scenarios, profiles, top_k=5, encoded=None, workers=1, metrics=NO_METRICS,
+                    weights=BATCH_WEIGHTS, pool=None):
+    if pool is not None:
+        encoded = pool.encoded
+    if encoded is None:
+        with metrics.stage("preprocess"):
+            encoded = encode_profiles(profiles)
+    try:
+        return find_best_buddies_batch(test_scenarios, profiles, top_k=top_k, encoded=encoded, workers=workers,
+                                       metrics=metrics, weights=weights, pool=pool)
+    except Exception as e:
+        logger.warning(f"Batch matching failed ({e}); matching the scenarios one at a time")
+    results = []
+    for i in test_scenarios.index:
+        try:
+            results.append(find_best_buddies(test_scenarios.loc[i, REQUEST_KEYS], profiles, encoded, top_k=top_k,
+                                             metrics=metrics, weights=weights))
+        except Exception as e:
+            logger.error(f"Error processing scenario {i + 1}: {e}")
+            results.append(None)
+    return results
 
 # Main function to process each scenario and log results
-def evaluate_metrics(test_scenarios, profiles):
+def evaluate_metrics(test_scenarios, profiles, top_k=5, workers=1, metrics=NO_METRICS, weights=BATCH_WEIGHTS):
     metrics_log = []
-    for i, request in test_scenarios.iterrows():
-        try:
-            logger.info(f"Processing scenario {i + 1} with request: {request.to_dict()}")
-            top_buddies_indices = find_best_buddies(request, profiles)
-            detailed_top_buddies = profiles.loc[top_buddies_indices]
-
-            # Log the scenario results for metrics tracking
-            top_buddy_scores = [score for idx, score in enumerate(top_buddies_indices)]
-            metrics_log.append({
-                "Scenario": i + 1,
-                "Data Size": len(top_buddies_indices),
-                "Top Buddy Scores": top_buddy_scores,
-            })
-            
-            # Display top matching buddies for each scenario
-            display_columns = ["Buddy_id", "Destination", "User Language", "Local Language", "Keywords", "Event", "Package"]
-            print(f"\nTop Matching Buddies for Scenario {i + 1} (Detailed View):")
+    all_top_indices = match_scenarios(test_scenarios, profiles, top_k=top_k, workers=workers, metrics=metrics,
+                                      weights=weights)
+    # Building each scenario's dict for the log is only worth it when debug logging is on
+    debug = logger.isEnabledFor(logging.DEBUG)
+    with metrics.stage("serialize"):
+        for i, top_buddies_indices in zip(test_scenarios.index, all_top_indices):
+            if top_buddies_indices is None:
+                continue  # failed to match, already logged
             try:
-                print(detailed_top_buddies[display_columns])
-            except KeyError as e:
-                logger.warning(f"Error displaying detailed columns: {e}")
-                print("Available columns in buddy profiles:", detailed_top_buddies.columns.tolist())
+                logger.info("Processing scenario %d", i + 1)
+                if debug:
+                    logger.debug("Scenario %d request: %s", i + 1, test_scenarios.loc[i].to_dict())
+                detailed_top_buddies = profiles.loc[top_buddies_indices]
 
-        except Exception as e:
-            logger.error(f"Error processing scenario {i + 1}: {e}")
+                # Log the scenario results for metrics tracking
+                top_buddy_scores = [score for idx, score in enumerate(top_buddies_indices)]
+                metrics_log.append({
+                    "Scenario": i + 1,
+                    "Data Size": len(top_buddies_indices),
+                    "Top Buddy Scores": top_buddy_scores,
+                })
+            
+                # Display top matching buddies for each scenario
+                display_columns = ["Buddy_id", "Destination", "User Language", "Local Language", "Keywords", "Event", "Package"]
+                print(f"\nTop Matching Buddies for Scenario {i + 1} (Detailed View):")
+                try:
+                    print(detailed_top_buddies[display_columns])
+                except KeyError as e:
+                    logger.warning(f"Error displaying detailed columns: {e}")
+                    print("Available columns in buddy profiles:", detailed_top_buddies.columns.tolist())
+
+            except Exception as e:
+                logger.error(f"Error processing scenario {i + 1}: {e}")
 
-    # Convert metrics log to DataFrame for review
-    metrics_df = pd.DataFrame(metrics_log)
-    print("\nPerformance Metrics for Test Scenarios:")
-    print(metrics_df)
+        # Convert metrics log to DataFrame for review
+        metrics_df = pd.DataFrame(metrics_log)
+        print("\nPerformance Metrics for Test Scenarios:")
+        print(metrics_df)
     return metrics_df
 
+# Streaming variant of evaluate_metrics: yields one metrics row per scenario, reading scenario chunks
+# lazily and matching each chunk as it arrives, so memory stays flat however many scenarios there are.
+# With workers > 1 one process pool, sharing one copy of the profiles, serves every chunk.
+def iter_scenario_metrics(scenario_chunks, profiles, top_k=5, encoded=None, workers=1, metrics=NO_METRICS,
+                          weights=BATCH_WEIGHTS):
+    if encoded is None:
+        with metrics.stage("preprocess"):
+            encoded = encode_profiles(profiles)
+    pool = ProfilePool(encoded, workers) if workers > 1 else None
+    try:
+        scenario_number = 0
+        for chunk in scenario_chunks:
+            for top_buddies_indices in match_scenarios(chunk, profiles, top_k=top_k, encoded=encoded, metrics=metrics,
+                                                       weights=weights, pool=pool):
+                scenario_number += 1
+                if top_buddies_indices is None:
+                    continue  # failed to match, already logged
+                yield {
+                    "Scenario": scenario_number,
+                    "Data Size": len(top_buddies_indices),
+                    "Top Buddy Scores": list(top_buddies_indices),
+                }
+            logger.info(f"Matched {scenario_number} scenarios")
+    finally:
+        if pool is not None:
+            pool.close()
+
+# Replay a scenario file (CSV, JSONL, Parquet or Excel) into the metrics CSV chunk by chunk,
+# flushing as it goes; returns the number of scenarios written
+def stream_metrics_to_csv(scenario_file, profiles, output_file="buddy_matching_metrics.csv",
+                          chunk_size=10_000, flush_every=1_000, top_k=5, workers=1, metrics=NO_METRICS,
+                          weights=BATCH_WEIGHTS):
+    chunks = iter_scenario_chunks(scenario_file, chunk_size)
+    rows = iter_scenario_metrics(chunks, profiles, top_k=top_k, workers=workers, metrics=metrics, weights=weights)
+    written = write_metric_rows(rows, output_file, flush_every)
+    logger.info(f"Metrics for {written} scenarios streamed to {output_file}")
+    return written
+
 # Save metrics to CSV
 def save_metrics_to_csv(metrics_df, output_file="buddy_matching_metrics.csv"):
     try:
@@ -116,17 +312,21 @@ def save_metrics_to_csv(metrics_df, output_file="buddy_matching_metrics.csv"):
 
 # Main function to run the entire process
 def main():
-    buddy_profiles, test_scenarios = load_data()
-    buddy_profiles_expanded = preprocess_data(buddy_profiles)
+    # Per-stage timings and candidate counts for this run, logged at the end
+    stage_metrics = StageMetrics()
+    buddy_profiles, test_scenarios = load_data(metrics=stage_metrics)
+    buddy_profiles_expanded = preprocess_data(buddy_profiles, metrics=stage_metrics)
     
     # Split into train and test set
     train_profiles, test_profiles = split_data(buddy_profiles_expanded)
     
     # Process scenarios and log metrics cumulatively
-    metrics_log = evaluate_metrics(test_scenarios, train_profiles)
+    metrics_log = evaluate_metrics(test_scenarios, train_profiles, metrics=stage_metrics)
     
     # Save cumulative metrics to CSV
-    save_metrics_to_csv(metrics_log)
+    with stage_metrics.stage("serialize"):
+        save_metrics_to_csv(metrics_log)
+    logger.info("Stage metrics: %s", stage_metrics.as_dict())
 
 # Run the main function
 if __name__ == "__main__":
@@ -0,0 +1,605 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from api_mount import load_api_matcher
+from batch_processing import build_partitions, evaluate_metrics, find_best_buddies, find_best_buddies_batch, preprocess_data
+from scoring_engine import encode_profiles
+
+# Profile-table sizes the size sweep runs at by default
+SWEEP_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+DESTINATIONS = ["Los Angeles", "New Delhi", "Tokyo", "Paris", "Berlin", "Sydney", "Rome", "Cairo", "Lima", "Seoul"]
+LANGUAGES = ["English", "Spanish", "Hindi", "Japanese", "French", "German", "Italian", "Arabic", "Korean"]
+KEYWORDS = ["shopping", "food", "art", "culture", "history", "technology", "anime", "fashion", "music", "nightlife", "hiking", "beach"]
+EVENTS = ["City Tour", "Cultural Tour", "Tech Expo", "Food Festival", "Concert", "Museum Visit"]
+PACKAGES = ["Solo Traveler Buddy", "Shopping Enthusiast Buddy", "Foodie Buddy", "Adventure Buddy"]
+
+
+# Random profile table shaped like Dummy-Buddy-Profiles-Batch1.xlsx
+def make_profiles(n, seed=0, destinations=DESTINATIONS):
+    rng = np.random.default_rng(seed)
+    keyword_counts = rng.integers(1, 4, size=n)
+    keywords = [",".join(rng.choice(KEYWORDS, size=count, replace=False)) for count in keyword_counts]
+    return pd.DataFrame({
+        "Buddy_id": np.arange(1, n + 1),
+        "Destination": rng.choice(destinations, size=n),
+        "User Language": rng.choice(LANGUAGES, size=n),
+        "Local Language": rng.choice(LANGUAGES, size=n),
+        "Keywords": keywords,
+        "Event": rng.choice(EVENTS, size=n),
+        "Package": rng.choice(PACKAGES, size=n),
+    })
+
+
+# A single request in the shape of a Buddy-Matching-Test-Scenarios.xlsx row
+def make_request(seed=1, destinations=DESTINATIONS):
+    rng = np.random.default_rng(seed)
+    return pd.Series({
+        "destination": rng.choice(destinations),
+        "language": rng.choice(LANGUAGES),
+        "local_language": rng.choice(LANGUAGES),
+        "keywords": ",".join(rng.choice(KEYWORDS, size=2, replace=False)),
+        "event": rng.choice(EVENTS),
+        "package": rng.choice(PACKAGES),
+    })
+
+
+# n scenarios shaped like Buddy-Matching-Test-Scenarios.xlsx, drawn column-wise
+def make_scenarios(n, seed=1, destinations=DESTINATIONS):
+    rng = np.random.default_rng(seed)
+    keywords = [",".join(pair) for pair in (rng.choice(KEYWORDS, size=2, replace=False) for _ in range(n))]
+    return pd.DataFrame({
+        "destination": rng.choice(destinations, size=n),
+        "language": rng.choice(LANGUAGES, size=n),
+        "local_language": rng.choice(LANGUAGES, size=n),
+        "keywords": keywords,
+        "event": rng.choice(EVENTS, size=n),
+        "package": rng.choice(PACKAGES, size=n),
+    })
+
+
+# Buddy table rows (the API model's columns) for a synthetic profile table: the buddy speaks
+# its user language and, when different, the local language
+def make_buddy_rows(profiles):
+    languages = np.where(profiles["User Language"] == profiles["Local Language"], profiles["User Language"],
+                         profiles["User Language"] + "," + profiles["Local Language"])
+    return [
+        {"name": f"Buddy {buddy_id}", "destination": destination, "language": language, "keywords": keywords,
+         "event": event, "package": package}
+        for buddy_id, destination, language, keywords, event, package in zip(
+            profiles["Buddy_id"], profiles["Destination"], languages, profiles["Keywords"],
+            profiles["Event"], profiles["Package"])
+    ]
+
+
+# A scenario row as the BuddySearchRequest match_buddies takes
+def as_search_request(scenario):
+    return SimpleNamespace(destination=scenario["destination"], language=scenario["language"],
+                           keywords=scenario["keywords"], event=scenario["event"], package=scenario["package"])
+
+
+# The original iterrows matcher, kept as the baseline to measure against
+def legacy_find_best_buddies(request, profiles):
+    matching_scores = []
+    for idx, profile in profiles.iterrows():
+        score = 0
+        if request['destination'] == profile.get('Destination'):
+            score += 20
+        if request['language'] == profile.get('User Language'):
+            score += 20
+        if request['local_language'] == profile.get('Local Language'):
+            score += 20
+        request_keywords = str(request['keywords']).split(',') if pd.notna(request['keywords']) else []
+        profile_keywords = str(profile.get('Keywords', '')).split(',') if pd.notna(profile.get('Keywords')) else []
+        for keyword in request_keywords:
+            if keyword in profile_keywords:
+                score += 20
+        if request['event'] == profile.get('Event'):
+            score += 10
+        if request['package'] == profile.get('Package'):
+            score += 10
+        matching_scores.append((idx, score))
+    top_matches = sorted(matching_scores, key=lambda x: x[1], reverse=True)[:5]
+    return [idx for idx, score in top_matches]
+
+
+def _best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Compare the iterrows matcher with the vectorized one across profile-table sizes.
+# The iterrows loop is linear in the row count, so above max_legacy_rows it is timed
+# on a slice of that size and scaled up (reported as extrapolated).
+def bench_find_best_buddies(sizes=(10_000, 100_000, 1_000_000), max_legacy_rows=100_000, repeat=3):
+    request = make_request()
+    results = []
+    for n in sizes:
+        profiles = make_profiles(n)
+
+        start = time.perf_counter()
+        encoded = encode_profiles(profiles)
+        encode_seconds = time.perf_counter() - start
+        vectorized_seconds, top = _best_time(lambda: find_best_buddies(request, profiles, encoded), repeat)
+
+        legacy_rows = min(n, max_legacy_rows)
+        legacy_seconds, legacy_top = _best_time(lambda: legacy_find_best_buddies(request, profiles.iloc[:legacy_rows]), 1)
+        if legacy_rows == n and legacy_top != top:
+            raise AssertionError(f"Top matches differ at n={n}: {legacy_top} != {top}")
+        legacy_seconds *= n / legacy_rows
+
+        results.append({
+            "profiles": n,
+            "encode_s": encode_seconds,
+            "legacy_s": legacy_seconds,
+            "legacy_extrapolated": legacy_rows < n,
+            "vectorized_s": vectorized_seconds,
+            "speedup": legacy_seconds / vectorized_seconds,
+        })
+    return results
+
+
+# Per-scenario matching versus the chunked scenarios x profiles batch path used by evaluate_metrics
+def bench_evaluate_batch(n_profiles=100_000, n_scenarios=2_000, repeat=1):
+    profiles = make_profiles(n_profiles)
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(n_scenarios)])
+    encoded = encode_profiles(profiles)
+
+    per_request_seconds, expected = _best_time(
+        lambda: [find_best_buddies(request, profiles, encoded) for _, request in scenarios.iterrows()], repeat)
+    batch_seconds, top = _best_time(lambda: find_best_buddies_batch(scenarios, profiles, encoded=encoded), repeat)
+    if top != expected:
+        raise AssertionError("Batch and per-scenario top matches differ")
+
+    return [{
+        "profiles": n_profiles,
+        "scenarios": n_scenarios,
+        "per_request_s": per_request_seconds,
+        "batch_s": batch_seconds,
+        "speedup": per_request_seconds / batch_seconds,
+    }]
+
+
+# Full-table scoring versus trying the request's destination partition first, under the batch and
+# the API weights. Both return the same matches; the block only stands alone when its k-th best beats
+# any profile outside it, so the gain depends on how much the destination is worth.
+def bench_partitioned(n_profiles=1_000_000, n_destinations=200, n_requests=50):
+    from keyword_scoring import API_WEIGHTS, BATCH_WEIGHTS
+    destinations = [f"City {i}" for i in range(n_destinations)]
+    profiles = make_profiles(n_profiles, destinations=destinations)
+    requests = [make_request(seed=s, destinations=destinations) for s in range(n_requests)]
+    encoded = encode_profiles(profiles)
+    partitions = build_partitions(profiles)
+
+    results = []
+    for label, weights in (("batch", BATCH_WEIGHTS), ("api", API_WEIGHTS)):
+        full_seconds, expected = _best_time(
+            lambda: [find_best_buddies(r, profiles, encoded, weights=weights) for r in requests], 1)
+        partitioned_seconds, partitioned = _best_time(
+            lambda: [find_best_buddies(r, profiles, encoded, partitions, weights=weights) for r in requests], 1)
+        assert partitioned == expected, "partitioned scoring diverged from full-table scoring"
+        results.append({
+            "profiles": n_profiles,
+            "destinations": n_destinations,
+            "weights": label,
+            "full_ms_per_request": 1000 * full_seconds / n_requests,
+            "partitioned_ms_per_request": 1000 * partitioned_seconds / n_requests,
+            "speedup": full_seconds / partitioned_seconds,
+        })
+    return results
+
+
+# Exhaustive scoring versus upper-bound pruning (find_best_buddies(prune=True)), over the whole table
+# and over destination partitions; both must return the same matches
+def bench_pruned(n_profiles=1_000_000, n_requests=50, top_k=10):
+    profiles = make_profiles(n_profiles)
+    requests = [make_request(seed=s) for s in range(n_requests)]
+    encoded = encode_profiles(profiles)
+    partitions = build_partitions(profiles)
+
+    results = []
+    for label, block in (("full", None), ("partitioned", partitions)):
+        exhaustive_seconds, expected = _best_time(
+            lambda: [find_best_buddies(r, profiles, encoded, block, top_k) for r in requests], 1)
+        pruned_seconds, pruned = _best_time(
+            lambda: [find_best_buddies(r, profiles, encoded, block, top_k, prune=True) for r in requests], 1)
+        assert pruned == expected, "pruned scoring diverged from exhaustive scoring"
+        results.append({
+            "profiles": n_profiles,
+            "candidates": label,
+            "exhaustive_ms_per_request": 1000 * exhaustive_seconds / n_requests,
+            "pruned_ms_per_request": 1000 * pruned_seconds / n_requests,
+            "speedup": exhaustive_seconds / pruned_seconds,
+        })
+    return results
+
+
+# Private (unshared) bytes of this process, from /proc/self/smaps_rollup
+def _private_bytes():
+    with open("/proc/self/smaps_rollup") as rollup:
+        fields = dict(line.split(":", 1) for line in rollup if ":" in line)
+    return sum(int(fields[field].split()[0]) * 1024 for field in ("Private_Clean", "Private_Dirty"))
+
+
+def _match_in_worker(job):
+    source, n_profiles, n_requests = job
+    baseline = _private_bytes()
+    if source == "copy":
+        profiles = make_profiles(n_profiles).set_index("Buddy_id", drop=False)
+        encoded, partitions = encode_profiles(profiles), build_partitions(profiles)
+        render = lambda labels: profiles.loc[labels, ["Buddy_id", "Keywords"]].to_dict("records")
+    else:
+        from shared_profiles import SharedProfiles
+        index = SharedProfiles(source).current()
+        encoded, partitions = index.encoded, index.partitions
+        render = lambda labels: index.records(labels, ["Buddy_id", "Keywords"])
+    rendered = [render(find_best_buddies(make_request(seed=s), None, encoded, partitions, top_k=10))
+                for s in range(n_requests)]
+    return _private_bytes() - baseline, rendered
+
+
+# Per-worker private memory when every worker process encodes its own copy of the profiles versus
+# mapping one shared generation file (shared_profiles); both must render the same matches
+def bench_shared_store(n_profiles=1_000_000, workers=4, n_requests=20):
+    import multiprocessing
+    import tempfile
+    from shared_profiles import publish_profiles
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        return []
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        publish_profiles(directory, make_profiles(n_profiles).set_index("Buddy_id", drop=False),
+                         columns=["Buddy_id", "Keywords"])
+        outputs = {}
+        for source in ("copy", directory):
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                outputs[source] = pool.map(_match_in_worker, [(source, n_profiles, n_requests)] * workers)
+            results.append({
+                "profiles": n_profiles,
+                "workers": workers,
+                "store": "per-worker copy" if source == "copy" else "shared mmap",
+                "private_mib_per_worker": np.mean([private for private, _ in outputs[source]]) / 2 ** 20,
+            })
+        if [rendered for _, rendered in outputs["copy"]] != [rendered for _, rendered in outputs[directory]]:
+            raise AssertionError("Shared profile store rendered different matches")
+    return results
+
+
+# Matching a popular destination and rendering every match as JSON: match_buddies' ORM objects
+# turned into dicts for json.dumps, versus match_page from column rows; then page 2 by cursor
+def bench_serialization(n_profiles=100_000, page_size=50, seed=0, package=None):
+    matching_algorithm, models = load_api_matcher(package)
+    logging.getLogger(matching_algorithm.__name__).setLevel(logging.WARNING)
+    db = sqlite_session(models, n_profiles, seed)
+    request = SimpleNamespace(destination=DESTINATIONS[0], language="English", keywords="", event="", package="")
+    fields = matching_algorithm.BUDDY_RESPONSE_FIELDS
+
+    def orm_body():
+        db.expunge_all()
+        buddies = matching_algorithm.match_buddies(db, request)
+        return json.dumps([{field: getattr(buddy, field) for field in fields} for buddy in buddies]).encode()
+
+    def page_body(**options):
+        db.expunge_all()
+        return matching_algorithm.match_page(db, request, **options)
+
+    orm_seconds, expected = _best_time(orm_body, 3)
+    page_seconds, body = _best_time(lambda: page_body(limit=n_profiles), 3)
+    if json.loads(body)["matches"] != json.loads(expected):
+        raise AssertionError("match_page rendered different matches")
+    cursors = matching_algorithm.CursorStore()
+    first_seconds, first = _best_time(lambda: page_body(cursors=cursors, limit=page_size), 3)
+    cursor = json.loads(first)["next_cursor"]
+    next_seconds, _ = _best_time(
+        lambda: matching_algorithm.match_page(db, cursors=cursors, cursor=cursor, limit=page_size), 3)
+    matches = len(json.loads(expected))
+    return [
+        {"path": "match_buddies + json.dumps", "matches": matches, "ms": 1000 * orm_seconds},
+        {"path": "match_page, every match", "matches": matches, "ms": 1000 * page_seconds},
+        {"path": f"match_page, first {page_size}", "matches": page_size, "ms": 1000 * first_seconds},
+        {"path": f"match_page, next {page_size} by cursor", "matches": page_size, "ms": 1000 * next_seconds},
+    ]
+
+
+# evaluate_metrics matching throughput for 1, 2, 4, ... up to max_workers processes
+def bench_parallel_scaling(n_profiles=200_000, n_scenarios=4_000, max_workers=None):
+    max_workers = max_workers or os.cpu_count()
+    profiles = preprocess_data(make_profiles(n_profiles))
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(n_scenarios)])
+    encoded = encode_profiles(profiles)
+
+    worker_counts = sorted({1, max_workers} | {2 ** p for p in range(max_workers.bit_length()) if 2 ** p <= max_workers})
+    results = []
+    expected = None
+    for workers in worker_counts:
+        seconds, top = _best_time(
+            lambda: find_best_buddies_batch(scenarios, profiles, encoded=encoded, workers=workers), 1)
+        if expected is None:
+            expected = top
+        elif top != expected:
+            raise AssertionError(f"Results with {workers} workers differ from 1 worker")
+        results.append({
+            "workers": workers,
+            "seconds": seconds,
+            "scenarios_per_s": n_scenarios / seconds,
+            "speedup": results[0]["seconds"] / seconds if results else 1.0,
+        })
+    return results
+
+
+# Latency samples (seconds) of func(i) for i in range(repeat)
+def _latencies(func, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Peak bytes Python and numpy allocate while func runs (a separate, untimed run under tracemalloc)
+def _peak_bytes(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _record(benchmark, rows, samples, peak_bytes, **extra):
+    return {
+        "benchmark": benchmark,
+        "rows": rows,
+        "p50_ms": 1000 * float(np.median(samples)),
+        "min_ms": 1000 * min(samples),
+        "peak_mib": peak_bytes / 2 ** 20,
+        **extra,
+    }
+
+
+# find_best_buddies latency and peak memory per request, against an encoded table of n profiles
+def bench_find_best_buddies_sweep(sizes=SWEEP_SIZES, repeat=5, seed=0):
+    results = []
+    for n in sizes:
+        profiles = preprocess_data(make_profiles(n, seed=seed))
+        scenarios = make_scenarios(repeat, seed=seed + 1)
+        encode_seconds, encoded = _best_time(lambda: encode_profiles(profiles), 1)
+        samples = _latencies(lambda i: find_best_buddies(scenarios.iloc[i], profiles, encoded), repeat)
+        peak = _peak_bytes(lambda: find_best_buddies(scenarios.iloc[0], profiles, encoded))
+        results.append(_record("find_best_buddies", n, samples, peak, encode_s=encode_seconds))
+    return results
+
+
+# evaluate_metrics end to end (encode, batch match, per-scenario report) for n_scenarios scenarios
+def bench_evaluate_metrics_sweep(sizes=SWEEP_SIZES, n_scenarios=200, repeat=1, seed=0):
+    results = []
+    for n in sizes:
+        profiles = preprocess_data(make_profiles(n, seed=seed))
+        scenarios = make_scenarios(n_scenarios, seed=seed + 1)
+
+        def run(_=None):
+            # The report it prints is not what is being measured
+            with contextlib.redirect_stdout(io.StringIO()):
+                evaluate_metrics(scenarios, profiles)
+
+        samples = _latencies(run, repeat)
+        peak = _peak_bytes(run)
+        results.append(_record("evaluate_metrics", n, samples, peak, scenarios=n_scenarios,
+                               ms_per_scenario=1000 * float(np.median(samples)) / n_scenarios))
+    return results
+
+
+# A SQLite session holding n synthetic buddies, for the API matcher benchmarks (in memory by
+# default; pass a sqlite:///path url for a database other connections can open too)
+def sqlite_session(models, n, seed=0, batch_size=50_000, url="sqlite://"):
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import Session
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine)
+    db = Session(engine)
+    profiles = make_profiles(n, seed=seed)
+    for start in range(0, n, batch_size):
+        db.execute(insert(models.Buddy), make_buddy_rows(profiles.iloc[start:start + batch_size]))
+    db.commit()
+    return db
+
+
+# match_buddies latency and peak memory per request on SQLite: the default ILIKE path, and with
+# the keyword index and destination partitions built up front
+def bench_match_buddies_sweep(sizes=SWEEP_SIZES, repeat=5, seed=0, package=None):
+    matching_algorithm, models = load_api_matcher(package)
+    logging.getLogger(matching_algorithm.__name__).setLevel(logging.WARNING)
+    results = []
+    for n in sizes:
+        start = time.perf_counter()
+        db = sqlite_session(models, n, seed)
+        load_seconds = time.perf_counter() - start
+        requests = [as_search_request(scenario) for _, scenario in make_scenarios(repeat, seed=seed + 1).iterrows()]
+
+        start = time.perf_counter()
+        keyword_index = matching_algorithm.build_keyword_index(db)
+        partitions = matching_algorithm.build_partitions(db)
+        index_seconds = time.perf_counter() - start
+
+        for benchmark, options in [
+            ("match_buddies", {}),
+            ("match_buddies_indexed", {"keyword_index": keyword_index, "partitions": partitions}),
+        ]:
+            def run(i):
+                db.expunge_all()  # every request loads its buddies afresh, as a new API session would
+                return matching_algorithm.match_buddies(db, requests[i], top_k=10, **options)
+
+            samples = _latencies(run, repeat)
+            peak = _peak_bytes(lambda: run(0))
+            results.append(_record(benchmark, n, samples, peak, load_s=load_seconds,
+                                   index_s=index_seconds if options else 0.0))
+        db.close()
+    return results
+
+
+# match_buddies requests/sec under concurrent load on a SQLite file: the sync path on a thread pool
+# (a Session per request, as a threaded API server runs it) against match_buddies_async on aiosqlite
+# with as many requests in flight. Both use the destination partitions and keyword index.
+def bench_async_throughput(n_profiles=100_000, n_requests=200, concurrency=16, seed=0, package=None):
+    import asyncio
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy.orm import Session
+    matching_algorithm, models = load_api_matcher(package)
+    logging.getLogger(matching_algorithm.__name__).setLevel(logging.WARNING)
+    requests = [as_search_request(scenario) for _, scenario in make_scenarios(n_requests, seed=seed + 1).iterrows()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "buddies.db")
+        db = sqlite_session(models, n_profiles, seed, url=f"sqlite:///{path}")
+        options = {"top_k": 10, "keyword_index": matching_algorithm.build_keyword_index(db),
+                   "partitions": matching_algorithm.build_partitions(db)}
+        engine = db.get_bind()
+        db.close()
+
+        def sync_request(request):
+            with Session(engine) as session:
+                return [buddy.id for buddy in matching_algorithm.match_buddies(session, request, **options)]
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            sync_seconds, sync_results = _best_time(lambda: list(pool.map(sync_request, requests)), 1)
+        engine.dispose()
+
+        async def run_async():
+            sessions = matching_algorithm.create_async_session_factory(
+                f"sqlite+aiosqlite:///{path}", pool_size=concurrency, max_overflow=0)
+            in_flight = asyncio.Semaphore(concurrency)
+
+            async def async_request(request):
+                async with in_flight, sessions() as session:
+                    buddies = await matching_algorithm.match_buddies_async(session, request, **options)
+                    return [buddy.id for buddy in buddies]
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*map(async_request, requests))
+            seconds = time.perf_counter() - start
+            await sessions.kw["bind"].dispose()
+            return seconds, results
+
+        async_seconds, async_results = asyncio.run(run_async())
+
+    if async_results != sync_results:
+        raise AssertionError("match_buddies_async results differ from match_buddies")
+    return [
+        {"path": path_name, "profiles": n_profiles, "concurrency": concurrency, "requests": n_requests,
+         "seconds": seconds, "requests_per_s": n_requests / seconds}
+        for path_name, seconds in [("sync", sync_seconds), ("async", async_seconds)]
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# The size sweep as one JSON-serializable report, tagged with the commit and machine it ran on
+def run_sweep(sizes=SWEEP_SIZES, sql_sizes=SWEEP_SIZES, n_scenarios=200, repeat=5, package=None):
+    results = bench_find_best_buddies_sweep(sizes, repeat)
+    results += bench_evaluate_metrics_sweep(sizes, n_scenarios)
+    results += bench_match_buddies_sweep(sql_sizes, repeat, package=package)
+    return {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+# Benchmarks whose p50 latency or peak memory grew by more than tolerance (0.25 = 25%) over the
+# baseline report; benchmarks missing from either report are skipped
+def compare_reports(baseline, current, tolerance=0.25):
+    before = {(r["benchmark"], r["rows"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = before.get((result["benchmark"], result["rows"]))
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "peak_mib"):
+            if previous[metric] > 0 and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append({
+                    "benchmark": result["benchmark"],
+                    "rows": result["rows"],
+                    "metric": metric,
+                    "baseline": previous[metric],
+                    "current": result[metric],
+                    "change": result[metric] / previous[metric] - 1,
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Buddy matching benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SWEEP_SIZES)
+    parser.add_argument("--sql-sizes", type=int, nargs="+", help="profile counts for match_buddies (default: --sizes)")
+    parser.add_argument("--scenarios", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--api-package", help="package the API's matching_algorithm and models live in")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--comparisons", action="store_true",
+                        help="also run the legacy, batch, partition and parallel comparisons")
+    parser.add_argument("--max-legacy-rows", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight for the async comparison")
+    args = parser.parse_args()
+
+    # Keep the per-scenario INFO lines off the terminal while timing
+    logging.getLogger("batch_processing").setLevel(logging.WARNING)
+    report = run_sweep(args.sizes, args.sql_sizes or args.sizes, args.scenarios, args.repeat, args.api_package)
+    print(pd.DataFrame(report["results"]).to_string(index=False))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.comparisons:
+        print(pd.DataFrame(bench_find_best_buddies(args.sizes, args.max_legacy_rows)).to_string(index=False))
+        print(pd.DataFrame(bench_evaluate_batch(n_scenarios=args.scenarios)).to_string(index=False))
+        print(pd.DataFrame(bench_partitioned()).to_string(index=False))
+        print(pd.DataFrame(bench_pruned()).to_string(index=False))
+        print(pd.DataFrame(bench_shared_store(workers=args.workers)).to_string(index=False))
+        print(pd.DataFrame(bench_parallel_scaling(max_workers=args.workers)).to_string(index=False))
+        print(pd.DataFrame(bench_serialization(package=args.api_package)).to_string(index=False))
+        print(pd.DataFrame(bench_async_throughput(concurrency=args.concurrency, package=args.api_package))
+              .to_string(index=False))
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare_reports(json.load(baseline), report, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {benchmark} rows={rows} {metric}: {baseline:.3f} -> {current:.3f} ({change:+.0%})"
+                  .format(**regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import re
+
+from types import SimpleNamespace
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Table, and_, delete, insert, select, true
+
+# Normalized search keys for the Buddy model, kept in side tables so destination, language and
+# keyword filters become indexed equality lookups instead of leading-wildcard ILIKE scans:
+#
+#   buddy_destinations (buddy_id PK, destination)   lower-cased, whitespace-collapsed destination
+#   buddy_languages    (language, buddy_id)          one row per language in Buddy.language
+#   buddy_keywords     (keyword, buddy_id)           one row per keyword in Buddy.keywords
+#
+# The tables live on the model's own MetaData, so create_all/Alembic autogenerate pick them up.
+
+
+# Lower-case and collapse whitespace, the normal form stored in every lookup table
+def normalize_value(value):
+    return re.sub(r"\s+", " ", value or "").strip().lower()
+
+
+# Split a comma-separated Buddy column into distinct normalized values
+def normalize_list(value):
+    return sorted({item for item in map(normalize_value, (value or "").split(",")) if item})
+
+
+# Define (once per model) and return the three lookup tables
+def lookup_tables(model):
+    metadata = model.metadata
+    if "buddy_destinations" in metadata.tables:
+        return (metadata.tables["buddy_destinations"], metadata.tables["buddy_languages"], metadata.tables["buddy_keywords"])
+
+    buddy_id = f"{model.__tablename__}.id"
+    destinations = Table(
+        "buddy_destinations", metadata,
+        Column("buddy_id", Integer, ForeignKey(buddy_id, ondelete="CASCADE"), primary_key=True),
+        Column("destination", String, nullable=False, index=True),
+    )
+    languages = Table(
+        "buddy_languages", metadata,
+        Column("language", String, primary_key=True),
+        Column("buddy_id", Integer, ForeignKey(buddy_id, ondelete="CASCADE"), primary_key=True),
+        Index("ix_buddy_languages_buddy_id", "buddy_id"),
+    )
+    keywords = Table(
+        "buddy_keywords", metadata,
+        Column("keyword", String, primary_key=True),
+        Column("buddy_id", Integer, ForeignKey(buddy_id, ondelete="CASCADE"), primary_key=True),
+        Index("ix_buddy_keywords_buddy_id", "buddy_id"),
+    )
+    return destinations, languages, keywords
+
+
+# Migration step: create the lookup tables (and their indexes) if they do not exist yet
+def create_lookup_tables(engine, model):
+    model.metadata.create_all(engine, tables=list(lookup_tables(model)))
+
+
+def _lookup_rows(buddy_id, destination, language, keywords):
+    destination_row = {"buddy_id": buddy_id, "destination": normalize_value(destination)}
+    language_rows = [{"buddy_id": buddy_id, "language": item} for item in normalize_list(language)]
+    keyword_rows = [{"buddy_id": buddy_id, "keyword": item} for item in normalize_list(keywords)]
+    return destination_row, language_rows, keyword_rows
+
+
+def _insert_rows(db, tables, buddies):
+    destinations, languages, keywords = tables
+    destination_rows, language_rows, keyword_rows = [], [], []
+    for buddy in buddies:
+        destination_row, buddy_languages, buddy_keywords = _lookup_rows(
+            buddy.id, buddy.destination, buddy.language, buddy.keywords)
+        destination_rows.append(destination_row)
+        language_rows.extend(buddy_languages)
+        keyword_rows.extend(buddy_keywords)
+    for table, rows in ((destinations, destination_rows), (languages, language_rows), (keywords, keyword_rows)):
+        if rows:
+            db.execute(insert(table), rows)
+
+
+# Backfill: rebuild every lookup row from the Buddy table, batch_size buddies at a time
+def backfill_lookup_tables(db, model, batch_size=1000):
+    tables = lookup_tables(model)
+    for table in tables:
+        db.execute(delete(table))
+
+    last_id = None
+    while True:
+        query = select(model.id, model.destination, model.language, model.keywords).order_by(model.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(model.id > last_id)
+        batch = db.execute(query).all()
+        if not batch:
+            break
+        _insert_rows(db, tables, batch)
+        last_id = batch[-1].id
+    db.commit()
+
+
+# Write path: refresh the lookup rows of buddies that were just created or edited (flushed, with ids)
+def sync_lookup_rows(db, model, buddies):
+    tables = lookup_tables(model)
+    buddy_ids = [buddy.id for buddy in buddies]
+    for table in tables:
+        db.execute(delete(table).where(table.c.buddy_id.in_(buddy_ids)))
+    _insert_rows(db, tables, buddies)
+
+
+# The request's whole-value search keys: (destination, languages, keywords), normalized
+def lookup_keys(request):
+    return normalize_value(request.destination), normalize_list(request.language), normalize_list(request.keywords)
+
+
+# The lookup-table match conditions, in the shape of sql_scoring.match_conditions, so the same
+# whole-value tests both filter (lookup_filters) and score (sql_scoring.score_expression):
+#   destination  normalized equality ("paris" no longer matches "North Paris Suburbs")
+#   language     the buddy speaks every requested language, in any order
+#   keywords     one condition per distinct requested keyword the buddy lists
+def lookup_conditions(model, request):
+    destinations, languages, keywords = lookup_tables(model)
+    destination, request_languages, request_keywords = lookup_keys(request)
+    language_conditions = [model.id.in_(select(languages.c.buddy_id).where(languages.c.language == language))
+                           for language in request_languages]
+    return SimpleNamespace(
+        destination=model.id.in_(select(destinations.c.buddy_id).where(destinations.c.destination == destination)),
+        language=and_(*language_conditions) if language_conditions else true(),
+        keywords=[model.id.in_(select(keywords.c.buddy_id).where(keywords.c.keyword == keyword))
+                  for keyword in request_keywords],
+    )
+
+
+# Indexed replacements for the destination/language/keyword ILIKE filters in match_buddies, with the
+# semantics of lookup_conditions; the keyword filter is one IN over every requested keyword
+def lookup_filters(model, request):
+    conditions = lookup_conditions(model, request)
+    filters = [conditions.destination, conditions.language]
+    request_keywords = lookup_keys(request)[2]
+    if request_keywords:
+        keywords = lookup_tables(model)[2]
+        filters.append(model.id.in_(select(keywords.c.buddy_id).where(keywords.c.keyword.in_(request_keywords))))
+    return filters
+
+
+# Python side of lookup_conditions for a loaded buddy, against lookup_keys(request):
+# (destination matches, speaks every language, number of request keywords listed)
+def lookup_matches(buddy, keys):
+    destination, languages, keywords = keys
+    buddy_keywords = set(normalize_list(buddy.keywords))
+    return (normalize_value(buddy.destination) == destination,
+            set(languages) <= set(normalize_list(buddy.language)),
+            sum(keyword in buddy_keywords for keyword in keywords))
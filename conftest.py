@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# The stand-in API's model has the same columns match_buddies reads from the API's Buddy model
+from standin_api import Base, Buddy
+
+BUDDIES = [
+    ("Test One", "Los Angeles", "English,Spanish", "shopping,food,art", "City Tour", "Solo Traveler Buddy"),
+    ("Test Two", "Los Angeles", "English", "food,beach", "Food Festival", "Foodie Buddy"),
+    ("Test Three", "los angeles", "english,spanish", "Art,Museums", "city tour", "solo traveler buddy"),
+    ("Alpha Two", "New Delhi", "Hindi,English", "culture,shopping,history", "Cultural Tour", "Shopping Enthusiast Buddy"),
+    ("Alpha Three", "New Delhi", "Hindi", "food,history", "Food Festival", "Foodie Buddy"),
+    ("Kenji", "Tokyo", "Japanese,English", "technology,anime", "Tech Expo", "Solo Traveler Buddy"),
+    ("Marie", "Paris", "French,English", "art,fashion,history", "Museum Visit", "Solo Traveler Buddy"),
+    ("Pierre", "Paris", "French", "food,nightlife", "City Tour", "Foodie Buddy"),
+    ("Nadia", "North Paris Suburbs", "French,English", "art", "City Tour", "Solo Traveler Buddy"),
+]
+
+
+@pytest.fixture
+def buddy_model():
+    return Buddy
+
+
+# In-memory SQLite session preloaded with BUDDIES (ids 1..n in list order)
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(
+            Buddy(name=name, destination=destination, language=language, keywords=keywords, event=event, package=package)
+            for name, destination, language, keywords, event, package in BUDDIES
+        )
+        session.commit()
+        yield session
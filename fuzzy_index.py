@@ -0,0 +1,212 @@
+import re
+from collections import defaultdict
+
+# Fields the fuzzy index covers. Keyword values are comma-separated lists, indexed keyword by keyword.
+FIELDS = ("destination", "event", "package", "keywords")
+LIST_FIELDS = {"keywords"}
+
+# Minimum trigram similarity (shared trigrams / all trigrams of the two terms) for a fuzzy match;
+# the same default as PostgreSQL's pg_trgm
+DEFAULT_THRESHOLD = 0.3
+
+# Abbreviations and alternative names trigrams cannot bridge. Both request values and indexed values
+# are folded to the group's first term before matching, so "NYC" finds "New York" and vice versa.
+ALIASES = {
+    "destination": {
+        "new york": ["nyc", "new york city", "ny"],
+        "los angeles": ["la", "l.a."],
+        "san francisco": ["sf"],
+        "washington": ["dc", "washington dc", "washington d.c."],
+        "rio de janeiro": ["rio"],
+        "mexico city": ["cdmx"],
+    },
+}
+
+
+# Lower-case and collapse whitespace, the form terms are compared in
+def normalize_term(value):
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+
+# The term's trigrams, pg_trgm style: each word padded with two spaces in front and one behind,
+# so short words and word starts still produce trigrams
+def trigrams(term):
+    grams = set()
+    for word in re.findall(r"\w+", term):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# Trigram index over the distinct values of one field, with the ids of the profiles holding each.
+# Lookups only touch the terms that share a trigram with the query, so their cost grows with the
+# number of distinct values, not with the number of profiles.
+class FuzzyTermIndex:
+    def __init__(self, aliases=None, split=False):
+        self.split = split
+        self.canonical = {}
+        for term, alternatives in (aliases or {}).items():
+            for alternative in [term, *alternatives]:
+                self.canonical[normalize_term(alternative)] = normalize_term(term)
+        self.grams = defaultdict(set)     # trigram -> terms containing it
+        self.gram_counts = {}             # term -> number of distinct trigrams
+        self.raw_values = {}              # term -> raw spellings seen for it, first seen first
+        self.postings = defaultdict(set)  # term -> profile ids
+        self.profile_terms = {}           # profile id -> terms, for removal
+
+    def __len__(self):
+        return len(self.gram_counts)
+
+    def _terms(self, value):
+        if value is None or value != value:  # None or NaN
+            return []
+        values = str(value).split(",") if self.split else [value]
+        terms = []
+        for raw in values:
+            term = normalize_term(raw)
+            if term:
+                terms.append((self.canonical.get(term, term), raw))
+        return terms
+
+    def _add_term(self, term, raw):
+        if term in self.gram_counts:
+            if raw not in self.raw_values[term]:
+                self.raw_values[term].append(raw)
+            return
+        grams = trigrams(term)
+        for gram in grams:
+            self.grams[gram].add(term)
+        self.gram_counts[term] = len(grams)
+        self.raw_values[term] = [raw]
+
+    def _drop_term(self, term):
+        for gram in trigrams(term):
+            self.grams[gram].discard(term)
+            if not self.grams[gram]:
+                del self.grams[gram]
+        del self.gram_counts[term]
+        del self.raw_values[term]
+
+    # Make the field's values searchable without tying them to profiles (see closest)
+    def add_values(self, values):
+        for value in values:
+            for term, raw in self._terms(value):
+                self._add_term(term, raw)
+
+    # Index a new profile, or re-index an existing one with its current value
+    def add(self, profile_id, value):
+        self.remove(profile_id)
+        terms = set()
+        for term, raw in self._terms(value):
+            self._add_term(term, raw)
+            self.postings[term].add(profile_id)
+            terms.add(term)
+        self.profile_terms[profile_id] = terms
+
+    # Drop a profile; terms no profile holds any more leave the index. Unknown ids are ignored.
+    def remove(self, profile_id):
+        for term in self.profile_terms.pop(profile_id, ()):
+            posting = self.postings[term]
+            posting.discard(profile_id)
+            if not posting:
+                del self.postings[term]
+                self._drop_term(term)
+
+    # Indexed terms at least threshold-similar to the query term, as {term: similarity}
+    def similar(self, query, threshold=DEFAULT_THRESHOLD):
+        if query is None or query != query:
+            return {}
+        term = normalize_term(query)
+        term = self.canonical.get(term, term)
+        matches = {term: 1.0} if term in self.gram_counts else {}
+        grams = trigrams(term)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self.grams.get(gram, ()):
+                shared[candidate] += 1
+        for candidate, overlap in shared.items():
+            similarity = overlap / (len(grams) + self.gram_counts[candidate] - overlap)
+            if similarity >= threshold:
+                matches.setdefault(candidate, similarity)
+        return matches
+
+    # The raw indexed value most similar to the query term (ties go to the alphabetically first), or None
+    def closest(self, query, threshold=DEFAULT_THRESHOLD):
+        matches = self.similar(query, threshold)
+        if not matches:
+            return None
+        return self.raw_values[min(matches, key=lambda term: (-matches[term], term))][0]
+
+    # Every raw spelling of the terms similar to the query, e.g. for an equality filter in SQL
+    def spellings(self, query, threshold=DEFAULT_THRESHOLD):
+        return [raw for term in self.similar(query, threshold) for raw in self.raw_values[term]]
+
+    # Ids of profiles holding a term similar to the query, optionally limited to candidates
+    def lookup(self, query, threshold=DEFAULT_THRESHOLD, candidates=None):
+        matched = set()
+        for term in self.similar(query, threshold):
+            posting = self.postings.get(term, set())
+            matched |= posting if candidates is None else posting & candidates
+        return matched
+
+
+# Fuzzy term indexes for the destination, event, package and keywords fields.
+#
+#     index = FuzzyIndex.build(rows)  # (profile_id, destination, event, package, keywords)
+#     index.lookup("destination", "NYC")                  # ids of New York buddies
+#     index.match_counts("keywords", ["musc", "fod"])     # id -> number of request keywords matched
+#
+# Keep it current with add/remove when profiles change, like KeywordIndex and ProfilePartitions.
+class FuzzyIndex:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, aliases=ALIASES):
+        self.threshold = threshold
+        self.fields = {field: FuzzyTermIndex(aliases.get(field), field in LIST_FIELDS) for field in FIELDS}
+
+    # Build an index from (profile_id, destination, event, package, keywords) rows
+    @classmethod
+    def build(cls, profiles, threshold=DEFAULT_THRESHOLD, aliases=ALIASES):
+        index = cls(threshold, aliases)
+        for profile_id, *values in profiles:
+            index.add(profile_id, *values)
+        return index
+
+    # Index over a table's distinct values only (no profile ids), for closest()
+    @classmethod
+    def from_values(cls, values, threshold=DEFAULT_THRESHOLD, aliases=ALIASES):
+        index = cls(threshold, aliases)
+        for field, field_values in values.items():
+            index.fields[field].add_values(field_values)
+        return index
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def add(self, profile_id, destination=None, event=None, package=None, keywords=None):
+        for field, value in zip(FIELDS, (destination, event, package, keywords)):
+            self.fields[field].add(profile_id, value)
+
+    def remove(self, profile_id):
+        for field_index in self.fields.values():
+            field_index.remove(profile_id)
+
+    # Ids of profiles whose field value is similar to the query
+    def lookup(self, field, query, candidates=None):
+        return self.fields[field].lookup(query, self.threshold, candidates)
+
+    # Terms of the field similar to the query, as {term: similarity}
+    def similar(self, field, query):
+        return self.fields[field].similar(query, self.threshold)
+
+    def closest(self, field, query):
+        return self.fields[field].closest(query, self.threshold)
+
+    def spellings(self, field, query):
+        return self.fields[field].spellings(query, self.threshold)
+
+    # Number of the given terms each profile has a similar value for, for profiles matching at least one
+    def match_counts(self, field, terms, candidates=None):
+        counts = defaultdict(int)
+        for term in terms:
+            for profile_id in self.lookup(field, term, candidates):
+                counts[profile_id] += 1
+        return dict(counts)
@@ -0,0 +1,92 @@
+import re
+from collections import defaultdict
+
+# Keywords that should match each other; every term in a group is indexed under the group's first term
+SYNONYMS = {
+    "weed": ["420 friendly", "cannabis"],
+    "music": ["nightlife", "concert"],
+    # Add more synonym mappings here if needed
+}
+
+
+# Lower-case and collapse whitespace so " Street  Food" and "street food" are the same keyword
+def normalize_keyword(keyword):
+    return re.sub(r"\s+", " ", str(keyword)).strip().lower()
+
+
+# Split a comma-separated keyword string (or an iterable of keywords) into normalized, non-empty terms
+def parse_keywords(keywords):
+    if keywords is None:
+        return []
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    terms = (normalize_keyword(keyword) for keyword in keywords)
+    return [term for term in terms if term]
+
+
+# Inverted index from normalized keyword (synonyms folded together) to the ids of profiles that list it
+class KeywordIndex:
+    def __init__(self, synonyms=SYNONYMS):
+        self.canonical = {}
+        for keyword, alternatives in synonyms.items():
+            group = normalize_keyword(keyword)
+            for term in [keyword, *alternatives]:
+                self.canonical[normalize_keyword(term)] = group
+        self.postings = defaultdict(set)  # canonical keyword -> profile ids
+        self.profile_terms = {}           # profile id -> canonical keywords, for removal
+
+    # Build an index from (profile_id, keywords) pairs
+    @classmethod
+    def build(cls, profiles, synonyms=SYNONYMS):
+        index = cls(synonyms)
+        for profile_id, keywords in profiles:
+            index.add(profile_id, keywords)
+        return index
+
+    def __len__(self):
+        return len(self.profile_terms)
+
+    def __contains__(self, profile_id):
+        return profile_id in self.profile_terms
+
+    # Map keywords to their canonical synonym-group terms, dropping duplicates but keeping order
+    def expand(self, keywords):
+        return list(dict.fromkeys(self.canonical.get(term, term) for term in parse_keywords(keywords)))
+
+    # Index a new profile, or re-index an existing one with its current keywords
+    def add(self, profile_id, keywords):
+        self.remove(profile_id)
+        terms = frozenset(self.expand(keywords))
+        for term in terms:
+            self.postings[term].add(profile_id)
+        self.profile_terms[profile_id] = terms
+
+    # Drop a profile from every posting list it appears in; unknown ids are ignored
+    def remove(self, profile_id):
+        for term in self.profile_terms.pop(profile_id, ()):
+            posting = self.postings[term]
+            posting.discard(profile_id)
+            if not posting:
+                del self.postings[term]
+
+    # Ids of profiles listing the keyword or one of its synonyms
+    def lookup(self, keyword):
+        term = normalize_keyword(keyword)
+        return self.postings.get(self.canonical.get(term, term), set())
+
+    # Ids of profiles sharing at least one keyword with the request, optionally limited to candidates
+    def matching(self, keywords, candidates=None):
+        matched = set()
+        for term in self.expand(keywords):
+            posting = self.postings.get(term, set())
+            matched |= posting if candidates is None else posting & candidates
+        return matched
+
+    # Number of request keywords each profile shares, for profiles sharing at least one
+    def match_counts(self, keywords, candidates=None):
+        counts = defaultdict(int)
+        for term in self.expand(keywords):
+            posting = self.postings.get(term, set())
+            for profile_id in (posting if candidates is None else posting & candidates):
+                counts[profile_id] += 1
+        return dict(counts)
@@ -0,0 +1,183 @@
+import json
+import re
+
+import numpy as np
+from scipy import sparse
+
+# How keyword matches turn into points: "each" scores every request keyword the profile lists,
+# "any" scores once if the profile lists at least one
+KEYWORD_MODES = ("each", "any")
+
+
+# Points per matched field. The batch matcher and the API matcher read their weights from one of
+# these instead of hardcoding them, so both award the same points per field. They still decide a
+# match differently (the batch matcher compares values and comma tokens exactly, match_buddies
+# filters on substrings), so only rankings on destination and keywords are known to agree.
+class ScoringWeights:
+    FIELDS = ("destination", "language", "local_language", "keywords", "event", "package")
+
+    def __init__(self, destination=0, language=0, local_language=0, keywords=0, event=0, package=0,
+                 keyword_mode="each"):
+        if keyword_mode not in KEYWORD_MODES:
+            raise ValueError(f"keyword_mode must be one of {KEYWORD_MODES}, not {keyword_mode!r}")
+        self.destination = destination
+        self.language = language
+        self.local_language = local_language
+        self.keywords = keywords
+        self.event = event
+        self.package = package
+        self.keyword_mode = keyword_mode
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)}" for field in self.FIELDS)
+        return f"ScoringWeights({fields}, keyword_mode={self.keyword_mode!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, ScoringWeights) and self.as_dict() == other.as_dict()
+
+    def as_dict(self):
+        return {**{field: getattr(self, field) for field in self.FIELDS}, "keyword_mode": self.keyword_mode}
+
+    @classmethod
+    def from_dict(cls, values):
+        unknown = set(values) - set(cls.FIELDS) - {"keyword_mode"}
+        if unknown:
+            raise ValueError(f"Unknown scoring fields: {sorted(unknown)}")
+        return cls(**values)
+
+
+# find_best_buddies: every field worth the same 20, event and package 10, 20 per shared keyword
+BATCH_WEIGHTS = ScoringWeights(destination=20, language=20, local_language=20, keywords=20, event=10, package=10,
+                               keyword_mode="each")
+
+# match_buddies: destination 50, language 30, 10 for any shared keyword, event and package 5
+API_WEIGHTS = ScoringWeights(destination=50, language=30, keywords=10, event=5, package=5, keyword_mode="any")
+
+
+# Weights from a JSON file of field -> points (plus an optional keyword_mode), e.g.
+#   {"destination": 50, "language": 30, "keywords": 10, "event": 5, "package": 5, "keyword_mode": "each"}
+def load_weights(path):
+    with open(path) as weights_file:
+        return ScoringWeights.from_dict(json.load(weights_file))
+
+
+# Lower-case, trimmed, whitespace-collapsed keyword terms of a comma-separated string
+def normalized_terms(value):
+    if value is None or value != value:  # None or NaN
+        return []
+    terms = (re.sub(r"\s+", " ", term).strip().lower() for term in str(value).split(","))
+    return [term for term in terms if term]
+
+
+# Profile keywords as a CSR matrix (profiles x vocabulary, 1 where the profile lists the keyword).
+# Scoring a request is one sparse mat-vec over the matrix, or over a block of its rows.
+# Matrices looked up by id are kept current with add/remove: a changed profile's row is zeroed in
+# place and its terms held beside the matrix until the next rebuild.
+class KeywordMatrix:
+    def __init__(self, matrix, vocabulary, row_ids=None, tokenize=normalized_terms):
+        self.matrix = matrix          # CSR, int32
+        self.vocabulary = vocabulary  # keyword term -> column
+        self.row_ids = row_ids        # profile id per row, when rows are looked up by id
+        self.tokenize = tokenize
+        self.added = {}               # profile id -> keyword terms, for profiles added or edited since
+        self._rows = None             # profile id -> row, built on first use
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    # Matrix for a column of keyword strings. Each distinct string is tokenized once and rows are
+    # gathered by value code; value_codes of -1 (missing values) land on an extra empty row.
+    @classmethod
+    def from_codes(cls, value_codes, distinct_values, tokenize=normalized_terms):
+        vocabulary = {}
+        rows, cols = [], []
+        for value_row, value in enumerate(distinct_values):
+            for term in set(tokenize(value)):
+                rows.append(value_row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+        distinct_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(distinct_values) + 1, len(vocabulary)),
+        )
+        return cls(distinct_matrix[value_codes], vocabulary, tokenize=tokenize)
+
+    # Matrix for (profile id, keywords) pairs, e.g. a query over the buddies table
+    @classmethod
+    def build(cls, profiles, tokenize=normalized_terms):
+        ids, values = [], []
+        for profile_id, keywords in profiles:
+            ids.append(profile_id)
+            values.append(keywords)
+        distinct = {}
+        codes = np.fromiter((distinct.setdefault(value, len(distinct)) for value in values), dtype=np.intp,
+                            count=len(values))
+        keyword_matrix = cls.from_codes(codes, list(distinct), tokenize)
+        keyword_matrix.row_ids = np.asarray(ids)
+        return keyword_matrix
+
+    def _row_index(self):
+        if self._rows is None:
+            self._rows = {profile_id: row for row, profile_id in enumerate(self.row_ids.tolist())}
+        return self._rows
+
+    # Index a new profile, or re-index an existing one with its current keywords
+    def add(self, profile_id, keywords):
+        self.remove(profile_id)
+        self.added[profile_id] = frozenset(self.tokenize(keywords))
+
+    def remove(self, profile_id):
+        self.added.pop(profile_id, None)
+        row = self._row_index().pop(profile_id, None)
+        if row is not None:
+            self.matrix.data[self.matrix.indptr[row]:self.matrix.indptr[row + 1]] = 0
+
+    # Keyword points per profile id for the given ids, from one mat-vec over their rows (and the
+    # terms of profiles added since the build). Ids the matrix does not hold score 0.
+    def scores_by_id(self, terms, weights, profile_ids):
+        rows_by_id = self._row_index()
+        known = [profile_id for profile_id in profile_ids if profile_id in rows_by_id]
+        rows = np.fromiter((rows_by_id[profile_id] for profile_id in known), dtype=np.intp, count=len(known))
+        points = dict(zip(known, self.scores(terms, weights, rows).tolist()))
+        for profile_id in profile_ids:
+            if profile_id in self.added:
+                matches = sum(term in self.added[profile_id] for term in terms)
+                points[profile_id] = int(_points(np.int64(matches), weights))
+        return {profile_id: points.get(profile_id, 0) for profile_id in profile_ids}
+
+    # Ids of the profiles listing at least one of the terms (only among candidates, when given)
+    def matching_ids(self, terms, candidates=None):
+        rows = np.flatnonzero(self.matrix @ self.request_vector(terms))
+        matched = set(self.row_ids[rows].tolist())
+        matched.update(profile_id for profile_id, listed in self.added.items() if not listed.isdisjoint(terms))
+        return matched if candidates is None else matched & candidates
+
+    # How often each vocabulary term appears among the request terms (repeats count repeatedly)
+    def request_vector(self, terms):
+        vector = np.zeros(len(self.vocabulary), dtype=np.int32)
+        for term in terms:
+            column = self.vocabulary.get(term)
+            if column is not None:
+                vector[column] += 1
+        return vector
+
+    # Keyword points of every profile (or of the given rows) for the request terms
+    def scores(self, terms, weights, rows=None):
+        return self.vector_scores(self.request_vector(terms), weights, rows)
+
+    # Keyword points for a request already turned into a vocabulary count vector
+    def vector_scores(self, vector, weights, rows=None):
+        size = len(self) if rows is None else len(rows)
+        if not weights.keywords or not vector.any():
+            return np.zeros(size, dtype=np.int64)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        return _points(matrix @ vector, weights)
+
+    # Keyword points for a block of requests given as a sparse (requests x vocabulary) count matrix
+    def block_scores(self, request_matrix, weights):
+        return _points((request_matrix @ self.matrix.T).toarray(), weights, np.int32)
+
+
+def _points(matches, weights, dtype=np.int64):
+    if weights.keyword_mode == "any":
+        matches = matches > 0
+    return dtype(weights.keywords) * matches.astype(dtype)
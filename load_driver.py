@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+DEFAULT_URL = "http://127.0.0.1:8000/api/book_buddy"
+
+
+# Minimal HTTP/1.1 client over asyncio streams with a pool of keep-alive connections.
+# At most `size` connections are open; requests wait for an idle one instead of reconnecting.
+class PooledHTTPClient:
+    def __init__(self, url, size=16):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or "/"
+        self.size = size
+        self.idle = asyncio.LifoQueue()
+        self.open_connections = 0
+        self.connects = 0
+
+    async def _acquire(self):
+        if self.idle.empty() and self.open_connections < self.size:
+            self.open_connections += 1
+            try:
+                self.connects += 1
+                return await asyncio.open_connection(self.host, self.port)
+            except BaseException:
+                self.open_connections -= 1
+                raise
+        return await self.idle.get()
+
+    def _discard(self, connection):
+        self.open_connections -= 1
+        connection[1].close()
+
+    async def _exchange(self, connection, body):
+        reader, writer = connection
+        writer.write(
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while (chunk_size := int((await reader.readline()).split(b";")[0], 16)):
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readline()
+            await reader.readline()
+            content = b"".join(chunks)
+        else:
+            content = await reader.readexactly(int(headers.get("content-length", 0)))
+        return status, content, headers.get("connection", "").lower() != "close"
+
+    # POST a JSON payload; returns (status code, response bytes). A pooled connection the server
+    # has since closed is retried once on a fresh connection.
+    async def post_json(self, payload):
+        body = json.dumps(payload).encode()
+        for attempt in range(2):
+            connection = await self._acquire()
+            try:
+                status, content, keep_alive = await self._exchange(connection, body)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                self._discard(connection)
+                if attempt:
+                    raise
+                continue
+            if keep_alive:
+                self.idle.put_nowait(connection)
+            else:
+                self._discard(connection)
+            return status, content
+
+    async def close(self):
+        while not self.idle.empty():
+            self._discard(self.idle.get_nowait())
+
+
+# Latency percentiles (nearest rank), throughput and status-code counts for (status, seconds) samples.
+# A status is an HTTP code, or "error" for a request that got no response; errors sort last.
+def summarize(samples, elapsed):
+    latencies = sorted(seconds for _, seconds in samples)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)] * 1000
+
+    return {
+        "requests": len(samples),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(samples) / elapsed if elapsed else None,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "status_codes": dict(sorted(Counter(status for status, _ in samples).items(),
+                                    key=lambda item: (isinstance(item[0], str), item[0]))),
+    }
+
+
+# Payloads from a JSONL corpus: each line is a payload, or an object with a "payload" key
+def read_corpus(path):
+    payloads = []
+    with open(path) as corpus:
+        for line in corpus:
+            if line.strip():
+                record = json.loads(line)
+                payloads.append(record["payload"] if isinstance(record, dict) and "payload" in record else record)
+    return payloads
+
+
+# Fire payloads (repeated `rounds` times) at the endpoint with at most `concurrency` in flight.
+# A request that fails even on retry (refused or reset connection, garbled response) is recorded
+# with status "error" and the time it took, and the run goes on.
+async def replay(payloads, url=DEFAULT_URL, concurrency=16, rounds=1):
+    client = PooledHTTPClient(url, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def send(payload):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                status, _ = await client.post_json(payload)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status = "error"
+            samples.append((status, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(send(payload) for _ in range(rounds) for payload in payloads))
+    finally:
+        await client.close()
+    report = summarize(samples, time.perf_counter() - start)
+    report["connections_opened"] = client.connects
+    return report
+
+
+# What the test functions read from a requests.Response
+class LoadResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _test_cases(test_module):
+    names = [name for name in dir(test_module) if name.startswith("test_case_")]
+    return [getattr(test_module, name) for name in sorted(names, key=lambda name: int(name.rsplit("_", 1)[1]))]
+
+
+# Run the test_case_* functions of a test module concurrently, `rounds` times each, with their
+# send_buddy_request routed through one pooled async client. Every request is timed and every
+# assertion still checked; returns the latency report plus any failures as (test name, message).
+def run_suite_under_load(test_module, url=DEFAULT_URL, concurrency=16, rounds=1):
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    client = PooledHTTPClient(url, concurrency)
+    samples = []
+
+    def send_buddy_request(payload):
+        start = time.perf_counter()
+        status, content = asyncio.run_coroutine_threadsafe(client.post_json(payload), loop).result()
+        samples.append((status, time.perf_counter() - start))
+        return LoadResponse(status, content)
+
+    def run_case(test_case):
+        try:
+            test_case()
+        except AssertionError as e:
+            return test_case.__name__, str(e)
+        return None
+
+    original_send = test_module.send_buddy_request
+    test_module.send_buddy_request = send_buddy_request
+    start = time.perf_counter()
+    try:
+        # The test cases print a lot; keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(concurrency) as pool:
+            outcomes = list(pool.map(run_case, [case for _ in range(rounds) for case in _test_cases(test_module)]))
+    finally:
+        test_module.send_buddy_request = original_send
+        asyncio.run_coroutine_threadsafe(client.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+    report = summarize(samples, time.perf_counter() - start)
+    report["connections_opened"] = client.connects
+    report["failures"] = [outcome for outcome in outcomes if outcome]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load driver for /api/book_buddy")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--corpus", help="JSONL payload corpus; default replays test_buddy_algorithm_expanded.py")
+    parser.add_argument("--standin", action="store_true", help="serve a local stand-in API and load that instead")
+    args = parser.parse_args()
+
+    url = args.url
+    if args.standin:
+        from standin_api import start_standin_server
+        server = start_standin_server()
+        url = "http://%s:%d/api/book_buddy" % server.server_address
+
+    if args.corpus:
+        report = asyncio.run(replay(read_corpus(args.corpus), url, args.concurrency, args.rounds))
+    else:
+        import test_buddy_algorithm_expanded
+        report = run_suite_under_load(test_buddy_algorithm_expanded, url, args.concurrency, args.rounds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
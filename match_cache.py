@@ -0,0 +1,215 @@
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+
+def _lower(value):
+    return (value or "").lower()
+
+
+# Lower-cased, trimmed, whitespace-collapsed: how the lookup-table filters compare destinations
+# (buddy_lookup.normalize_value)
+def _normalized(value):
+    return re.sub(r"\s+", " ", value or "").strip().lower()
+
+
+def _sorted_terms(value):
+    return tuple(sorted({term.strip() for term in _lower(value).split(",") if term.strip()}))
+
+
+# The request keywords as the matcher reads them (request_terms.CompiledRequest.keyword_terms), in
+# sorted order. Empty terms stay (one matches every buddy, like ILIKE '%%') and so do repeats
+# (keyword_mode="each" scores each one); only their order never changes a result.
+def _keyword_terms(value):
+    return tuple(sorted(term.strip() for term in _lower(value).split(","))) if value else ()
+
+
+# Canonical cache key for a BuddySearchRequest plus the match options that change the result.
+# Everything is lower-cased (every filter is case-insensitive) and keywords are sorted.
+# Languages are sorted and destinations normalized only with the lookup-table filters; the ILIKE
+# filters match the strings as written, so there "English,Spanish" and "Spanish,English" (or
+# " Paris" and "Paris") are different requests.
+def cache_key(request, **options):
+    use_lookup_tables = options.get("use_lookup_tables", False)
+    language = _sorted_terms(request.language) if use_lookup_tables else _lower(request.language)
+    destination = _normalized(request.destination) if use_lookup_tables else _lower(request.destination)
+    return (
+        destination,
+        language,
+        _keyword_terms(request.keywords),
+        _lower(request.event),
+        _lower(request.package),
+        tuple(sorted(options.items())),
+    )
+
+
+# Thread-safe LRU + TTL cache of match results (ranked buddy ids), indexed by request destination
+# so a write to one buddy only drops the cached requests that buddy could appear in.
+class MatchCache:
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.by_destination = {}      # lower-cased request destination -> keys
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Cached value for key, or None on a miss or an expired entry
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.by_destination.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        del self.entries[key]
+        keys = self.by_destination[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.by_destination[key[0]]
+
+    # Drop every cached request whose destination filter would match a buddy in this destination.
+    # Destinations are substring-matched (ILIKE '%...%'), so "york" entries go with "New York"; keys
+    # built for the lookup tables hold normalized destinations, matched against the normalized value.
+    def invalidate_destination(self, buddy_destination):
+        spellings = (_lower(buddy_destination), _normalized(buddy_destination))
+        with self.lock:
+            for destination in [d for d in self.by_destination if any(d in spelling for spelling in spellings)]:
+                for key in list(self.by_destination[destination]):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_destination.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class CursorError(LookupError):
+    pass
+
+
+# Ranked id lists behind pagination cursors, so later pages of a match are served without running
+# it again. A cursor is "<token>.<offset>": the token names one stored ranking (kept in a MatchCache,
+# so least recently used and expired rankings are dropped), the offset where the next page starts.
+# A stored ranking is a snapshot: later pages show it as it was, skipping buddies deleted since.
+class CursorStore:
+    def __init__(self, maxsize=1024, ttl=600.0, clock=time.monotonic):
+        self.cache = MatchCache(maxsize, ttl, clock)
+
+    def __len__(self):
+        return len(self.cache)
+
+    # Store a ranking and return the cursor for the given offset into it
+    def save(self, ids, offset):
+        token = secrets.token_urlsafe(12)
+        self.cache.put((token,), ids)
+        return f"{token}.{offset}"
+
+    # The cursor of another offset into the same ranking
+    @staticmethod
+    def advance(cursor, offset):
+        return f"{cursor.rsplit('.', 1)[0]}.{offset}"
+
+    # (ranked ids, offset) for a cursor; CursorError if it is malformed, unknown or expired
+    def resolve(self, cursor):
+        token, _, offset = str(cursor).rpartition(".")
+        if not token or not offset.isdigit():
+            raise CursorError(f"Malformed cursor: {cursor!r}")
+        ids = self.cache.get((token,))
+        if ids is None:
+            raise CursorError("Cursor expired or unknown; run the match again")
+        return ids, int(offset)
+
+
+def _destinations_touched(target):
+    # Current destination plus, for an edit that moved the buddy, the one it had before
+    history = inspect(target).attrs.destination.history
+    return {target.destination, *history.deleted} - {None}
+
+
+# Keep the cache in step with writes to the model: every insert, update or delete invalidates the
+# affected destinations when flushed, and again after commit so a request that read the old rows
+# between flush and commit cannot leave a stale entry behind. Bulk query.update()/delete() skip
+# ORM events; call invalidate_destination (or clear) yourself after those.
+# Returns a function that removes the listeners again.
+def install_invalidation(cache, model):
+    pending_key = ("match_cache_destinations", id(cache))
+
+    def on_write(mapper, connection, target):
+        destinations = _destinations_touched(target)
+        for destination in destinations:
+            cache.invalidate_destination(destination)
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault(pending_key, set()).update(destinations)
+
+    def on_commit(session):
+        for destination in session.info.pop(pending_key, ()):
+            cache.invalidate_destination(destination)
+
+    def on_rollback(session):
+        session.info.pop(pending_key, None)
+
+    listeners = [(model, name, on_write) for name in ("after_insert", "after_update", "after_delete")]
+    listeners += [(Session, "after_commit", on_commit), (Session, "after_rollback", on_rollback)]
+    for target, name, listener in listeners:
+        event.listen(target, name, listener)
+
+    def uninstall():
+        for target, name, listener in listeners:
+            event.remove(target, name, listener)
+
+    return uninstall
+
+
+# Reload cached ids as model instances, in the cached (ranked) order; a primary-key lookup only
+def load_in_order(db, model, ids):
+    buddies = {buddy.id: buddy for buddy in db.query(model).filter(model.id.in_(ids))}
+    return [buddies[buddy_id] for buddy_id in ids if buddy_id in buddies]
+
+
+# load_in_order on an AsyncSession
+async def load_in_order_async(db, model, ids):
+    buddies = {buddy.id: buddy for buddy in (await db.execute(select(model).filter(model.id.in_(ids)))).scalars()}
+    return [buddies[buddy_id] for buddy_id in ids if buddy_id in buddies]
@@ -1,9 +1,32 @@
+import asyncio
+import heapq
+import json
 import logging
+from concurrent.futures import Executor
+from functools import partial
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import and_, or_, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import QueuePool
 from .models import Buddy
-from typing import List
-from pydantic import BaseModel
+from .keyword_index import KeywordIndex
+from .fuzzy_index import FuzzyIndex
+from .keyword_scoring import API_WEIGHTS, KeywordMatrix, ScoringWeights, normalized_terms
+from .partitions import ProfilePartitions
+from .ranking import rank_by_score
+from .sql_scoring import contains, detail_filters, top_scored_ids
+from .buddy_lookup import lookup_conditions, lookup_filters, lookup_keys, lookup_matches
+from .match_cache import CursorStore, MatchCache, cache_key, load_in_order, load_in_order_async
+from .request_terms import CompiledRequest, compile_request
+from .stage_metrics import NO_METRICS, StageMetrics
+from typing import List, Optional, Tuple, Union
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:  # without orjson, response bodies are encoded with the json module
+    orjson = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,67 +40,679 @@ class BuddySearchRequest(BaseModel):
     event: str
     package: str
 
-# Function to match buddies based on user criteria
-def match_buddies(db: Session, request: BuddySearchRequest) -> List[Buddy]:
-    logger.info("Starting the matching process for request: %s", request)
+# Id sets (keyword-index matches, partition blocks) up to this size are sent to the database as an
+# IN list. Larger ones would be slow to bind and can exceed the driver's parameter limit (SQLite's
+# is 250,000), so they are applied to the loaded rows instead.
+MAX_IN_IDS = 5_000
+
+# Build the keyword inverted index from the buddies table; keep it current with
+# KeywordIndex.add/remove when buddies are created, edited or deleted
+def build_keyword_index(db: Session) -> KeywordIndex:
+    return KeywordIndex.build(db.query(Buddy.id, Buddy.keywords))
+
+# Build the buddies' keyword CSR matrix for match_buddies' keyword filter and scoring; keep it current
+# with KeywordMatrix.add/remove when buddies are created, edited or deleted (rebuild it after bulk changes)
+def build_keyword_matrix(db: Session) -> KeywordMatrix:
+    return KeywordMatrix.build(db.query(Buddy.id, Buddy.keywords))
+
+# Build destination (and destination+language) partitions of buddy ids; keep them current with
+# ProfilePartitions.add/remove when buddies are created, edited or deleted
+def build_partitions(db: Session) -> ProfilePartitions:
+    return ProfilePartitions.build(db.query(Buddy.id, Buddy.destination, Buddy.language))
+
+# Build the trigram index for fuzzy destination, event, package and keyword matching; keep it
+# current with FuzzyIndex.add/remove when buddies are created, edited or deleted
+def build_fuzzy_index(db: Session) -> FuzzyIndex:
+    return FuzzyIndex.build(db.query(Buddy.id, Buddy.destination, Buddy.event, Buddy.package, Buddy.keywords))
+
+# How match_buddies finds a request's candidates, decided before touching the database. Every
+# condition is kept in two forms: SQL clauses for the query, and the same conditions as id sets and
+# case-insensitive substring tests that can be checked on loaded rows (see match_buddies_batch).
+class MatchPlan:
+    def __init__(self):
+        self.clauses = []               # WHERE clauses of the candidate SELECT
+        self.id_filters = []            # id sets a candidate must be in
+        self.id_post_filters = []       # those too large for an IN list, applied to the loaded rows
+        self.substring_filters = []     # (column, terms): the column must contain one of the terms
+        self.keyword_matches = None     # ids matching a request keyword, from the keyword matrix or an index
+        self.keyword_counts = None      # id -> request keywords matched, from the fuzzy index
+        self.fuzzy_matches = {}         # field -> ids matching it, from the fuzzy index
+        self.lookup_keys = None         # buddy_lookup.lookup_keys, when the lookup tables decide matches
+
+    @property
+    def statement(self):
+        return select(Buddy).filter(*self.clauses)
+
+    # The candidate SELECT as plain rows of the given columns, without building ORM objects
+    def projection(self, columns):
+        return select(*[getattr(Buddy, column) for column in columns]).filter(*self.clauses)
+
+    # Require one of the (lower-cased) terms as a substring of the column: ILIKE '%term%', with any
+    # % or _ in the term escaped so it means what accepts() and the scoring take it to mean
+    def require_substring(self, column, terms):
+        self.clauses.append(or_(*[contains(getattr(Buddy, column), term) for term in terms]))
+        self.substring_filters.append((column, terms))
+
+    # Require the given ids: as an IN list when small enough, otherwise on the loaded rows (narrowed
+    # in SQL by the optional sql_hint clause)
+    def require_ids(self, ids, sql_hint=None):
+        self.id_filters.append(ids)
+        if len(ids) <= MAX_IN_IDS:
+            self.clauses.append(Buddy.id.in_(ids))
+        else:
+            self.id_post_filters.append(ids)
+            if sql_hint is not None:
+                self.clauses.append(sql_hint)
+
+    # Keep the loaded rows that pass every id post-filter
+    def filter_loaded(self, results):
+        for ids in self.id_post_filters:
+            results = [buddy for buddy in results if buddy.id in ids]
+        return results
+
+    # Whether a loaded buddy meets every condition of the plan (only for plans without SQL-only
+    # lookup-table clauses)
+    def accepts(self, buddy):
+        return all(buddy.id in ids for ids in self.id_filters) and all(
+            any(term in getattr(buddy, column).lower() for term in terms) for column, terms in self.substring_filters)
+
+# Build the candidate query for a compiled request (the "filter" stage; no database access)
+def plan_match(
+    request: CompiledRequest,
+    keyword_index: Optional[KeywordIndex] = None,
+    partitions: Optional[ProfilePartitions] = None,
+    use_lookup_tables: bool = False,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+) -> MatchPlan:
+    plan = MatchPlan()
+
+    # Candidate blocks for the request's destination: every partition whose destination contains it.
+    # They only narrow the destination substring filter, which still decides (see below).
+    candidate_ids = partitions.containing(request.destination) if partitions is not None else None
+
+    # With the fuzzy index, a destination, event or package matches when the buddy's value is
+    # trigram-similar to (or an alias of) the request's; the ids come from the index, not a scan
+    if fuzzy_index is not None:
+        for field in ("destination", "event", "package"):
+            if getattr(request, field):
+                plan.fuzzy_matches[field] = fuzzy_index.lookup(field, getattr(request, field))
+        if "destination" in plan.fuzzy_matches:
+            candidate_ids = plan.fuzzy_matches["destination"]
 
     # Initial query: Filter by destination and language first (top priority)
-    query = db.query(Buddy).filter(
-        Buddy.destination.ilike(f"%{request.destination}%"),
-        Buddy.language.ilike(f"%{request.language}%")
-    )
-    logger.info("Filtered by destination and language: %s", query)
+    if use_lookup_tables:
+        # Indexed equality lookups on the normalized side tables (see buddy_lookup for the semantics)
+        plan.clauses.extend(lookup_filters(Buddy, request))
+        plan.lookup_keys = lookup_keys(request)
+        logger.info("Filtered by destination, language and keyword lookup tables")
+    else:
+        if "destination" in plan.fuzzy_matches:
+            # Beyond an IN list, narrow to the matched destinations' spellings in SQL
+            spellings = Buddy.destination.in_(fuzzy_index.spellings("destination", request.destination))
+            plan.require_ids(candidate_ids, spellings)
+        else:
+            plan.require_substring("destination", [request.destination])
+            if candidate_ids is not None and len(candidate_ids) <= MAX_IN_IDS:
+                # The partition ids as an indexed IN list; larger blocks would not narrow the scan
+                plan.require_ids(candidate_ids)
+        plan.require_substring("language", [request.language])
+        if candidate_ids is None:
+            logger.info("Filtered by destination and language")
+        else:
+            logger.info("Filtered by destination partition (%d buddies) and language", len(candidate_ids))
 
     # If keywords are provided, add a filter for partial matches
     if request.keywords:
-        keywords = request.keywords.lower().split(",")
-        keyword_filters = [Buddy.keywords.ilike(f"%{keyword.strip()}%") for keyword in keywords]
-        query = query.filter(or_(*keyword_filters))
-        logger.info("Added keyword filters: %s", keyword_filters)
+        keywords = request.keyword_terms
+        if fuzzy_index is not None:
+            # Buddies with a keyword similar to any request keyword (inside the destination matches);
+            # keywords with only empty terms leave nothing to match on, so they filter nothing
+            terms = [keyword for keyword in keywords if keyword]
+            plan.keyword_counts = fuzzy_index.match_counts("keywords", terms, candidate_ids) if terms else {}
+            plan.keyword_matches = set(plan.keyword_counts)
+            if terms:
+                plan.require_ids(plan.keyword_matches)
+                logger.info("Added fuzzy keyword filter: %d buddies", len(plan.keyword_matches))
+        elif keyword_matrix is not None and not use_lookup_tables:
+            # Buddies listing a whole request term, normalized as the matrix scores them (the
+            # lookup-table filter already matches whole normalized terms)
+            terms = normalized_terms(request.keywords)
+            if terms:
+                plan.keyword_matches = keyword_matrix.matching_ids(terms, candidate_ids)
+                plan.require_ids(plan.keyword_matches)
+                logger.info("Added keyword matrix filter: %d buddies", len(plan.keyword_matches))
+        elif keyword_index is not None:
+            # Whole-keyword (and synonym) matches straight from the posting lists
+            # (only those inside the destination partition, when there is one)
+            plan.keyword_matches = keyword_index.matching(request.keyword_set, candidate_ids)
+            plan.require_ids(plan.keyword_matches)
+            logger.info("Added keyword index filter: %d buddies", len(plan.keyword_matches))
+        elif not use_lookup_tables:
+            plan.require_substring("keywords", keywords)
+            logger.info("Added %d keyword filters", len(keywords))
 
     # If event is provided, add a filter for partial match (case insensitive)
     if request.event:
-        query = query.filter(Buddy.event.ilike(f"%{request.event}%"))
+        if fuzzy_index is not None:
+            plan.require_ids(plan.fuzzy_matches["event"])
+        else:
+            plan.require_substring("event", [request.event])
         logger.info("Added event filter for: %s", request.event)
 
     # If package is provided, add a filter for partial match (case insensitive)
     if request.package:
-        query = query.filter(Buddy.package.ilike(f"%{request.package}%"))
+        if fuzzy_index is not None:
+            plan.require_ids(plan.fuzzy_matches["package"])
+        else:
+            plan.require_substring("package", [request.package])
         logger.info("Added package filter for: %s", request.package)
 
-    # Execute the query and fetch all results
-    results = query.all()
-    logger.info("Query executed. Number of results found: %d", len(results))
+    return plan
+
+# Score the loaded candidates and rank them, best first (the "score" and "topk" stages)
+def rank_candidates(
+    results: List[Buddy],
+    request: CompiledRequest,
+    plan: MatchPlan,
+    top_k: Optional[int] = None,
+    weights: ScoringWeights = API_WEIGHTS,
+    keyword_index: Optional[KeywordIndex] = None,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+    metrics: StageMetrics = NO_METRICS,
+) -> List[Buddy]:
+    debug = logger.isEnabledFor(logging.DEBUG)
+    keywords = request.keyword_terms
+    keyword_matches = plan.keyword_matches
+    keyword_counts = plan.keyword_counts
+
+    # Apply scoring based on prioritization criteria (points per field from weights)
+    with metrics.stage("score"):
+        # With the keyword matrix, every loaded buddy's keyword points come from one sparse mat-vec
+        keyword_points = None
+        if request.keywords and keyword_matrix is not None and fuzzy_index is None:
+            request_terms = normalized_terms(request.keywords)
+            keyword_points = keyword_matrix.scores_by_id(request_terms, weights, [buddy.id for buddy in results])
+        elif request.keywords and fuzzy_index is None and keyword_index is not None and weights.keyword_mode == "each":
+            # (the fuzzy index already counted its keyword matches while filtering)
+            keyword_counts = keyword_index.match_counts(request.keyword_set)
+        each_keyword = weights.keyword_mode == "each"
+        fuzzy_destination = plan.fuzzy_matches.get("destination")
+        fuzzy_event = plan.fuzzy_matches.get("event")
+        fuzzy_package = plan.fuzzy_matches.get("package")
+        lookup = plan.lookup_keys
+
+        # Keyword points already known per id, from the keyword matrix or a keyword (or fuzzy) index
+        keywords_known = keyword_points is not None or bool(request.keywords) and (
+            fuzzy_index is not None or keyword_index is not None)
+
+        def known_keyword_points(buddy):
+            if keyword_points is not None:
+                return keyword_points[buddy.id]
+            if each_keyword:
+                return weights.keywords * keyword_counts.get(buddy.id, 0)
+            return weights.keywords if buddy.id in keyword_matches else 0
+
+        def score_buddy(buddy):
+            score = 0
+            if lookup is not None:
+                # Whole-value matches, the same tests the lookup-table filters made
+                destination_match, language_match, lookup_keyword_hits = lookup_matches(buddy, lookup)
+            else:
+                destination_match = (request.destination in buddy.destination.lower() if fuzzy_destination is None
+                                     else buddy.id in fuzzy_destination)
+                language_match = request.language in buddy.language.lower()
+            # Priority 1: Destination match
+            if destination_match:
+                score += weights.destination
+            # Priority 2: Language match
+            if language_match:
+                score += weights.language
+            # Priority 3: Keyword match (if applicable)
+            if keywords_known:
+                score += known_keyword_points(buddy)
+            elif lookup is not None:
+                if each_keyword:
+                    score += weights.keywords * lookup_keyword_hits
+                elif lookup_keyword_hits:
+                    score += weights.keywords
+            elif request.keywords:
+                buddy_keywords = buddy.keywords.lower()
+                if each_keyword:
+                    score += weights.keywords * sum(keyword in buddy_keywords for keyword in keywords)
+                elif any(keyword in buddy_keywords for keyword in keywords):
+                    score += weights.keywords  # One matching keyword is enough
+            # Priority 4: Event match (if applicable)
+            if request.event and (request.event in buddy.event.lower() if fuzzy_event is None
+                                  else buddy.id in fuzzy_event):
+                score += weights.event
+            # Priority 5: Package match (if applicable)
+            if request.package and (request.package in buddy.package.lower() if fuzzy_package is None
+                                    else buddy.id in fuzzy_package):
+                score += weights.package
+            if debug:
+                logger.debug("Buddy: %s scored %d", getattr(buddy, "name", buddy.id), score)
+            return score
 
-    # Apply scoring based on prioritization criteria
-    scored_buddies = []
-    for buddy in results:
-        score = 0
-        # Priority 1: Destination match
-        if request.destination.lower() in buddy.destination.lower():
-            score += 50
-        # Priority 2: Language match
-        if request.language.lower() in buddy.language.lower():
-            score += 30
-        # Priority 3: Keyword match (if applicable)
-        if request.keywords:
-            for keyword in keywords:
-                if keyword.strip() in buddy.keywords.lower():
-                    score += 10
-                    break  # Stop after the first matching keyword
-        # Priority 4: Event match (if applicable)
-        if request.event and request.event.lower() in buddy.event.lower():
-            score += 5
-        # Priority 5: Package match (if applicable)
-        if request.package and request.package.lower() in buddy.package.lower():
-            score += 5
-
-        scored_buddies.append((buddy, score))
-        logger.debug("Buddy: %s scored %d", buddy.name, score)
-
-    # Sort the buddies by score in descending order
-    scored_buddies.sort(key=lambda x: x[1], reverse=True)
-    logger.info("Buddies sorted by score. Top match: %s", scored_buddies[0][0].name if scored_buddies else "None")
+        if not top_k or any(getattr(weights, field) < 0 for field in weights.FIELDS):
+            scored_buddies = [(buddy, score_buddy(buddy)) for buddy in results]
+        else:
+            # Upper bound per candidate: the points already known by id (keywords from the matrix or an
+            # index, fuzzy field matches), plus every point that needs its row to decide. Candidates are
+            # taken in buckets of equal bound, highest first, like scoring_engine.pruned_top_positions;
+            # once the k-th best score beats the next bucket's bound, no one left can enter the top k.
+            # Ties go to the lower id, so a bucket that can only equal the k-th best is still scored, in
+            # id order, until its next candidate could at best tie the k-th best with a higher id.
+            open_points = weights.language
+            open_points += weights.destination if fuzzy_destination is None else 0
+            open_points += weights.event if request.event and fuzzy_event is None else 0
+            open_points += weights.package if request.package and fuzzy_package is None else 0
+            if request.keywords and not keywords_known:
+                terms = lookup[2] if lookup is not None else keywords
+                open_points += weights.keywords * (len(terms) if each_keyword else 1)
+
+            def bound_of(buddy):
+                bound = open_points
+                if keywords_known:
+                    bound += known_keyword_points(buddy)
+                if fuzzy_destination is not None and buddy.id in fuzzy_destination:
+                    bound += weights.destination
+                if request.event and fuzzy_event is not None and buddy.id in fuzzy_event:
+                    bound += weights.event
+                if request.package and fuzzy_package is not None and buddy.id in fuzzy_package:
+                    bound += weights.package
+                return bound
+
+            buckets = {}
+            for buddy in results:
+                buckets.setdefault(bound_of(buddy), []).append(buddy)
+            scored_buddies = []
+            best = []  # min-heap of the top_k best (score, -id) so far; best[0] is the k-th best
+            for bound in sorted(buckets, reverse=True):
+                if len(best) == top_k and bound < best[0][0]:
+                    break
+                for buddy in sorted(buckets[bound], key=lambda buddy: buddy.id):
+                    if len(best) == top_k and (bound, -buddy.id) < best[0]:
+                        break
+                    score = score_buddy(buddy)
+                    scored_buddies.append((buddy, score))
+                    if len(best) < top_k:
+                        heapq.heappush(best, (score, -buddy.id))
+                    elif (score, -buddy.id) > best[0]:
+                        heapq.heapreplace(best, (score, -buddy.id))
+        if len(scored_buddies) < len(results):
+            metrics.count("candidates_pruned", len(results) - len(scored_buddies))
+
+    # Sort the buddies by score in descending order (ties on buddy id), keeping the best top_k if set
+    with metrics.stage("topk"):
+        scored_buddies = rank_by_score(scored_buddies, top_k)
+    logger.info("Buddies sorted by score. Top match: %s",
+                getattr(scored_buddies[0][0], "name", scored_buddies[0][0].id) if scored_buddies else "None")
 
     # Return the sorted buddy objects (ignoring the score)
     return [buddy for buddy, score in scored_buddies]
+
+def _match_cache_key(request, top_k, use_lookup_tables, keyword_index, partitions, keyword_matrix, weights):
+    return cache_key(
+        request,
+        top_k=top_k,
+        use_lookup_tables=use_lookup_tables,
+        keyword_index=keyword_index is not None,
+        partitions=partitions is not None,
+        keyword_matrix=keyword_matrix is not None,
+        weights=tuple(weights.as_dict().items()),
+    )
+
+# Function to match buddies based on user criteria
+def match_buddies(
+    db: Session,
+    request: Union[BuddySearchRequest, CompiledRequest],
+    keyword_index: Optional[KeywordIndex] = None,
+    partitions: Optional[ProfilePartitions] = None,
+    top_k: Optional[int] = None,
+    use_lookup_tables: bool = False,
+    cache: Optional[MatchCache] = None,
+    metrics: StageMetrics = NO_METRICS,
+    weights: ScoringWeights = API_WEIGHTS,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+) -> List[Buddy]:
+    logger.debug("Starting the matching process for request: %s", request)
+    metrics.count("requests")
+    if fuzzy_index is not None and use_lookup_tables:
+        raise ValueError("fuzzy_index and use_lookup_tables cannot be combined")
+
+    # Normalize the request once (memoized across identical requests); everything below reads this
+    request = compile_request(request, keyword_index.expand if keyword_index is not None else None)
+
+    # Serve repeated requests from the result cache (ranked ids, reloaded by primary key).
+    # Install match_cache.install_invalidation(cache, Buddy) once so Buddy writes evict stale entries.
+    # Invalidation goes by the request's destination string, which cannot tell which buddies a
+    # fuzzy request reaches through aliases and trigrams, so fuzzy results are never cached.
+    if fuzzy_index is not None:
+        cache = None
+    if cache is not None:
+        key = _match_cache_key(request, top_k, use_lookup_tables, keyword_index, partitions, keyword_matrix, weights)
+        cached_ids = cache.get(key)
+        if cached_ids is not None:
+            logger.info("Served %d buddies from the match cache", len(cached_ids))
+            metrics.count("cache_hits")
+            with metrics.stage("load"):
+                cached_buddies = load_in_order(db, Buddy, cached_ids)
+            metrics.count("candidates_returned", len(cached_buddies))
+            return cached_buddies
+
+    with metrics.stage("filter"):
+        plan = plan_match(request, keyword_index, partitions, use_lookup_tables, fuzzy_index, keyword_matrix)
+
+    # The SQL text is only rendered when debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Matching query: %s", plan.statement)
+
+    # Execute the query and fetch all results
+    with metrics.stage("load"):
+        results = plan.filter_loaded(db.execute(plan.statement).scalars().all())
+    logger.info("Query executed. Number of results found: %d", len(results))
+    metrics.count("candidates_scanned", len(results))
+
+    matched_buddies = rank_candidates(results, request, plan, top_k, weights, keyword_index, keyword_matrix,
+                                      fuzzy_index, metrics)
+    metrics.count("candidates_returned", len(matched_buddies))
+    if cache is not None:
+        cache.put(key, [buddy.id for buddy in matched_buddies])
+    return matched_buddies
+
+# One entry of match_buddies_batch's result: the ranked buddies, or why the request failed
+class BatchMatch:
+    def __init__(self, buddies: Optional[List[Buddy]] = None, error: Optional[str] = None):
+        self.buddies = buddies if buddies is not None else []
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+# match_buddies for many requests at once (e.g. a group trip). Requests are grouped by destination;
+# each group runs one candidate query (the union of its requests' conditions) and every request in it
+# is filtered and scored against those shared rows, with the same result match_buddies gives.
+# Results come back in input order; a request that fails gets an error instead of buddies and does
+# not affect the others.
+def match_buddies_batch(
+    db: Session,
+    requests: List[Union[BuddySearchRequest, CompiledRequest]],
+    keyword_index: Optional[KeywordIndex] = None,
+    partitions: Optional[ProfilePartitions] = None,
+    top_k: Optional[int] = None,
+    metrics: StageMetrics = NO_METRICS,
+    weights: ScoringWeights = API_WEIGHTS,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+) -> List[BatchMatch]:
+    logger.info("Starting batch matching for %d requests", len(requests))
+    metrics.count("requests", len(requests))
+    expand = keyword_index.expand if keyword_index is not None else None
+    results: List[Optional[BatchMatch]] = [None] * len(requests)
+
+    groups = {}  # destination -> [(position, compiled request, plan)]
+    with metrics.stage("filter"):
+        for position, request in enumerate(requests):
+            try:
+                compiled = compile_request(request, expand)
+                plan = plan_match(compiled, keyword_index, partitions, False, fuzzy_index, keyword_matrix)
+            except Exception as e:
+                logger.exception("Batch request %d could not be planned", position)
+                results[position] = BatchMatch(error=f"{type(e).__name__}: {e}")
+                continue
+            groups.setdefault(compiled.destination, []).append((position, compiled, plan))
+
+    for destination, members in groups.items():
+        statement = select(Buddy).filter(or_(*[and_(*plan.clauses) for _, _, plan in members]))
+        try:
+            with metrics.stage("load"):
+                candidates = db.execute(statement).scalars().all()
+        except Exception as e:
+            logger.exception("Candidate query for destination %r failed", destination)
+            db.rollback()
+            for position, _, _ in members:
+                results[position] = BatchMatch(error=f"{type(e).__name__}: {e}")
+            continue
+        logger.info("Destination %r: %d candidates for %d requests", destination, len(candidates), len(members))
+        metrics.count("candidates_scanned", len(candidates))
+
+        for position, request, plan in members:
+            try:
+                matched = [buddy for buddy in candidates if plan.accepts(buddy)]
+                ranked = rank_candidates(matched, request, plan, top_k, weights, keyword_index, keyword_matrix,
+                                         fuzzy_index, metrics)
+            except Exception as e:
+                logger.exception("Batch request %d could not be scored", position)
+                results[position] = BatchMatch(error=f"{type(e).__name__}: {e}")
+                continue
+            metrics.count("candidates_returned", len(ranked))
+            results[position] = BatchMatch(ranked)
+    return results
+
+# Columns of a matched buddy in the API's JSON responses
+BUDDY_RESPONSE_FIELDS = ("id", "name", "destination", "language", "keywords", "event", "package")
+
+# Body of the bulk endpoint (POST /api/book_buddies, a JSON list of BuddySearchRequest bodies).
+# Each item is answered in place, as /api/book_buddy would answer it alone:
+#   {"status": 200, "matches": [buddy, ...]}
+#   {"status": 404, "detail": "No buddies found matching the criteria"}
+#   {"status": 422, "detail": [validation errors]}   or 500 with the error for a failed match
+def book_buddies_batch(db: Session, payloads: list, **options) -> List[dict]:
+    responses: List[Optional[dict]] = [None] * len(payloads)
+    valid_positions, valid_requests = [], []
+    for position, payload in enumerate(payloads):
+        try:
+            valid_requests.append(BuddySearchRequest.model_validate(payload))
+            valid_positions.append(position)
+        except ValidationError as e:
+            responses[position] = {"status": 422, "detail": e.errors(include_url=False)}
+
+    for position, match in zip(valid_positions, match_buddies_batch(db, valid_requests, **options)):
+        if not match.ok:
+            responses[position] = {"status": 500, "detail": match.error}
+        elif not match.buddies:
+            responses[position] = {"status": 404, "detail": "No buddies found matching the criteria"}
+        else:
+            matches = [{field: getattr(buddy, field) for field in BUDDY_RESPONSE_FIELDS} for buddy in match.buddies]
+            responses[position] = {"status": 200, "matches": matches}
+    return responses
+
+# JSON body as bytes: orjson encodes straight to one bytes object, with json as the fallback
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+# One page of a match as a JSON body, rendered from column rows rather than ORM objects:
+#   {"matches": [{field: value, ...}, ...], "total": ranked buddies, "next_cursor": cursor or null}
+# The first page runs the match (the candidates, scores and ranking of match_buddies with the same
+# options) and, if there is more, keeps the ranked ids in cursors. Pass next_cursor back instead of
+# a request for the following page; it is loaded by primary key, without matching again.
+# fields picks the buddy fields to return (any of BUDDY_RESPONSE_FIELDS, in the order given); they
+# are loaded for the page's buddies only, ranking reads just the columns it scores.
+# Raises ValueError when more than limit buddies match and there are no cursors to page on with,
+# and match_cache.CursorError for a malformed, expired or unknown cursor.
+def match_page(
+    db: Session,
+    request: Optional[Union[BuddySearchRequest, CompiledRequest]] = None,
+    cursors: Optional[CursorStore] = None,
+    cursor: Optional[str] = None,
+    fields: Tuple[str, ...] = BUDDY_RESPONSE_FIELDS,
+    limit: int = 20,
+    keyword_index: Optional[KeywordIndex] = None,
+    partitions: Optional[ProfilePartitions] = None,
+    top_k: Optional[int] = None,
+    use_lookup_tables: bool = False,
+    metrics: StageMetrics = NO_METRICS,
+    weights: ScoringWeights = API_WEIGHTS,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+) -> bytes:
+    unknown = set(fields) - set(BUDDY_RESPONSE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown buddy fields: {sorted(unknown)}")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    if cursor is not None:
+        if cursors is None:
+            raise ValueError("A cursor can only be resolved by the CursorStore that issued it")
+        ranked_ids, offset = cursors.resolve(cursor)
+        with metrics.stage("load"):
+            matches = _page_rows(db, ranked_ids[offset:offset + limit], fields)
+        total = len(ranked_ids)
+        next_cursor = CursorStore.advance(cursor, offset + limit) if offset + limit < total else None
+    else:
+        if request is None:
+            raise ValueError("match_page needs a request or a cursor")
+        logger.debug("Starting the paged matching process for request: %s", request)
+        metrics.count("requests")
+        if fuzzy_index is not None and use_lookup_tables:
+            raise ValueError("fuzzy_index and use_lookup_tables cannot be combined")
+        request = compile_request(request, keyword_index.expand if keyword_index is not None else None)
+        with metrics.stage("filter"):
+            plan = plan_match(request, keyword_index, partitions, use_lookup_tables, fuzzy_index, keyword_matrix)
+        # Rows carry the columns rank_candidates reads, as attributes, like Buddy objects
+        columns = _ranking_columns(request, plan, keyword_index, keyword_matrix, fuzzy_index)
+        with metrics.stage("load"):
+            results = plan.filter_loaded(db.execute(plan.projection(columns)).all())
+        metrics.count("candidates_scanned", len(results))
+        ranked = rank_candidates(results, request, plan, top_k, weights, keyword_index, keyword_matrix,
+                                 fuzzy_index, metrics)
+        metrics.count("candidates_returned", len(ranked))
+        total = len(ranked)
+        if total > limit and cursors is None:
+            raise ValueError(f"{total} buddies match but limit is {limit}; pass a CursorStore to page through them")
+        ranked_ids = [row.id for row in ranked]
+        # The response fields only for the buddies on the page
+        with metrics.stage("load"):
+            matches = _page_rows(db, ranked_ids[:limit], fields)
+        next_cursor = cursors.save(ranked_ids, limit) if total > limit else None
+
+    with metrics.stage("serialize"):
+        return dump_json({"matches": matches, "total": total, "next_cursor": next_cursor})
+
+# The columns rank_candidates reads for a plan: the id, and every field whose match is not already
+# known by id from an index (lookup-table plans read the destination, language and keywords)
+def _ranking_columns(request, plan, keyword_index, keyword_matrix, fuzzy_index):
+    columns = ["id", "language"]
+    if plan.lookup_keys is not None or "destination" not in plan.fuzzy_matches:
+        columns.append("destination")
+    keywords_known = bool(request.keywords) and (
+        keyword_matrix is not None or keyword_index is not None or fuzzy_index is not None)
+    if plan.lookup_keys is not None or request.keywords and not keywords_known:
+        columns.append("keywords")
+    columns += [field for field in ("event", "package") if getattr(request, field) and field not in plan.fuzzy_matches]
+    return columns
+
+# The given fields of the buddies with these ids, as dicts in the ids' order (deleted ones skipped).
+# The id keys the rows back into order, so it is selected even when not among the fields.
+def _page_rows(db, ids, fields):
+    statement = select(Buddy.id, *[getattr(Buddy, field) for field in fields]).where(Buddy.id.in_(ids))
+    rows = {row[0]: row[1:] for row in db.execute(statement)}
+    return [dict(zip(fields, rows[buddy_id])) for buddy_id in ids if buddy_id in rows]
+
+# Connection pool for the async engine: connections kept open, extra ones allowed in bursts, seconds a
+# request waits for a free one, and seconds before a connection is recycled (checked before use)
+ASYNC_POOL_OPTIONS = {"pool_size": 20, "max_overflow": 10, "pool_timeout": 10, "pool_recycle": 1800,
+                      "pool_pre_ping": True}
+
+# ASYNC_POOL_OPTIONS that apply to the url's pool: sizes and timeouts only exist on queue pools (in-memory
+# SQLite gets a StaticPool, which rejects them). Options the caller passes always win.
+def _async_pool_options(url, pool_options):
+    url = make_url(url)
+    pool_class = pool_options.get("poolclass") or url.get_dialect().get_pool_class(url)
+    defaults = ASYNC_POOL_OPTIONS if issubclass(pool_class, QueuePool) else {
+        key: ASYNC_POOL_OPTIONS[key] for key in ("pool_recycle", "pool_pre_ping")}
+    return {**defaults, **pool_options}
+
+# AsyncSession factory for match_buddies_async, e.g. for "postgresql+asyncpg://..." or
+# "sqlite+aiosqlite:///buddies.db". Objects stay loaded after commit, so reading them never
+# triggers a lazy load outside the event loop.
+def create_async_session_factory(url: str, **pool_options) -> async_sessionmaker:
+    engine = create_async_engine(url, **_async_pool_options(url, pool_options))
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+# match_buddies on an AsyncSession: the same candidates, scores and ranking, but the query is awaited
+# and the CPU-bound steps (index lookups, scoring, ranking) run on the executor (the loop's default
+# thread pool unless one is given), so the event loop keeps serving other requests meanwhile
+async def match_buddies_async(
+    db: AsyncSession,
+    request: Union[BuddySearchRequest, CompiledRequest],
+    keyword_index: Optional[KeywordIndex] = None,
+    partitions: Optional[ProfilePartitions] = None,
+    top_k: Optional[int] = None,
+    use_lookup_tables: bool = False,
+    cache: Optional[MatchCache] = None,
+    metrics: StageMetrics = NO_METRICS,
+    weights: ScoringWeights = API_WEIGHTS,
+    keyword_matrix: Optional[KeywordMatrix] = None,
+    fuzzy_index: Optional[FuzzyIndex] = None,
+    executor: Optional[Executor] = None,
+) -> List[Buddy]:
+    logger.debug("Starting the async matching process for request: %s", request)
+    metrics.count("requests")
+    if fuzzy_index is not None and use_lookup_tables:
+        raise ValueError("fuzzy_index and use_lookup_tables cannot be combined")
+    loop = asyncio.get_running_loop()
+    request = compile_request(request, keyword_index.expand if keyword_index is not None else None)
+
+    if fuzzy_index is not None:
+        cache = None  # see match_buddies
+    if cache is not None:
+        key = _match_cache_key(request, top_k, use_lookup_tables, keyword_index, partitions, keyword_matrix, weights)
+        cached_ids = cache.get(key)
+        if cached_ids is not None:
+            logger.info("Served %d buddies from the match cache", len(cached_ids))
+            metrics.count("cache_hits")
+            with metrics.stage("load"):
+                cached_buddies = await load_in_order_async(db, Buddy, cached_ids)
+            metrics.count("candidates_returned", len(cached_buddies))
+            return cached_buddies
+
+    with metrics.stage("filter"):
+        plan = await loop.run_in_executor(
+            executor, partial(plan_match, request, keyword_index, partitions, use_lookup_tables, fuzzy_index,
+                                    keyword_matrix))
+
+    with metrics.stage("load"):
+        results = plan.filter_loaded((await db.execute(plan.statement)).scalars().all())
+    logger.info("Query executed. Number of results found: %d", len(results))
+    metrics.count("candidates_scanned", len(results))
+
+    matched_buddies = await loop.run_in_executor(executor, partial(
+        rank_candidates, results, request, plan, top_k, weights, keyword_index, keyword_matrix, fuzzy_index, metrics))
+    metrics.count("candidates_returned", len(matched_buddies))
+    if cache is not None:
+        cache.put(key, [buddy.id for buddy in matched_buddies])
+    return matched_buddies
+
+# Database-side variant of match_buddies: filtering, the 50/30/10/5/5 scoring, ordering and the
+# top_k limit all run as one SQL query, and only (buddy id, score) pairs come back
+def match_buddy_scores(
+    db: Session,
+    request: Union[BuddySearchRequest, CompiledRequest],
+    top_k: Optional[int] = 10,
+    use_lookup_tables: bool = False,
+    metrics: StageMetrics = NO_METRICS,
+    weights: ScoringWeights = API_WEIGHTS,
+) -> List[Tuple[int, int]]:
+    logger.debug("Starting SQL-scored matching for request: %s", request)
+    metrics.count("requests")
+    request = compile_request(request)
+    with metrics.stage("filter"):
+        filters = conditions = None
+        if use_lookup_tables:
+            # Scored on the same whole-value conditions the lookup filters match on
+            filters = lookup_filters(Buddy, request) + detail_filters(Buddy, request)
+            conditions = lookup_conditions(Buddy, request)
+    # Filtering, scoring and the top_k cut all happen inside this one query
+    with metrics.stage("score"):
+        scored_ids = top_scored_ids(db, Buddy, request, top_k, filters, weights, conditions)
+    logger.info("SQL scoring returned %d buddies", len(scored_ids))
+    metrics.count("candidates_returned", len(scored_ids))
+    return scored_ids
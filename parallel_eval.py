@@ -0,0 +1,141 @@
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from keyword_scoring import BATCH_WEIGHTS
+from scoring_engine import REQUEST_KEYS, EncodedProfiles, chunk_rows, score_matrix, top_k_positions
+
+# Scenario columns the scorer reads; only these are sent to the workers
+REQUEST_COLUMNS = REQUEST_KEYS
+
+# Set in each worker by _init_worker: the shared profile arrays and the segments backing them
+_worker_profiles = None
+_worker_segments = []
+
+
+# Copy an array into a new shared-memory segment; returns the segment and what a worker needs to attach
+def _share_array(array):
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def _attach_array(spec):
+    name, shape, dtype = spec
+    segment = shared_memory.SharedMemory(name=name)
+    return segment, np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+# Place the coded columns and keyword CSR arrays in shared memory. The layout (segment names plus
+# the small category and vocabulary tables) is sent to each worker once, at pool start-up.
+def share_profiles(encoded):
+    segments = []
+
+    def share(array):
+        segment, spec = _share_array(array)
+        segments.append(segment)
+        return spec
+
+    matrix = encoded.keyword_matrix
+    layout = {
+        "size": len(encoded),
+        "codes": {column: share(codes) for column, codes in encoded.codes.items()},
+        "categories": encoded.categories,
+        "vocabulary": encoded.vocabulary,
+        "dead": encoded.dead,
+        "keywords": {
+            "shape": matrix.shape,
+            "data": share(matrix.data),
+            "indices": share(matrix.indices),
+            "indptr": share(matrix.indptr),
+        },
+    }
+    return segments, layout
+
+
+# Release the shared segments once the pool is done
+def release_profiles(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+def _init_worker(layout):
+    global _worker_profiles
+    codes = {}
+    for column, spec in layout["codes"].items():
+        segment, codes[column] = _attach_array(spec)
+        _worker_segments.append(segment)
+    keyword_arrays = {}
+    for part in ("data", "indices", "indptr"):
+        segment, keyword_arrays[part] = _attach_array(layout["keywords"][part])
+        _worker_segments.append(segment)
+    keyword_matrix = sparse.csr_matrix(
+        (keyword_arrays["data"], keyword_arrays["indices"], keyword_arrays["indptr"]),
+        shape=layout["keywords"]["shape"], copy=False,
+    )
+    # Workers rank by row position; the parent maps positions back to index labels
+    _worker_profiles = EncodedProfiles(
+        pd.RangeIndex(layout["size"]), codes, layout["categories"], keyword_matrix, layout["vocabulary"])
+    _worker_profiles.dead = layout["dead"]
+
+
+def _top_positions(task):
+    requests, k, weights = task
+    return top_k_positions(score_matrix(requests, _worker_profiles, weights), k)
+
+
+# A process pool whose workers share one copy of the encoded profiles. Start-up (copying the
+# profiles to shared memory, forking the workers) is paid once, however many scenario blocks are
+# then matched, e.g. every chunk of a streamed run:
+#
+#     with ProfilePool(encoded, workers=4) as pool:
+#         for chunk in chunks:
+#             results = pool.top_indices(chunk, k=5)
+class ProfilePool:
+    def __init__(self, encoded, workers=2):
+        self.encoded = encoded
+        self.workers = workers
+        self.segments, layout = share_profiles(encoded)
+        try:
+            self.pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(layout,))
+        except BaseException:
+            release_profiles(self.segments)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            release_profiles(self.segments)
+
+    # Top k profile index labels for every scenario, with scenario chunks spread over the workers.
+    # Chunks come back in submission order, so the output matches batch_top_indices exactly.
+    def top_indices(self, scenarios, k=5, max_cells=8_000_000, weights=BATCH_WEIGHTS):
+        requests = scenarios[REQUEST_COLUMNS]
+        k = min(k, self.encoded.live_count)
+        # Several chunks per worker keep the pool busy when chunks finish unevenly
+        chunk_size = min(chunk_rows(self.encoded, max_cells), max(1, math.ceil(len(requests) / (self.workers * 4))))
+        tasks = ((requests.iloc[start:start + chunk_size], k, weights) for start in range(0, len(requests), chunk_size))
+        results = []
+        for positions in self.pool.imap(_top_positions, tasks):
+            results.extend(self.encoded.index[row].tolist() for row in positions)
+        return results
+
+
+# Top k profile index labels for every scenario, on a pool started for this one call
+def parallel_top_indices(scenarios, encoded, k=5, workers=2, max_cells=8_000_000, weights=BATCH_WEIGHTS):
+    with ProfilePool(encoded, workers) as pool:
+        return pool.top_indices(scenarios, k, max_cells, weights)
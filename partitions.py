@@ -0,0 +1,104 @@
+import re
+from collections import defaultdict
+
+import numpy as np
+
+
+# Lower-case and collapse whitespace so " new  york" and "New York" land in the same partition
+def normalize_key(value):
+    if value is None or value != value:  # None or NaN
+        return ""
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+
+# Split a comma-separated language field ("English,Spanish") into normalized language keys
+def parse_languages(languages):
+    if languages is None or languages != languages:
+        return []
+    if isinstance(languages, str):
+        languages = languages.split(",")
+    return [key for key in map(normalize_key, languages) if key]
+
+
+# In-memory hash partitions of profile ids by normalized destination, and by (destination, language).
+#
+# candidates() returns the block of ids a scorer needs to look at for a request, or None when the
+# destination has no partition at all. None means "no pre-filter is possible": callers fall back to
+# scoring the full table, which keeps the old behaviour for unknown or free-text destinations.
+class ProfilePartitions:
+    def __init__(self):
+        self.by_destination = defaultdict(set)  # destination -> ids
+        self.by_language = defaultdict(set)     # (destination, language) -> ids
+        self.profile_keys = {}                  # id -> (destination, languages), for removal
+        self.sorted_blocks = {}                 # (destination, languages) -> sorted_candidates array
+
+    # Build partitions from (profile_id, destination, languages) triples
+    @classmethod
+    def build(cls, profiles):
+        partitions = cls()
+        for profile_id, destination, languages in profiles:
+            partitions.add(profile_id, destination, languages)
+        return partitions
+
+    def __len__(self):
+        return len(self.profile_keys)
+
+    # Place a new profile, or move an existing one to its current destination and languages
+    def add(self, profile_id, destination, languages=None):
+        self.remove(profile_id)
+        self.sorted_blocks.clear()
+        destination = normalize_key(destination)
+        languages = parse_languages(languages)
+        self.by_destination[destination].add(profile_id)
+        for language in languages:
+            self.by_language[destination, language].add(profile_id)
+        self.profile_keys[profile_id] = (destination, languages)
+
+    # Take a profile out of its partitions; unknown ids are ignored
+    def remove(self, profile_id):
+        if profile_id not in self.profile_keys:
+            return
+        destination, languages = self.profile_keys.pop(profile_id)
+        self.sorted_blocks.clear()
+        self._discard(self.by_destination, destination, profile_id)
+        for language in languages:
+            self._discard(self.by_language, (destination, language), profile_id)
+
+    @staticmethod
+    def _discard(partition, key, profile_id):
+        block = partition[key]
+        block.discard(profile_id)
+        if not block:
+            del partition[key]
+
+    # Ids to score for a request, or None if the destination has no partition (score everything).
+    # With languages, the block narrows to profiles speaking any of them; if none do, the whole
+    # destination block is returned so language-only misses still get ranked.
+    def candidates(self, destination, languages=None):
+        destination = normalize_key(destination)
+        block = self.by_destination.get(destination)
+        if block is None:
+            return None
+        language_blocks = [self.by_language.get((destination, language)) for language in parse_languages(languages)]
+        language_blocks = [language_block for language_block in language_blocks if language_block]
+        if language_blocks:
+            return set().union(*language_blocks)
+        return block
+
+    # Ids of every destination block whose key contains the destination: a superset of the profiles a
+    # case-insensitive substring filter (ILIKE '%destination%') matches, as any destination containing
+    # it still contains it once both are normalized. Empty when no destination does.
+    def containing(self, destination):
+        destination = normalize_key(destination)
+        blocks = [block for key, block in self.by_destination.items() if destination in key]
+        return set().union(*blocks)
+
+    # candidates() as a sorted array of ids (row positions, for the batch scorer), kept until the next
+    # add or remove
+    def sorted_candidates(self, destination, languages=None):
+        key = (normalize_key(destination), tuple(parse_languages(languages)))
+        if key not in self.sorted_blocks:
+            block = self.candidates(destination, languages)
+            self.sorted_blocks[key] = None if block is None else np.sort(
+                np.fromiter(block, dtype=np.intp, count=len(block)))
+        return self.sorted_blocks[key]
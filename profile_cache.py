@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+try:
+    from pyarrow import feather
+except ImportError:  # snapshots need pyarrow; without it every load parses the spreadsheet
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes so old caches are re-parsed instead of misread
+CACHE_FORMAT = 2
+DEFAULT_CACHE_DIR = ".buddy_cache"
+
+
+# SHA-256 of a file, read in 1 MiB blocks
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+# One snapshot per source file and set of read options: the name carries a digest of the absolute
+# path and the read_excel arguments, so a different sheet_name, usecols or dtype (or a same-named
+# file in another directory) never gets served another read's snapshot
+def _cache_paths(path, cache_dir, read_excel_kwargs):
+    source = json.dumps([os.path.abspath(path), read_excel_kwargs], sort_keys=True, default=repr)
+    name = f"{os.path.basename(path)}.{hashlib.sha256(source.encode()).hexdigest()[:16]}"
+    return os.path.join(cache_dir, f"{name}.feather"), os.path.join(cache_dir, f"{name}.meta.json")
+
+
+# The stored metadata if the snapshot still describes the source file, else None.
+# mtime and size are checked first; if they moved, the content hash decides, so a touched but
+# unchanged spreadsheet is not re-parsed (the metadata is refreshed with the new mtime instead).
+def _valid_meta(path, snapshot_path, meta_path):
+    if not (os.path.exists(snapshot_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("format") != CACHE_FORMAT:
+        return None
+
+    stat = _source_stat(path)
+    if stat["mtime_ns"] == meta.get("mtime_ns") and stat["size"] == meta.get("size"):
+        return meta
+    if stat["size"] == meta.get("size") and file_sha256(path) == meta.get("sha256"):
+        meta.update(stat)
+        _write_meta(meta_path, meta)
+        return meta
+    return None
+
+
+def _write_meta(meta_path, meta):
+    temporary_path = f"{meta_path}.tmp"
+    with open(temporary_path, "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temporary_path, meta_path)
+
+
+# The frame as Feather can store it, plus what _restore_index needs: a default RangeIndex is dropped
+# (None), any other index (e.g. from index_col=) becomes leading columns, stored with its level names
+def _with_index_columns(frame):
+    index = frame.index
+    if isinstance(index, pd.RangeIndex) and index.equals(pd.RangeIndex(len(frame))) and index.name is None:
+        return frame.reset_index(drop=True), None
+    snapshot = frame.reset_index()
+    return snapshot, {"columns": list(snapshot.columns[:index.nlevels]), "names": list(index.names)}
+
+
+def _restore_index(frame, meta):
+    index = meta.get("index")
+    if index is None:
+        return frame
+    return frame.set_index(index["columns"]).rename_axis(index["names"])
+
+
+# Read a spreadsheet through an uncompressed Feather snapshot (memory-mapped on load).
+# The Excel file is parsed only when it has changed since the snapshot was written. Without
+# pyarrow, or for sheets Arrow cannot store, this falls back to plain pd.read_excel.
+def read_excel_cached(path, cache_dir=DEFAULT_CACHE_DIR, **read_excel_kwargs):
+    if feather is None:
+        return pd.read_excel(path, **read_excel_kwargs)
+
+    snapshot_path, meta_path = _cache_paths(path, cache_dir, read_excel_kwargs)
+    meta = _valid_meta(path, snapshot_path, meta_path)
+    if meta is not None:
+        try:
+            frame = _restore_index(feather.read_table(snapshot_path, memory_map=True).to_pandas(), meta)
+            logger.info(f"Loaded {path} from cached snapshot {snapshot_path}")
+            return frame
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {snapshot_path}: {e}")
+
+    stat = _source_stat(path)
+    sha256 = file_sha256(path)
+    frame = pd.read_excel(path, **read_excel_kwargs)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = f"{snapshot_path}.tmp"
+        snapshot, index = _with_index_columns(frame)
+        feather.write_feather(snapshot, temporary_path, compression="uncompressed")
+        os.replace(temporary_path, snapshot_path)
+        _write_meta(meta_path, {"format": CACHE_FORMAT, "source": os.path.abspath(path), "sha256": sha256,
+                                "index": index, **stat})
+        logger.info(f"Cached {path} as {snapshot_path}")
+    except Exception as e:
+        logger.warning(f"Could not cache {path}, continuing without a snapshot: {e}")
+    return frame
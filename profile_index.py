@@ -0,0 +1,334 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from keyword_index import SYNONYMS
+from partitions import normalize_key, parse_languages
+from scoring_engine import EncodedProfiles, encode_profiles
+
+logger = logging.getLogger(__name__)
+
+# Index file layout:
+#
+#   magic (8 bytes) | schema version (uint32) | header length (uint32) | header (JSON) | data
+#
+# The header lists every array in the data section (offset, dtype, shape), holds the small tables
+# (category values, vocabulary, partition keys, synonyms) and the SHA-256 of the data section.
+# Arrays start on ALIGNMENT-byte boundaries so they can be used straight from the memory map.
+# Optional raw columns, for rendering results, are stored per row: numeric columns as arrays,
+# anything else as a UTF-8 string heap (see StringHeap).
+MAGIC = b"BUDDYIDX"
+SCHEMA_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+class IndexFileError(ValueError):
+    pass
+
+
+# Strings of one column, one per row, in a byte heap: row i is data[offsets[i]:offsets[i + 1]] as
+# UTF-8, or None where missing is set. All three arrays can live in a memory map.
+class StringHeap:
+    def __init__(self, offsets, data, missing=None):
+        self.offsets = offsets  # int64, one more than there are rows
+        self.data = data        # uint8
+        self.missing = missing  # bool per row, or None when no value is missing
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if self.missing is not None and self.missing[row]:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    # The (offsets, data, missing) arrays for a sequence of values; None and NaN are missing
+    @staticmethod
+    def encode(values):
+        encoded = [None if pd.isna(value) else str(value).encode() for value in values]
+        lengths = np.fromiter((0 if value is None else len(value) for value in encoded), dtype=np.int64,
+                              count=len(encoded))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        data = np.frombuffer(b"".join(value for value in encoded if value is not None), dtype=np.uint8)
+        missing = np.array([value is None for value in encoded], dtype=bool)
+        return offsets, data, missing if missing.any() else None
+
+
+# Everything the matchers derive from a profile table, loaded from an index file
+class ProfileIndex:
+    def __init__(self, encoded, partitions, synonyms, metadata, columns=None, label_lookup=None):
+        self.encoded = encoded        # EncodedProfiles backed by the memory map
+        self.partitions = partitions  # MappedPartitions of row positions, or None if none were stored
+        self.synonyms = synonyms      # keyword synonym table the index was built with
+        self.metadata = metadata      # schema version, profile count, build details
+        self.columns = columns or {}  # raw column name -> StringHeap or numeric array, for rendering
+        # (sorted live integer labels, their row positions or None when already in row order)
+        self.label_lookup = label_lookup
+
+    def __len__(self):
+        return len(self.encoded)
+
+    # Row positions of index labels (e.g. find_best_buddies results). Integer labels are binary
+    # searched in the mapped sorted labels, so no per-process hash table is built over them.
+    def positions(self, labels):
+        if self.label_lookup is not None:
+            sorted_labels, order = self.label_lookup
+            labels = np.asarray(labels, dtype=sorted_labels.dtype)
+            positions = np.searchsorted(sorted_labels, labels)
+            found = positions < len(sorted_labels)
+            found[found] = sorted_labels[positions[found]] == labels[found]
+            if order is not None:
+                positions[found] = order[positions[found]]
+        else:
+            positions = self.encoded.index.get_indexer(labels)
+            found = positions >= 0
+        if not found.all():
+            raise KeyError(f"Unknown profile labels: {np.asarray(labels)[~found].tolist()}")
+        return positions
+
+    # Render profiles as dicts of the given columns (by default every raw and categorical column),
+    # read from the mapped arrays; categorical columns are decoded from their codes
+    def records(self, labels, columns=None):
+        positions = self.positions(labels).tolist()
+        if columns is None:
+            columns = list(self.columns) + [column for column in self.encoded.categories if column not in self.columns]
+        values = {}
+        for column in columns:
+            if column in self.columns:
+                stored = self.columns[column]
+                values[column] = ([stored[row] for row in positions] if isinstance(stored, StringHeap)
+                                  else stored[positions].tolist())
+            elif column in self.encoded.categories:
+                categories = self.encoded.categories[column]
+                values[column] = [None if code < 0 else categories[code]
+                                  for code in self.encoded.codes[column][positions].tolist()]
+            else:
+                raise KeyError(f"Column {column!r} is not stored in the index")
+        return [{column: values[column][i] for column in columns} for i in range(len(positions))]
+
+
+# Read-only destination (and destination+language) partitions of row positions, stored as sorted
+# position blocks. candidates() behaves like ProfilePartitions.candidates but returns a sorted array.
+class MappedPartitions:
+    def __init__(self, keys, offsets, positions):
+        self.blocks = {tuple(key): (offsets[i], offsets[i + 1]) for i, key in enumerate(keys)}
+        self.positions = positions
+
+    def _block(self, key):
+        bounds = self.blocks.get(key)
+        return None if bounds is None else self.positions[bounds[0]:bounds[1]]
+
+    def candidates(self, destination, languages=None):
+        destination = normalize_key(destination)
+        block = self._block((destination,))
+        if block is None:
+            return None
+        language_blocks = [self._block((destination, language)) for language in parse_languages(languages)]
+        language_blocks = [language_block for language_block in language_blocks if language_block is not None]
+        if len(language_blocks) == 1:
+            return language_blocks[0]
+        if language_blocks:
+            return np.unique(np.concatenate(language_blocks))
+        return block
+
+    sorted_candidates = candidates  # blocks are stored sorted
+
+
+def _partition_blocks(partitions):
+    blocks = [((destination,), ids) for destination, ids in partitions.by_destination.items()]
+    blocks += [(key, ids) for key, ids in partitions.by_language.items()]
+    return blocks
+
+
+# Serialize the encoded profiles, their keyword matrix, the partitions (row positions, as built by
+# batch_processing.build_partitions) and the synonym table into one index file, written atomically.
+# columns maps column names to raw values in row order, stored for rendering (see ProfileIndex.records).
+def write_index(path, encoded, partitions=None, synonyms=SYNONYMS, metadata=None, columns=None):
+    arrays = {f"codes/{column}": codes for column, codes in encoded.codes.items()}
+    matrix = encoded.keyword_matrix.tocsr()
+    arrays["keywords/data"] = matrix.data
+    arrays["keywords/indices"] = matrix.indices
+    arrays["keywords/indptr"] = matrix.indptr
+
+    if len(encoded.dead):
+        arrays["dead"] = np.asarray(encoded.dead, dtype=np.int64)
+
+    index_values = None
+    if encoded.index.dtype.kind in "iu":
+        labels = encoded.index.to_numpy()
+        arrays["index"] = labels
+        # Labels out of order, or repeated on deleted rows, get a sorted copy of the live ones for lookups
+        if len(encoded.dead) or np.any(labels[1:] <= labels[:-1]):
+            live = np.setdiff1d(np.arange(len(labels)), encoded.dead)
+            order = live[np.argsort(labels[live], kind="stable")]
+            arrays["labels/sorted"] = labels[order]
+            arrays["labels/order"] = order.astype(np.int64)
+    else:
+        index_values = encoded.index.tolist()
+
+    partition_keys = None
+    if partitions is not None:
+        blocks = _partition_blocks(partitions)
+        partition_keys = [list(key) for key, _ in blocks]
+        arrays["partitions/offsets"] = np.cumsum([0] + [len(ids) for _, ids in blocks], dtype=np.int64)
+        arrays["partitions/positions"] = np.concatenate(
+            [np.sort(np.fromiter(ids, dtype=np.int64, count=len(ids))) for _, ids in blocks] or [np.empty(0, np.int64)])
+
+    column_kinds = []
+    for number, (column, values) in enumerate((columns or {}).items()):
+        values = values.to_numpy() if isinstance(values, pd.Series) else np.asarray(values)
+        if len(values) != len(encoded):
+            raise ValueError(f"Column {column!r} has {len(values)} values for {len(encoded)} profiles")
+        if values.dtype.kind in "iufb":
+            arrays[f"columns/{number}/values"] = values
+            column_kinds.append([column, "number"])
+        else:
+            offsets, data, missing = StringHeap.encode(values)
+            arrays[f"columns/{number}/offsets"] = offsets
+            arrays[f"columns/{number}/data"] = data
+            if missing is not None:
+                arrays[f"columns/{number}/missing"] = missing
+            column_kinds.append([column, "string"])
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += array.nbytes
+    data_size = offset
+
+    digest = hashlib.sha256()
+    data = bytearray(data_size)
+    for name, array in arrays.items():
+        start = layout[name]["offset"]
+        data[start:start + array.nbytes] = array.tobytes()
+    digest.update(data)
+
+    header = {
+        "size": len(encoded),
+        "arrays": layout,
+        "data_size": data_size,
+        "sha256": digest.hexdigest(),
+        "index": index_values,
+        "categories": {column: values.tolist() for column, values in encoded.categories.items()},
+        "vocabulary": sorted(encoded.vocabulary, key=encoded.vocabulary.get),
+        "keyword_shape": list(matrix.shape),
+        "partition_keys": partition_keys,
+        "columns": column_kinds,
+        "synonyms": synonyms,
+        "metadata": metadata or {},
+    }
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(_PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    header_bytes = header_bytes.ljust(data_start - _PREAMBLE.size)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as index_file:
+        index_file.write(_PREAMBLE.pack(MAGIC, SCHEMA_VERSION, len(header_bytes)))
+        index_file.write(header_bytes)
+        index_file.write(data)
+    os.replace(temporary_path, path)
+    logger.info(f"Wrote profile index for {len(encoded)} profiles to {path}")
+
+
+# Build the index file straight from a profile table, storing the named columns raw for rendering
+def build_index(profiles, path, by_language=False, synonyms=SYNONYMS, metadata=None, columns=()):
+    from batch_processing import build_partitions
+    encoded = encode_profiles(profiles)
+    partitions = build_partitions(profiles, by_language=by_language)
+    write_index(path, encoded, partitions, synonyms, metadata, {column: profiles[column] for column in columns})
+    return encoded
+
+
+# Memory-map an index file. The schema version must match this code and, with verify, the data
+# section must match its recorded checksum; either failure raises IndexFileError.
+def load_index(path, verify=True):
+    with open(path, "rb") as index_file:
+        buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < _PREAMBLE.size:
+        raise IndexFileError(f"{path} is not a profile index file")
+    magic, version, header_size = _PREAMBLE.unpack_from(buffer)
+    if magic != MAGIC:
+        raise IndexFileError(f"{path} is not a profile index file")
+    if version != SCHEMA_VERSION:
+        raise IndexFileError(f"{path} has schema version {version}, expected {SCHEMA_VERSION}; rebuild it")
+    try:
+        header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_size]))
+    except ValueError as e:
+        raise IndexFileError(f"{path} has a corrupt header: {e}") from None
+
+    data_start = _PREAMBLE.size + header_size
+    if len(buffer) != data_start + header["data_size"]:
+        raise IndexFileError(f"{path} is truncated or has trailing data")
+    data = memoryview(buffer)[data_start:]
+    if verify and hashlib.sha256(data).hexdigest() != header["sha256"]:
+        raise IndexFileError(f"{path} failed its checksum; rebuild it")
+
+    def array(name):
+        spec = header["arrays"][name]
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        return np.frombuffer(data, dtype=np.dtype(spec["dtype"]), count=count, offset=spec["offset"]).reshape(spec["shape"])
+
+    codes = {name.split("/", 1)[1]: array(name) for name in header["arrays"] if name.startswith("codes/")}
+    keyword_matrix = sparse.csr_matrix(
+        (array("keywords/data"), array("keywords/indices"), array("keywords/indptr")),
+        shape=tuple(header["keyword_shape"]), copy=False,
+    )
+    index = pd.Index(array("index")) if header["index"] is None else pd.Index(header["index"])
+    categories = {column: pd.Index(values) for column, values in header["categories"].items()}
+    vocabulary = {term: column for column, term in enumerate(header["vocabulary"])}
+    encoded = EncodedProfiles(index, codes, categories, keyword_matrix, vocabulary)
+    if "dead" in header["arrays"]:
+        encoded.dead = array("dead")
+
+    partitions = None
+    if header["partition_keys"] is not None:
+        partitions = MappedPartitions(header["partition_keys"], array("partitions/offsets").tolist(),
+                                      array("partitions/positions"))
+    columns = {}
+    for number, (column, kind) in enumerate(header.get("columns", [])):
+        if kind == "number":
+            columns[column] = array(f"columns/{number}/values")
+        else:
+            missing = f"columns/{number}/missing"
+            columns[column] = StringHeap(array(f"columns/{number}/offsets"), array(f"columns/{number}/data"),
+                                         array(missing) if missing in header["arrays"] else None)
+    label_lookup = None
+    if "labels/order" in header["arrays"]:
+        label_lookup = (array("labels/sorted"), array("labels/order"))
+    elif header["index"] is None:
+        label_lookup = (array("index"), None)
+    metadata = {"schema_version": version, "size": header["size"], **header["metadata"]}
+    return ProfileIndex(encoded, partitions, header["synonyms"], metadata, columns, label_lookup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a profile index file from a profile spreadsheet")
+    parser.add_argument("profiles", help="profile spreadsheet (e.g. Dummy-Buddy-Profiles-Batch1.xlsx)")
+    parser.add_argument("output", help="index file to write")
+    parser.add_argument("--by-language", action="store_true", help="also partition by destination and language")
+    parser.add_argument("--columns", nargs="*", default=[], help="columns to store raw, for rendering matches")
+    args = parser.parse_args()
+
+    from batch_processing import preprocess_data
+    from profile_cache import file_sha256, read_excel_cached
+    profiles = preprocess_data(read_excel_cached(args.profiles))
+    build_index(profiles, args.output, args.by_language, columns=args.columns,
+                metadata={"source": args.profiles, "source_sha256": file_sha256(args.profiles)})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,283 @@
+import json
+import logging
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from partitions import ProfilePartitions
+from scoring_engine import CATEGORY_FIELDS, KEYWORD_FIELD, EncodedProfiles, encode_profiles, split_keywords
+
+logger = logging.getLogger(__name__)
+
+ID_FIELD = "Buddy_id"
+CATEGORY_COLUMNS = [column for _, column, _ in CATEGORY_FIELDS]
+
+# Deleted rows stay in the arrays (masked out of scoring) until they outnumber the live ones,
+# and at least this many have piled up; then the store compacts itself
+COMPACT_MIN_DEAD = 1024
+
+
+# Copy of a buffer with room for size entries, the new tail set to fill
+def _resized(array, size, fill):
+    resized = np.full(size, fill, dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+
+# Capacity to grow a buffer to so that it fits needed entries; doubling keeps appends amortized O(1)
+def _capacity(current, needed):
+    return max(needed, 2 * current, 16)
+
+
+# In-memory profile store for find_best_buddies that takes appends, updates and deletes keyed on
+# Buddy_id without re-encoding the table. Rows live in growable code and keyword CSR buffers:
+#   append  new row at the end; unseen category values and keywords get new codes/columns
+#   update  the old row is tombstoned and the profile re-appended
+#   delete  the row is tombstoned (masked out of scoring) and dropped from its partitions
+# Every change costs O(size of the profile), so a batch of changes costs O(delta), not O(total).
+# Rankings are returned as Buddy_ids. Use it wherever EncodedProfiles is accepted:
+#
+#     store = ProfileStore.from_profiles(profiles)
+#     find_best_buddies(request, None, store, store.partitions)
+class ProfileStore(EncodedProfiles):
+    def __init__(self, by_language=False):
+        self.by_language = by_language
+        self._size = 0
+        self._labels = np.empty(0, dtype=np.int64)
+        self._codes = {column: np.empty(0, dtype=np.int32) for column in CATEGORY_COLUMNS}
+        self._category_values = {column: [] for column in CATEGORY_COLUMNS}
+        self._lookups = {column: {} for column in CATEGORY_COLUMNS}  # read by code_for
+        self._vocabulary = {}
+        self._keyword_data = np.empty(0, dtype=np.int32)
+        self._keyword_indices = np.empty(0, dtype=np.int32)
+        self._keyword_indptr = np.zeros(1, dtype=np.int32)
+        self._nnz = 0
+        self._rows = {}     # Buddy_id -> row
+        self._records = {}  # Buddy_id -> profile fields, for to_frame()
+        self._dead = set()  # tombstoned rows
+        self._compiled = {}
+        self._views = {}    # cached index / categories / matrix / dead views, dropped on change
+        self.partitions = ProfilePartitions()
+
+    # Store holding a profile table (which must have a Buddy_id column), encoded in one pass
+    @classmethod
+    def from_profiles(cls, profiles, by_language=False):
+        store = cls(by_language)
+        encoded = encode_profiles(profiles.reset_index(drop=True))
+        size = len(profiles)
+        store._size = size
+        store._labels = profiles[ID_FIELD].to_numpy(dtype=np.int64, copy=True)
+        for column in CATEGORY_COLUMNS:
+            store._codes[column] = encoded.codes[column].astype(np.int32)
+            values = encoded.categories[column].tolist() if column in encoded.categories else []
+            store._category_values[column] = values
+            store._lookups[column] = {value: code for code, value in enumerate(values)}
+        matrix = encoded.keyword_matrix.tocsr()
+        store._vocabulary = dict(encoded.vocabulary)
+        store._keyword_data = matrix.data.astype(np.int32)
+        store._keyword_indices = matrix.indices.astype(np.int32)
+        store._keyword_indptr = matrix.indptr.astype(np.int32)
+        store._nnz = matrix.nnz
+        columns = profiles.columns.tolist()
+        values = zip(*(profiles[column].tolist() for column in columns))  # much faster than to_dict("records")
+        store._records = {buddy_id: dict(zip(columns, row)) for buddy_id, row in zip(store._labels.tolist(), values)}
+        store._rows = {buddy_id: row for row, buddy_id in enumerate(store._labels.tolist())}
+        if len(store._rows) != size:
+            raise ValueError(f"{ID_FIELD} values must be unique")
+        for row, record in enumerate(store._records.values()):
+            store._partition(row, record)
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, buddy_id):
+        return buddy_id in self._rows
+
+    @property
+    def live_count(self):
+        return self._size - len(self._dead)
+
+    def _view(self, name, build):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    @property
+    def index(self):
+        return self._view("index", lambda: pd.Index(self._labels[:self._size]))
+
+    @property
+    def codes(self):
+        return {column: codes[:self._size] for column, codes in self._codes.items()}
+
+    @property
+    def categories(self):
+        return self._view("categories", lambda: {
+            column: pd.Index(values, dtype=object) for column, values in self._category_values.items()})
+
+    @property
+    def vocabulary(self):
+        return self._vocabulary
+
+    @property
+    def keyword_matrix(self):
+        return self._view("keyword_matrix", lambda: sparse.csr_matrix(
+            (self._keyword_data[:self._nnz], self._keyword_indices[:self._nnz],
+             self._keyword_indptr[:self._size + 1]),
+            shape=(self._size, len(self._vocabulary)), copy=False))
+
+    @property
+    def dead(self):
+        return self._view("dead", lambda: np.array(sorted(self._dead), dtype=np.intp))
+
+    def _changed(self, new_terms=False):
+        self._views.clear()
+        if new_terms:
+            # Compiled scenarios hold codes; a new category value or keyword can change them
+            self._compiled.clear()
+
+    def _partition(self, row, record):
+        languages = record.get("User Language") if self.by_language else None
+        self.partitions.add(row, record.get("Destination"), languages)
+
+    def _code(self, column, value):
+        if value is None or pd.isna(value):
+            return -1, False
+        lookup = self._lookups[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self._category_values[column])
+            self._category_values[column].append(value)
+            return code, True
+        return code, False
+
+    def _append(self, record):
+        row = self._size
+        new_terms = False
+        if row == len(self._labels):
+            capacity = _capacity(row, row + 1)
+            self._labels = _resized(self._labels, capacity, 0)
+            self._codes = {column: _resized(codes, capacity, -1) for column, codes in self._codes.items()}
+            self._keyword_indptr = _resized(self._keyword_indptr, capacity + 1, 0)
+        self._labels[row] = record[ID_FIELD]
+        for column in CATEGORY_COLUMNS:
+            self._codes[column][row], added = self._code(column, record.get(column))
+            new_terms |= added
+
+        value = record.get(KEYWORD_FIELD)
+        columns = []
+        for token in set(split_keywords(value)) if value is not None else ():
+            column = self._vocabulary.get(token)
+            if column is None:
+                column = self._vocabulary[token] = len(self._vocabulary)
+                new_terms = True
+            columns.append(column)
+        end = self._nnz + len(columns)
+        if end > len(self._keyword_indices):
+            capacity = _capacity(len(self._keyword_indices), end)
+            self._keyword_data = _resized(self._keyword_data, capacity, 1)
+            self._keyword_indices = _resized(self._keyword_indices, capacity, 0)
+        self._keyword_data[self._nnz:end] = 1
+        self._keyword_indices[self._nnz:end] = sorted(columns)
+        self._keyword_indptr[row + 1] = end
+        self._nnz = end
+
+        self._size = row + 1
+        self._rows[record[ID_FIELD]] = row
+        self._records[record[ID_FIELD]] = record
+        self._partition(row, record)
+        self._changed(new_terms)
+
+    def _tombstone(self, buddy_id):
+        row = self._rows.pop(buddy_id)
+        del self._records[buddy_id]
+        self._dead.add(row)
+        self.partitions.remove(row)
+        self._changed()
+
+    # Add a profile, or replace the one with the same Buddy_id. Fields follow the profile
+    # spreadsheet's columns; missing ones are treated as empty.
+    def upsert(self, record):
+        record = dict(record)
+        if record.get(ID_FIELD) is None:
+            raise ValueError(f"Profile has no {ID_FIELD}: {record}")
+        if record[ID_FIELD] in self._rows:
+            self._tombstone(record[ID_FIELD])
+        self._append(record)
+        self._maybe_compact()
+
+    # Remove a profile; returns False if there was none with that Buddy_id
+    def delete(self, buddy_id):
+        if buddy_id not in self._rows:
+            return False
+        self._tombstone(buddy_id)
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        if len(self._dead) >= COMPACT_MIN_DEAD and len(self._dead) > self.live_count:
+            self.compact()
+
+    # Rewrite the store without its tombstoned rows (O(total); done automatically when they pile up)
+    def compact(self):
+        logger.info(f"Compacting profile store: {self.live_count} live rows, {len(self._dead)} deleted")
+        compacted = ProfileStore.from_profiles(self.to_frame().reset_index(), self.by_language)
+        self.__dict__.update(compacted.__dict__)
+
+    # The live profiles as a DataFrame indexed by Buddy_id, in row order
+    def to_frame(self):
+        order = sorted(self._rows, key=self._rows.get)
+        frame = pd.DataFrame([self._records[buddy_id] for buddy_id in order])
+        if frame.empty:
+            return pd.DataFrame(columns=[ID_FIELD]).set_index(ID_FIELD)
+        return frame.set_index(ID_FIELD)
+
+    def profile(self, buddy_id):
+        return self._records.get(buddy_id)
+
+    # One column's raw values in row order, None on deleted rows (e.g. for an index file's columns)
+    def column_values(self, column):
+        values = [None] * len(self)
+        for buddy_id, row in self._rows.items():
+            values[row] = self._records[buddy_id].get(column)
+        return values
+
+
+# Apply a change feed: an iterable of change records, each either
+#   {"op": "upsert", "Buddy_id": 7, "Destination": "Paris", ...}   (op defaults to "upsert")
+#   {"op": "delete", "Buddy_id": 7}
+# Returns how many upserts, deletes and deletes of unknown ids were applied.
+def apply_changes(store, changes):
+    applied = Counter()
+    for change in changes:
+        change = dict(change)
+        op = change.pop("op", "upsert")
+        if op == "upsert":
+            store.upsert(change)
+            applied["upserts"] += 1
+        elif op == "delete":
+            applied["deletes" if store.delete(change.get(ID_FIELD)) else "missing"] += 1
+        else:
+            raise ValueError(f"Unknown change op {op!r} for {ID_FIELD} {change.get(ID_FIELD)}")
+    return dict(applied)
+
+
+def _read_changes(path):
+    with open(path) as delta_file:
+        for line_number, line in enumerate(delta_file, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line_number}: invalid change record: {e}") from None
+
+
+# Apply a JSONL delta file (one change record per line, see apply_changes), streaming it line by line
+def apply_delta_file(store, path):
+    applied = apply_changes(store, _read_changes(path))
+    logger.info(f"Applied {path}: {applied}")
+    return applied
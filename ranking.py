@@ -0,0 +1,12 @@
+import heapq
+
+
+# Order (item, score) pairs best first, breaking ties on ascending id so results are deterministic.
+# With top_k only the best k are kept, using a bounded heap (O(n log k)) instead of a full sort.
+def rank_by_score(scored, top_k=None, id_of=lambda item: item.id):
+    def key(pair):
+        return -pair[1], id_of(pair[0])
+
+    if top_k is None:
+        return sorted(scored, key=key)
+    return heapq.nsmallest(top_k, scored, key=key)
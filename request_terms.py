@@ -0,0 +1,64 @@
+import sys
+from weakref import WeakKeyDictionary
+
+# Fields of a BuddySearchRequest, in the order they are compiled
+REQUEST_FIELDS = ("destination", "language", "keywords", "event", "package")
+
+
+def _intern(value):
+    return sys.intern(value.lower())
+
+
+# A BuddySearchRequest normalized once, the way match_buddies compares it: every field lower-cased
+# and interned, and the keywords split on commas and trimmed (empty terms kept, as the old split
+# did). It has the same attributes as the request, so it can be passed anywhere one is expected.
+# keyword_set holds the distinct non-empty terms, synonym-folded when compiled with an expand function.
+class CompiledRequest:
+    __slots__ = ("destination", "language", "keywords", "event", "package", "keyword_terms", "keyword_set")
+
+    def __init__(self, destination, language, keywords, event, package, expand=None):
+        self.destination = _intern(destination or "")
+        self.language = _intern(language or "")
+        self.keywords = _intern(keywords or "")
+        self.event = _intern(event or "")
+        self.package = _intern(package or "")
+        self.keyword_terms = tuple(sys.intern(term.strip()) for term in self.keywords.split(",")) if self.keywords else ()
+        terms = [term for term in self.keyword_terms if term]
+        self.keyword_set = frozenset(expand(terms) if expand is not None else terms)
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in REQUEST_FIELDS)
+        return f"CompiledRequest({fields})"
+
+
+# Compiled requests kept per expand owner (the KeywordIndex of a bound expand method), so dropping
+# or rebuilding an index drops its entries too; requests compiled without expand share _plain_memo.
+MEMO_SIZE = 4096
+_plain_memo = {}
+_index_memos = WeakKeyDictionary()
+
+
+def _memo_for(expand):
+    if expand is None:
+        return _plain_memo
+    owner = getattr(expand, "__self__", expand)
+    return _index_memos.setdefault(owner, {})
+
+
+def _compile(fields, expand):
+    memo = _memo_for(expand)
+    compiled = memo.get(fields)
+    if compiled is None:
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        compiled = memo[fields] = CompiledRequest(*fields, expand=expand)
+    return compiled
+
+
+# Compile a request (anything with the BuddySearchRequest attributes). Identical requests share one
+# memoized CompiledRequest; an already compiled request is returned as it is. expand (for example
+# KeywordIndex.expand) folds keywords into synonym groups for keyword_set.
+def compile_request(request, expand=None):
+    if isinstance(request, CompiledRequest):
+        return request
+    return _compile(tuple(getattr(request, field) for field in REQUEST_FIELDS), expand)
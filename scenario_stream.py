@@ -0,0 +1,50 @@
+import csv
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+METRIC_COLUMNS = ["Scenario", "Data Size", "Top Buddy Scores"]
+
+
+# Yield DataFrames of at most chunk_size scenarios from a CSV, JSONL, Parquet or Excel file.
+# CSV, JSONL and Parquet are read incrementally; Excel cannot be, so it is loaded once and sliced.
+def iter_scenario_chunks(path, chunk_size=10_000):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif extension in (".jsonl", ".ndjson"):
+        with pd.read_json(path, lines=True, chunksize=chunk_size) as reader:
+            yield from reader
+    elif extension == ".parquet":
+        from pyarrow import parquet
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif extension in (".xlsx", ".xls"):
+        scenarios = pd.read_excel(path)
+        for start in range(0, len(scenarios), chunk_size):
+            yield scenarios.iloc[start:start + chunk_size]
+    else:
+        raise ValueError(f"Unsupported scenario file type: {path}")
+
+
+# Append metric rows to a CSV as they arrive, writing the header only for a new file and flushing
+# every flush_every rows so a crashed run leaves everything up to the last flush on disk.
+# Returns the number of rows written.
+def write_metric_rows(rows, output_file, flush_every=1_000):
+    write_header = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+    written = 0
+    with open(output_file, "a", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=METRIC_COLUMNS)
+        if write_header:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+            if written % flush_every == 0:
+                output.flush()
+                os.fsync(output.fileno())
+                logger.info(f"Flushed {written} metric rows to {output_file}")
+    return written
@@ -0,0 +1,350 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from keyword_scoring import BATCH_WEIGHTS, KeywordMatrix
+from stage_metrics import NO_METRICS
+
+# Request keys compared by plain equality against a profile column, with the points each match is
+# worth by default. The scorers take a keyword_scoring.ScoringWeights to use other points.
+CATEGORY_FIELDS = [
+    ("destination", "Destination", BATCH_WEIGHTS.destination),
+    ("language", "User Language", BATCH_WEIGHTS.language),
+    ("local_language", "Local Language", BATCH_WEIGHTS.local_language),
+    ("event", "Event", BATCH_WEIGHTS.event),
+    ("package", "Package", BATCH_WEIGHTS.package),
+]
+KEYWORD_FIELD = "Keywords"
+KEYWORD_WEIGHT = BATCH_WEIGHTS.keywords
+
+# Code assigned to request values that cannot equal any profile value (NaN, unseen values)
+NO_MATCH = -2
+
+# Score given to deleted rows (see profile_store), below anything a live profile can score
+DEAD_SCORE = np.iinfo(np.int32).min
+
+# Request keys a scenario is compiled from
+REQUEST_KEYS = [key for key, _, _ in CATEGORY_FIELDS] + ["keywords"]
+
+# Compiled scenarios memoized per EncodedProfiles; the memo is dropped when it reaches this size
+COMPILED_CACHE_SIZE = 4096
+
+
+# A scenario translated once into an EncodedProfiles' terms: one code per category column, and the
+# vocabulary columns (with repeat counts) of its keywords. Scoring it only compares integers.
+class CompiledScenario:
+    __slots__ = ("values", "codes", "keyword_columns", "keyword_counts")
+
+    def __init__(self, values, codes, keyword_columns, keyword_counts):
+        self.values = values                    # request key -> raw value
+        self.codes = codes                      # profile column -> code, NO_MATCH if nothing can equal it
+        self.keyword_columns = keyword_columns  # vocabulary columns of the request keywords
+        self.keyword_counts = keyword_counts    # how often each appears (repeats score repeatedly)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+
+# Column-oriented, integer-coded view of the profile table used by the vectorized scorer
+class EncodedProfiles:
+    def __init__(self, index, codes, categories, keyword_matrix, vocabulary):
+        self.index = index                    # profile index labels, in row order
+        self.codes = codes                    # column name -> integer codes (-1 for NaN)
+        self.categories = categories          # column name -> pd.Index of distinct values
+        self.keyword_matrix = keyword_matrix  # CSR (profiles x vocabulary), 1 where a profile has the keyword
+        self.vocabulary = vocabulary          # keyword token -> column in keyword_matrix
+        self._lookups = {}                    # column name -> {value: code}, built on first use
+        self._compiled = {}                   # request values -> CompiledScenario
+        self.dead = np.empty(0, dtype=np.intp)  # sorted row positions of deleted profiles, never ranked
+
+    def __len__(self):
+        return len(self.index)
+
+    # Rows that can be ranked (all of them, unless rows were deleted in place)
+    @property
+    def live_count(self):
+        return len(self) - len(self.dead)
+
+    # The keyword matrix with its scoring methods (see keyword_scoring)
+    @property
+    def keywords(self):
+        return KeywordMatrix(self.keyword_matrix, self.vocabulary)
+
+    # Translate a request value into the integer code used for the given column
+    def code_for(self, column, value):
+        if column not in self.categories or pd.isna(value):
+            return NO_MATCH
+        lookup = self._lookups.get(column)
+        if lookup is None:
+            lookup = self._lookups[column] = {category: code for code, category in enumerate(self.categories[column])}
+        return lookup.get(value, NO_MATCH)
+
+    # Compile a scenario (a Series or dict with the REQUEST_KEYS) against these profiles, memoized
+    # on its values so repeated scenarios are translated once; a compiled scenario passes through
+    def compile(self, request):
+        if isinstance(request, CompiledScenario):
+            return request
+        values = {key: request.get(key) for key in REQUEST_KEYS}
+        memo_key = tuple(None if pd.isna(value) else value for value in values.values())
+        compiled = self._compiled.get(memo_key)
+        if compiled is None:
+            codes = {column: self.code_for(column, values[key]) for key, column, _ in CATEGORY_FIELDS}
+            counts = {}
+            for token in split_keywords(values["keywords"]):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            compiled = CompiledScenario(values, codes, np.fromiter(counts, dtype=np.intp, count=len(counts)),
+                                        np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+            if len(self._compiled) >= COMPILED_CACHE_SIZE:
+                self._compiled.clear()
+            self._compiled[memo_key] = compiled
+        return compiled
+
+
+# Split a raw keyword cell the same way the row-by-row matcher always has (comma split, no trimming)
+def split_keywords(value):
+    return str(value).split(',') if pd.notna(value) else []
+
+
+# Integer codes (-1 for NaN) and distinct values of one column. Categorical columns (see
+# compact_profiles) already hold exactly this, so their codes are used without re-encoding.
+def column_codes(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), pd.Index(values.cat.categories)
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    return codes.astype(np.int32), pd.Index(uniques)
+
+
+# Profiles x vocabulary keyword matrix, tokenized with split_keywords. Each distinct keyword string
+# is parsed once; rows are then gathered by value code, with code -1 (NaN) on an empty row.
+def keyword_matrix_for(values):
+    value_codes, distinct = column_codes(values)
+    keywords = KeywordMatrix.from_codes(value_codes, distinct, split_keywords)
+    return keywords.matrix, keywords.vocabulary
+
+
+# Encode the categorical columns and keyword lists of the profile table once, up front
+def encode_profiles(profiles):
+    codes = {}
+    categories = {}
+    for _, column, _ in CATEGORY_FIELDS:
+        if column in profiles.columns:
+            codes[column], categories[column] = column_codes(profiles[column])
+        else:
+            codes[column] = np.full(len(profiles), -1, dtype=np.int32)
+
+    if KEYWORD_FIELD in profiles.columns:
+        keyword_matrix, vocabulary = keyword_matrix_for(profiles[KEYWORD_FIELD])
+    else:
+        keyword_matrix, vocabulary = sparse.csr_matrix((len(profiles), 0), dtype=np.int32), {}
+
+    return EncodedProfiles(profiles.index, codes, categories, keyword_matrix, vocabulary)
+
+
+# Text columns worth storing as pandas Categoricals: integer codes plus one copy of each distinct value
+COMPACT_COLUMNS = [column for _, column, _ in CATEGORY_FIELDS] + [KEYWORD_FIELD]
+
+
+# Convert repetitive text columns to Categoricals. Columns where most values are distinct stay as
+# they are, since a categorical would only add a codes array on top of the strings. Under pandas
+# copy-on-write the untouched columns are shared with the input rather than copied.
+def compact_profiles(profiles, max_distinct_ratio=0.5):
+    conversions = {}
+    for column in COMPACT_COLUMNS:
+        if column in profiles.columns and not isinstance(profiles[column].dtype, pd.CategoricalDtype):
+            if profiles[column].nunique(dropna=True) <= max_distinct_ratio * len(profiles):
+                conversions[column] = "category"
+    return profiles.astype(conversions) if conversions else profiles
+
+
+# Bytes held by a profile table, including the Python string objects in text columns
+def frame_nbytes(profiles):
+    return int(profiles.memory_usage(deep=True).sum())
+
+
+# Count how often each vocabulary keyword appears in the request (repeats score repeatedly)
+def request_keyword_vector(request, encoded):
+    compiled = encoded.compile(request)
+    vector = np.zeros(len(encoded.vocabulary), dtype=np.int64)
+    vector[compiled.keyword_columns] = compiled.keyword_counts
+    return vector
+
+
+# The category-field points alone (no keywords, deleted rows not masked), as score_profiles adds them up
+def category_scores(request, encoded, positions=None, weights=BATCH_WEIGHTS):
+    compiled = encoded.compile(request)
+    size = len(encoded) if positions is None else len(positions)
+    scores = np.zeros(size, dtype=np.int64)
+    for key, column, _ in CATEGORY_FIELDS:
+        code = compiled.codes[column]
+        weight = getattr(weights, key)
+        if code != NO_MATCH and weight:
+            codes = encoded.codes[column] if positions is None else encoded.codes[column][positions]
+            scores += weight * (codes == code)
+    return scores
+
+
+# Score every profile against a single request (raw or compiled) in one pass over the coded columns.
+# With positions (sorted row positions, e.g. a destination partition) only that block is scored.
+def score_profiles(request, encoded, positions=None, weights=BATCH_WEIGHTS):
+    compiled = encoded.compile(request)
+    scores = category_scores(compiled, encoded, positions, weights)
+    if len(compiled.keyword_columns):
+        scores += encoded.keywords.vector_scores(request_keyword_vector(compiled, encoded), weights, positions)
+    if len(encoded.dead):
+        scores[encoded.dead if positions is None else np.isin(positions, encoded.dead)] = DEAD_SCORE
+    return scores
+
+
+# Highest scores first; equal scores keep profile order, like a stable descending sort.
+# Only the profiles at or above the k-th best score are sorted (see top_k_positions).
+def top_indices(scores, index, k=5):
+    return index[top_k_positions(scores[None, :], k)[0]].tolist()
+
+
+# Vectorized code_for over a column of request values
+def codes_for(encoded, column, values):
+    values = pd.Series(values)
+    if column not in encoded.categories:
+        return np.full(len(values), NO_MATCH, dtype=np.int64)
+    codes = encoded.categories[column].get_indexer(values).astype(np.int64)
+    codes[(codes < 0) | values.isna().to_numpy()] = NO_MATCH
+    return codes
+
+
+# Keyword counts for a block of requests as a sparse (requests x vocabulary) matrix
+def request_keyword_matrix(requests, encoded):
+    rows, cols = [], []
+    for row, value in enumerate(requests['keywords']):
+        for token in split_keywords(value):
+            column = encoded.vocabulary.get(token)
+            if column is not None:
+                rows.append(row)
+                cols.append(column)
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)),
+        shape=(len(requests), len(encoded.vocabulary)),
+    )
+
+
+# Score a block of requests (a DataFrame of scenarios) against every profile: (requests x profiles)
+def score_matrix(requests, encoded, weights=BATCH_WEIGHTS):
+    scores = np.zeros((len(requests), len(encoded)), dtype=np.int32)
+    matches = np.empty(scores.shape, dtype=bool)
+    for key, column, _ in CATEGORY_FIELDS:
+        weight = getattr(weights, key)
+        if not weight:
+            continue
+        request_codes = codes_for(encoded, column, requests[key])
+        np.equal(request_codes[:, None], encoded.codes[column][None, :], out=matches)
+        scores += matches * np.int32(weight)
+
+    keyword_matrix = request_keyword_matrix(requests, encoded)
+    if keyword_matrix.nnz and weights.keywords:
+        scores += encoded.keywords.block_scores(keyword_matrix, weights)
+    scores[:, encoded.dead] = DEAD_SCORE
+    return scores
+
+
+# Per-row top k positions of a score matrix, best first; ties go to the earlier profile.
+# A partition finds each row's k-th best score, so only the few candidates at or above it are sorted.
+def top_k_positions(scores, k=5):
+    n = scores.shape[1]
+    k = min(k, n)
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    thresholds = np.partition(scores, n - k, axis=1)[:, n - k]
+    positions = np.empty((scores.shape[0], k), dtype=np.intp)
+    for row, threshold in enumerate(thresholds):
+        above = np.flatnonzero(scores[row] > threshold)
+        tied = np.flatnonzero(scores[row] == threshold)[:k - len(above)]
+        candidates = np.concatenate([above, tied])
+        positions[row] = candidates[np.argsort(-scores[row, candidates], kind="stable")]
+    return positions
+
+
+# Most keyword points a profile can get from the request: matching every request keyword
+def max_keyword_points(compiled, weights=BATCH_WEIGHTS):
+    if not len(compiled.keyword_columns):
+        return 0
+    return weights.keywords * (int(compiled.keyword_counts.sum()) if weights.keyword_mode == "each" else 1)
+
+
+# Top k row positions for one request, best first, exactly as top_k_positions over score_profiles
+# would return them, with the keyword points (the costly sparse product) only computed where they can
+# matter. The category points are scored for every row first; a row can then score at most that plus
+# max_keyword_points. Rows are taken in buckets of equal category points, highest first, until the
+# k-th best score beats every remaining bucket's bound. With positions only those rows are considered.
+def pruned_top_positions(request, encoded, k=5, positions=None, weights=BATCH_WEIGHTS, metrics=NO_METRICS):
+    compiled = encoded.compile(request)
+    rows = np.arange(len(encoded)) if positions is None else np.asarray(positions)
+    dead = np.isin(rows, encoded.dead) if len(encoded.dead) else None
+    k = min(k, len(rows) - (int(dead.sum()) if dead is not None else 0))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if any(getattr(weights, key) < 0 for key in weights.FIELDS):
+        # A negative weight breaks the bounds; score everything
+        return rows[top_k_positions(score_profiles(compiled, encoded, positions, weights)[None, :], k)[0]]
+
+    category_points = np.zeros(len(rows), dtype=np.int64)
+    bucket_values = {0}  # the possible category points: sums of every subset of the matchable weights
+    for key, column, _ in CATEGORY_FIELDS:
+        code = compiled.codes[column]
+        weight = getattr(weights, key)
+        if code != NO_MATCH and weight:
+            codes = encoded.codes[column] if positions is None else encoded.codes[column][rows]
+            category_points += weight * (codes == code)
+            bucket_values |= {value + weight for value in bucket_values}
+    if dead is not None:
+        category_points[dead] = DEAD_SCORE
+    keyword_bound = max_keyword_points(compiled, weights)
+    vector = request_keyword_vector(compiled, encoded) if keyword_bound else None
+
+    buckets, scores = [], []
+    threshold = None
+    for bucket_points in sorted(bucket_values, reverse=True):
+        # Ties go to the earlier profile, so a bucket that can only equal the k-th best still counts
+        if threshold is not None and bucket_points + keyword_bound < threshold:
+            break
+        bucket = np.flatnonzero(category_points == bucket_points)
+        if not len(bucket):
+            continue
+        bucket_scores = category_points[bucket]
+        if vector is not None:
+            bucket_scores = bucket_scores + encoded.keywords.vector_scores(vector, weights, rows[bucket])
+        buckets.append(bucket)
+        scores.append(bucket_scores)
+        if sum(map(len, buckets)) >= k:
+            best = np.concatenate(scores)
+            threshold = np.partition(best, len(best) - k)[len(best) - k]
+
+    # Back to profile order, so ties resolve as they do when every row is scored
+    buckets = np.concatenate(buckets)
+    scores = np.concatenate(scores)
+    order = np.argsort(buckets, kind="stable")
+    metrics.count("candidates_scanned", len(rows))
+    metrics.count("candidates_keyword_scored", len(buckets))
+    return rows[buckets[order][top_k_positions(scores[order][None, :], k)[0]]]
+
+
+# Bound the score matrix to roughly max_cells entries by scoring scenarios in chunks
+def chunk_rows(encoded, max_cells=8_000_000):
+    return max(1, max_cells // max(1, len(encoded)))
+
+
+# Top k profile index labels for every scenario, computed chunk by chunk
+def batch_top_indices(scenarios, encoded, k=5, max_cells=8_000_000, metrics=NO_METRICS, weights=BATCH_WEIGHTS):
+    chunk_size = chunk_rows(encoded, max_cells)
+    k = min(k, encoded.live_count)
+    results = []
+    for start in range(0, len(scenarios), chunk_size):
+        chunk = scenarios.iloc[start:start + chunk_size]
+        with metrics.stage("score"):
+            scores = score_matrix(chunk, encoded, weights)
+        with metrics.stage("topk"):
+            positions = top_k_positions(scores, k)
+            results.extend(encoded.index[row].tolist() for row in positions)
+        metrics.count("candidates_scanned", scores.size)
+        metrics.count("candidates_returned", positions.size)
+    return results
@@ -0,0 +1,129 @@
+import logging
+import os
+import re
+
+from profile_index import IndexFileError, load_index, write_index
+
+logger = logging.getLogger(__name__)
+
+# A shared profile directory holds numbered generation files (profile index files, see
+# profile_index) and a CURRENT file naming the live one:
+#
+#     profiles/CURRENT                    "profiles-00000003.idx"
+#     profiles/profiles-00000002.idx      previous generation, kept for readers still on it
+#     profiles/profiles-00000003.idx
+#
+# Readers memory-map the generation CURRENT names, so every worker process on the machine shares
+# one copy of the arrays through the OS page cache instead of holding its own. A refresh writes
+# the next generation, then swaps CURRENT with an atomic rename; readers pick it up on their next
+# call. One process publishes at a time.
+CURRENT_FILE = "CURRENT"
+GENERATION_PATTERN = re.compile(r"^profiles-(\d{8})\.idx$")
+KEEP_GENERATIONS = 2
+
+
+def _generation_file(generation):
+    return f"profiles-{generation:08d}.idx"
+
+
+# Generation numbers present in the directory, oldest first
+def generations(directory):
+    found = []
+    for name in os.listdir(directory):
+        match = GENERATION_PATTERN.match(name)
+        if match:
+            found.append(int(match.group(1)))
+    return sorted(found)
+
+
+# The generation file CURRENT names, or None before anything was published
+def current_file(directory):
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as current:
+            return os.path.join(directory, current.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+# Write encoded profiles (EncodedProfiles or a ProfileStore) as the next generation and make it
+# current. columns are raw values per row for rendering (see ProfileIndex.records). Generations
+# older than the newest keep are removed; readers that still map one keep reading it, as an
+# unlinked file stays alive until it is unmapped. Returns the new generation number.
+def publish(directory, encoded, partitions=None, columns=None, metadata=None, keep=KEEP_GENERATIONS):
+    os.makedirs(directory, exist_ok=True)
+    existing = generations(directory)
+    generation = existing[-1] + 1 if existing else 1
+    name = _generation_file(generation)
+    write_index(os.path.join(directory, name), encoded, partitions, columns=columns,
+                metadata={**(metadata or {}), "generation": generation})
+
+    temporary_path = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+    with open(temporary_path, "w") as current:
+        current.write(name)
+    os.replace(temporary_path, os.path.join(directory, CURRENT_FILE))
+    logger.info(f"Published profile generation {generation} ({len(encoded)} profiles) in {directory}")
+
+    for old in [*existing, generation][:-keep]:
+        try:
+            os.remove(os.path.join(directory, _generation_file(old)))
+        except OSError as e:  # e.g. still mapped on a platform that refuses to delete mapped files
+            logger.warning(f"Could not remove profile generation {old}: {e}")
+    return generation
+
+
+# Publish a profile table: encoded, partitioned by destination (and language) and with the named
+# columns stored raw for rendering
+def publish_profiles(directory, profiles, by_language=False, columns=(), metadata=None, keep=KEEP_GENERATIONS):
+    from batch_processing import build_partitions
+    from scoring_engine import encode_profiles
+    encoded = encode_profiles(profiles)
+    partitions = build_partitions(profiles, by_language=by_language)
+    return publish(directory, encoded, partitions, {column: profiles[column] for column in columns}, metadata, keep)
+
+
+# Publish a ProfileStore as it stands; deleted rows stay masked out in the new generation
+def publish_store(directory, store, columns=(), metadata=None, keep=KEEP_GENERATIONS):
+    return publish(directory, store, store.partitions,
+                   {column: store.column_values(column) for column in columns}, metadata, keep)
+
+
+# Read side, one per worker process. current() returns the live generation's ProfileIndex, and
+# reloads only when CURRENT has been swapped (one stat per call):
+#
+#     shared = SharedProfiles("profiles")
+#     index = shared.current()
+#     matches = find_best_buddies(request, None, index.encoded, index.partitions)
+#     index.records(matches, ["Buddy_id", "Destination", "Keywords"])
+#
+# Keep using one index for a whole request; a swap in the middle does not disturb it.
+class SharedProfiles:
+    def __init__(self, directory, verify=False):
+        self.directory = directory
+        self.verify = verify  # checksum each generation on load (reads the whole file)
+        self._index = None
+        self._stamp = None
+
+    @property
+    def generation(self):
+        return None if self._index is None else self._index.metadata["generation"]
+
+    def current(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, CURRENT_FILE))
+        except FileNotFoundError:
+            raise IndexFileError(f"No profile generation has been published in {self.directory}") from None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp != self._stamp:
+            # A publisher may swap again (and remove this file) between reading CURRENT and opening it
+            for _ in range(3):
+                path = current_file(self.directory)
+                try:
+                    self._index = load_index(path, verify=self.verify)
+                    break
+                except FileNotFoundError:
+                    continue
+            else:
+                raise IndexFileError(f"Could not open the current profile generation in {self.directory}")
+            self._stamp = stamp
+            logger.info(f"Loaded profile generation {self.generation} from {self.directory}")
+        return self._index
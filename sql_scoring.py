@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from sqlalchemy import case, or_
+
+# Points per matched field, in priority order (same weights as the Python loop in match_buddies)
+DESTINATION_POINTS = 50
+LANGUAGE_POINTS = 30
+KEYWORD_POINTS = 10
+EVENT_POINTS = 5
+PACKAGE_POINTS = 5
+
+# The points above in the shape of a keyword_scoring.ScoringWeights, which can be passed instead
+DEFAULT_WEIGHTS = SimpleNamespace(destination=DESTINATION_POINTS, language=LANGUAGE_POINTS, keywords=KEYWORD_POINTS,
+                                  event=EVENT_POINTS, package=PACKAGE_POINTS, keyword_mode="any")
+
+
+# ILIKE '%term%' with the term taken literally, as Python's `term in value.lower()` takes it: a % or
+# _ in a request is a character to find, not a wildcard
+def contains(column, term):
+    escaped = term.replace("/", "//").replace("%", "/%").replace("_", "/_")
+    return column.ilike(f"%{escaped}%", escape="/")
+
+
+# Request keywords as match_buddies reads them: lower-cased, comma split, each trimmed
+def request_keywords(request):
+    if hasattr(request, "keyword_terms"):  # a request_terms.CompiledRequest has them already
+        return list(request.keyword_terms)
+    return [keyword.strip() for keyword in request.keywords.lower().split(",")] if request.keywords else []
+
+
+# The event and package filters, applied only when the request sets them
+def detail_filters(model, request):
+    filters = []
+    if request.event:
+        filters.append(contains(model.event, request.event))
+    if request.package:
+        filters.append(contains(model.package, request.package))
+    return filters
+
+
+# The conditions match_buddies tests and scores: substring ILIKEs on the destination and language,
+# and one per request keyword (buddy_lookup.lookup_conditions has the whole-value equivalents)
+def match_conditions(model, request):
+    return SimpleNamespace(
+        destination=contains(model.destination, request.destination),
+        language=contains(model.language, request.language),
+        keywords=[contains(model.keywords, keyword) for keyword in request_keywords(request)],
+    )
+
+
+# The WHERE clauses match_buddies applies: destination and language always, keywords/event/package if given
+def match_filters(model, request):
+    conditions = match_conditions(model, request)
+    filters = [conditions.destination, conditions.language]
+    if conditions.keywords:
+        filters.append(or_(*conditions.keywords))
+    return filters + detail_filters(model, request)
+
+
+# The match_buddies score as one SQL expression: a CASE per field, summed. conditions (by default
+# match_conditions) decides what counts as a destination, language and keyword match.
+def score_expression(model, request, weights=DEFAULT_WEIGHTS, conditions=None):
+    def points(condition, value):
+        return case((condition, value), else_=0)
+
+    if conditions is None:
+        conditions = match_conditions(model, request)
+    score = points(conditions.destination, weights.destination)
+    score = score + points(conditions.language, weights.language)
+    if conditions.keywords and weights.keyword_mode == "any":
+        # One hit is enough, like the break after the first matching keyword
+        score = score + points(or_(*conditions.keywords), weights.keywords)
+    else:
+        for keyword in conditions.keywords:
+            score = score + points(keyword, weights.keywords)
+    if request.event:
+        score = score + points(contains(model.event, request.event), weights.event)
+    if request.package:
+        score = score + points(contains(model.package, request.package), weights.package)
+    return score
+
+
+# Filter, score, order and limit entirely in the database; returns (id, score) rows, best first,
+# ties on ascending id. No ORM objects are loaded, whatever the size of the candidate set.
+# filters replaces the default match_filters and conditions the scored match_conditions (e.g. with
+# buddy_lookup's indexed filters and conditions, which should go together).
+def top_scored_ids(db, model, request, top_k=None, filters=None, weights=DEFAULT_WEIGHTS, conditions=None):
+    if filters is None:
+        filters = match_filters(model, request)
+    score = score_expression(model, request, weights, conditions).label("score")
+    query = (
+        db.query(model.id, score)
+        .filter(*filters)
+        .order_by(score.desc(), model.id)
+    )
+    if top_k is not None:
+        query = query.limit(top_k)
+    return [(row.id, row.score) for row in query]
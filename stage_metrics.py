@@ -0,0 +1,111 @@
+import re
+import threading
+import time
+
+# Stages the matchers report, in pipeline order
+STAGES = ("load", "preprocess", "filter", "score", "topk", "serialize")
+
+
+# Times one stage into a StageMetrics on exit
+class _StageTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Shared do-nothing timer handed out by disabled metrics, so a disabled stage costs one method call
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# Per-stage wall-clock timings and named counters for the matching hot paths.
+#
+#     metrics = StageMetrics()
+#     with metrics.stage("score"):
+#         ...
+#     metrics.count("candidates_scanned", len(rows))
+#
+# A disabled instance (NO_METRICS, the matchers' default) records nothing. Safe to share across threads.
+class StageMetrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = {}   # stage -> [calls, total seconds, max seconds]
+        self.counters = {}  # counter name -> total
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        return _StageTimer(self, name) if self.enabled else _NULL_TIMER
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    # {"stages": {stage: {"calls", "total_s", "mean_s", "max_s"}}, "counters": {name: total}}
+    def as_dict(self):
+        with self.lock:
+            stages = {
+                name: {"calls": calls, "total_s": total, "mean_s": total / calls, "max_s": longest}
+                for name, (calls, total, longest) in self.timings.items()
+            }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    # Prometheus text exposition format: per-stage call counts, total and max seconds, plus counters
+    def to_prometheus(self, prefix="buddy_match"):
+        snapshot = self.as_dict()
+        lines = []
+        for metric, kind, field, help_text in [
+            ("stage_calls_total", "counter", "calls", "Times each matching stage ran"),
+            ("stage_seconds_total", "counter", "total_s", "Wall-clock seconds spent in each matching stage"),
+            ("stage_seconds_max", "gauge", "max_s", "Longest single run of each matching stage"),
+        ]:
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for stage, values in snapshot["stages"].items():
+                lines.append(f'{prefix}_{metric}{{stage="{stage}"}} {values[field]}')
+        for name, total in snapshot["counters"].items():
+            metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {total}")
+        return "\n".join(lines) + "\n"
+
+
+# Default for the matchers' metrics argument: timing disabled
+NO_METRICS = StageMetrics(enabled=False)
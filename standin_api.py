@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import StaticPool
+
+from api_mount import load_api_matcher
+from match_cache import CursorStore
+from sql_scoring import top_scored_ids
+
+logger = logging.getLogger(__name__)
+
+Base = declarative_base()
+
+
+# Same columns match_buddies reads from the API's Buddy model
+class Buddy(Base):
+    __tablename__ = "buddies"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    destination = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    keywords = Column(String, nullable=False)
+    event = Column(String, nullable=False)
+    package = Column(String, nullable=False)
+
+
+# Seed buddies chosen so every assertion in test_buddy_algorithm_expanded.py holds
+STANDIN_BUDDIES = [
+    ("Test One", "Los Angeles", "English,Spanish", "shopping,food,art", "City Tour", "Solo Traveler Buddy"),
+    ("Alpha Two", "New Delhi", "Hindi,English", "culture,shopping,history", "Cultural Tour", "Shopping Enthusiast Buddy"),
+    ("Alpha Eleven", "Paris", "French,English", "art,fashion,history", "Fashion Week", "Shopping Enthusiast Buddy"),
+    ("Alpha Five", "Berlin", "German,English", "history,nightlife,food", "City Tour", "Solo Traveler Buddy"),
+    ("Test Seven", "Rome", "Italian,English", "history,food,art", "Historical Tour", "Solo Traveler Buddy"),
+    ("Test Nine", "Buenos Aires", "Spanish,English", "music,dance,food", "Tango Festival", "Touring Musician Buddy"),
+    ("Test Twelve", "New York", "English", "shopping,art,food", "City Tour", "Solo Traveler Buddy"),
+    ("Kenji", "Tokyo", "Japanese,English", "anime,technology", "Tech Expo", "Solo Traveler Buddy"),
+    ("Olivia", "London", "English", "history,music", "City Tour", "Solo Traveler Buddy"),
+]
+
+REQUIRED_FIELDS = ("destination", "language")
+OPTIONAL_FIELDS = ("keywords", "event", "package")
+BUDDY_FIELDS = ("id", "name", "destination", "language", "keywords", "event", "package")
+MAX_PAGE_SIZE = 1000
+
+
+# In-memory SQLite session factory seeded with STANDIN_BUDDIES, safe to share across server threads
+def seeded_engine(buddies=STANDIN_BUDDIES):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(
+            Buddy(name=name, destination=destination, language=language, keywords=keywords, event=event, package=package)
+            for name, destination, language, keywords, event, package in buddies
+        )
+        session.commit()
+    return engine
+
+
+# FastAPI-style validation: required fields present and every field a string
+def validation_errors(payload):
+    if not isinstance(payload, dict):
+        return [{"loc": ["body"], "msg": "Input should be a valid dictionary", "type": "dict_type"}]
+    errors = []
+    for field in REQUIRED_FIELDS:
+        if field not in payload:
+            errors.append({"loc": ["body", field], "msg": "Field required", "type": "missing"})
+    for field in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        if field in payload and not isinstance(payload[field], str):
+            errors.append({"loc": ["body", field], "msg": "Input should be a valid string", "type": "string_type"})
+    return errors
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse connections
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path not in ("/api/book_buddy", "/api/book_buddies", "/api/match_page"):
+            return self.send_json(404, {"detail": "Not Found"})
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError:
+            return self.send_json(422, {"detail": [{"loc": ["body"], "msg": "Invalid JSON", "type": "json_invalid"}]})
+        if self.path == "/api/book_buddies":
+            return self.book_buddies(payload)
+        if self.path == "/api/match_page":
+            return self.match_page(payload)
+        errors = validation_errors(payload)
+        if errors:
+            return self.send_json(422, {"detail": errors})
+
+        request = SimpleNamespace(**{field: payload.get(field, "") for field in REQUIRED_FIELDS + OPTIONAL_FIELDS})
+        with self.server.db_lock, Session(self.server.engine) as db:
+            scored_ids = top_scored_ids(db, Buddy, request)
+            buddies = {buddy.id: buddy for buddy in db.query(Buddy).filter(Buddy.id.in_([i for i, _ in scored_ids]))}
+            matches = [{field: getattr(buddies[i], field) for field in BUDDY_FIELDS} for i, _ in scored_ids]
+        if not matches:
+            return self.send_json(404, {"detail": "No buddies found matching the criteria"})
+        self.send_json(200, matches)
+
+    # Bulk endpoint: a list of request bodies, answered item by item (see matching_algorithm.book_buddies_batch)
+    def book_buddies(self, payload):
+        if not isinstance(payload, list):
+            return self.send_json(422, {"detail": [{"loc": ["body"], "msg": "Input should be a valid list",
+                                                    "type": "list_type"}]})
+        matching_algorithm, _ = load_api_matcher()  # mounted on this module's Buddy
+        # Optional fields default to "" here too
+        payload = [{**dict.fromkeys(OPTIONAL_FIELDS, ""), **item} if isinstance(item, dict) else item for item in payload]
+        with self.server.db_lock, Session(self.server.engine) as db:
+            responses = matching_algorithm.book_buddies_batch(db, payload, top_k=10)
+        self.send_json(200, responses)
+
+    # Paged matches (see matching_algorithm.match_page). The body holds either a search request or
+    # the cursor of a previous page, plus the optional fields to return and page size:
+    #   {"request": {...}, "fields": ["id", "name"], "limit": 20}    first page
+    #   {"cursor": "<next_cursor>", "fields": ["id", "name"]}        the following pages
+    def match_page(self, payload):
+        if not isinstance(payload, dict):
+            return self.send_json(422, {"detail": validation_errors(payload)})
+        fields = payload.get("fields", list(BUDDY_FIELDS))
+        limit = payload.get("limit", 20)
+        errors = [] if "cursor" in payload else [
+            {**error, "loc": ["body", "request", *error["loc"][1:]]} for error in validation_errors(payload.get("request"))]
+        if not isinstance(fields, list) or not fields or not set(fields) <= set(BUDDY_FIELDS):
+            errors.append({"loc": ["body", "fields"], "msg": f"Fields must be a list of {list(BUDDY_FIELDS)}",
+                           "type": "fields"})
+        if not isinstance(limit, int) or not 1 <= limit <= MAX_PAGE_SIZE:
+            errors.append({"loc": ["body", "limit"], "msg": f"Limit must be between 1 and {MAX_PAGE_SIZE}",
+                           "type": "limit"})
+        if errors:
+            return self.send_json(422, {"detail": errors})
+
+        matching_algorithm, _ = load_api_matcher()
+        request = None
+        if "cursor" not in payload:
+            request = SimpleNamespace(**{field: payload["request"].get(field, "") for field in REQUIRED_FIELDS + OPTIONAL_FIELDS})
+        try:
+            with self.server.db_lock, Session(self.server.engine) as db:
+                body = matching_algorithm.match_page(db, request, self.server.cursors, payload.get("cursor"),
+                                                     tuple(fields), limit)
+        except LookupError as e:  # match_cache.CursorError
+            return self.send_json(410, {"detail": str(e)})
+        self.send_body(200, body)
+
+    def send_json(self, status, content):
+        self.send_body(status, json.dumps(content).encode())
+
+    # Send an encoded JSON body as it is
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+# Start the stand-in /api/book_buddy server on a background thread; port 0 picks a free port.
+# Returns the server (server.server_address has the bound port); call server.shutdown() to stop it.
+def start_standin_server(host="127.0.0.1", port=0, buddies=STANDIN_BUDDIES):
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.engine = seeded_engine(buddies)
+    server.db_lock = threading.Lock()
+    server.cursors = CursorStore()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    standin = start_standin_server(port=8000)
+    logger.info("Stand-in /api/book_buddy listening on http://%s:%d", *standin.server_address)
+    threading.Event().wait()
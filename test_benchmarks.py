@@ -0,0 +1,47 @@
+from benchmarks import (DESTINATIONS, bench_async_throughput, bench_serialization, compare_reports, make_buddy_rows,
+                        make_profiles, make_scenarios, run_sweep)
+
+
+def test_generators_follow_the_spreadsheet_schemas():
+    profiles = make_profiles(50, seed=2)
+    assert list(profiles.columns) == ["Buddy_id", "Destination", "User Language", "Local Language", "Keywords",
+                                      "Event", "Package"]
+    scenarios = make_scenarios(20, seed=3)
+    assert list(scenarios.columns) == ["destination", "language", "local_language", "keywords", "event", "package"]
+    assert scenarios["destination"].isin(DESTINATIONS).all()
+    assert make_scenarios(20, seed=3).equals(scenarios)
+
+    rows = make_buddy_rows(profiles)
+    assert len(rows) == 50
+    first = profiles.iloc[0]
+    assert rows[0]["destination"] == first["Destination"]
+    assert rows[0]["language"].split(",")[0] == first["User Language"]
+
+
+def test_sweep_report_and_regression_check():
+    report = run_sweep(sizes=[300], sql_sizes=[300], n_scenarios=5, repeat=2)
+    assert [(r["benchmark"], r["rows"]) for r in report["results"]] == [
+        ("find_best_buddies", 300),
+        ("evaluate_metrics", 300),
+        ("match_buddies", 300),
+        ("match_buddies_indexed", 300),
+    ]
+    assert all(r["p50_ms"] > 0 and r["peak_mib"] >= 0 for r in report["results"])
+    assert compare_reports(report, report) == []
+
+    slower = {"results": [dict(r, p50_ms=r["p50_ms"] * 2) for r in report["results"]]}
+    regressions = compare_reports(report, slower)
+    assert {r["benchmark"] for r in regressions} == {r["benchmark"] for r in report["results"]}
+    assert all(r["metric"] == "p50_ms" and round(r["change"], 6) == 1 for r in regressions)
+
+
+def test_async_throughput_benchmark():
+    results = bench_async_throughput(n_profiles=300, n_requests=8, concurrency=4)
+    assert [r["path"] for r in results] == ["sync", "async"]
+    assert all(r["requests_per_s"] > 0 for r in results)
+
+
+def test_serialization_benchmark():
+    results = bench_serialization(n_profiles=300, page_size=2)
+    assert [r["matches"] for r in results][2:] == [2, 2]
+    assert all(r["ms"] > 0 for r in results)
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+from buddy_lookup import backfill_lookup_tables, create_lookup_tables, lookup_filters, sync_lookup_rows
+from sql_scoring import match_filters
+
+
+def request(destination, language, keywords=""):
+    return SimpleNamespace(destination=destination, language=language, keywords=keywords, event="", package="")
+
+
+def matched_ids(db, model, filters):
+    return sorted(buddy_id for (buddy_id,) in db.query(model.id).filter(*filters))
+
+
+def setup_lookup(db, model):
+    create_lookup_tables(db.get_bind(), model)
+    backfill_lookup_tables(db, model, batch_size=4)
+
+
+# Where whole-value matching is the intent, indexed lookups find the same buddies as the ILIKE scan
+def test_parity_with_substring_filters(db, buddy_model):
+    setup_lookup(db, buddy_model)
+    for search in [
+        request("Los Angeles", "English"),
+        request("los angeles", "SPANISH", "art"),
+        request("New Delhi", "Hindi", "history,culture"),
+        request("Tokyo", "Japanese", "anime"),
+        request("Paris", "French", "food,nightlife"),
+        request("Atlantis", "Elvish", "magic"),
+    ]:
+        assert matched_ids(db, buddy_model, lookup_filters(buddy_model, search)) == \
+            matched_ids(db, buddy_model, match_filters(buddy_model, search))
+
+
+# The deliberate differences: no partial destinations or keywords, and language order does not matter
+def test_whole_value_semantics(db, buddy_model):
+    setup_lookup(db, buddy_model)
+    paris = request("Paris", "French")
+    assert matched_ids(db, buddy_model, match_filters(buddy_model, paris)) == [7, 8, 9]
+    assert matched_ids(db, buddy_model, lookup_filters(buddy_model, paris)) == [7, 8]
+
+    spanish_first = request("Los Angeles", "Spanish,English")
+    assert matched_ids(db, buddy_model, match_filters(buddy_model, spanish_first)) == []
+    assert matched_ids(db, buddy_model, lookup_filters(buddy_model, spanish_first)) == [1, 3]
+
+    partial_keyword = request("Los Angeles", "English", "muse")
+    assert matched_ids(db, buddy_model, match_filters(buddy_model, partial_keyword)) == [3]
+    assert matched_ids(db, buddy_model, lookup_filters(buddy_model, partial_keyword)) == []
+
+
+# Edited buddies are re-synced without a full backfill
+def test_sync_after_edit(db, buddy_model):
+    setup_lookup(db, buddy_model)
+    buddy = db.get(buddy_model, 6)
+    buddy.destination = "Osaka"
+    buddy.keywords = "food"
+    db.flush()
+    sync_lookup_rows(db, buddy_model, [buddy])
+    assert matched_ids(db, buddy_model, lookup_filters(buddy_model, request("Tokyo", "Japanese"))) == []
+    assert matched_ids(db, buddy_model, lookup_filters(buddy_model, request("osaka", "English", "food"))) == [6]
+
+
+# The destination lookup is served by its index, not a scan of the buddies table
+def test_destination_lookup_uses_index(db, buddy_model):
+    setup_lookup(db, buddy_model)
+    query = db.query(buddy_model.id).filter(*lookup_filters(buddy_model, request("Paris", "French")))
+    sql = str(query.statement.compile(compile_kwargs={"literal_binds": True}))
+    plan = " ".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert "ix_buddy_destinations_destination" in plan
+
+
+# With the lookup tables, scores come from the same whole-value tests as the filters: a buddy that
+# passes on "Spanish,English" gets the language points, and "art" is not found in "martial arts"
+def test_lookup_scoring_follows_the_lookup_filters(db, buddy_model):
+    from benchmarks import load_api_matcher
+    from keyword_scoring import API_WEIGHTS, ScoringWeights
+    matching_algorithm, _ = load_api_matcher()
+    db.add(buddy_model(name="Lucia", destination="Los Angeles", language="Spanish,English",
+                       keywords="food,martial arts", event="", package=""))
+    db.commit()
+    setup_lookup(db, buddy_model)
+
+    def scores(language, keywords, weights=API_WEIGHTS):
+        return matching_algorithm.match_buddy_scores(db, request("Los Angeles", language, keywords), top_k=None,
+                                                     use_lookup_tables=True, weights=weights)
+
+    assert scores("English,Spanish", "art") == scores("Spanish,English", "art") == [(1, 90), (3, 90)]
+    each = ScoringWeights(destination=50, language=30, keywords=10, event=5, package=5, keyword_mode="each")
+    assert scores("spanish, english", "art,food", each) == [(1, 100), (3, 90), (10, 90)]
+    for weights in (API_WEIGHTS, each):
+        for language, keywords in (("Spanish,English", "art,food"), ("English", "food"), ("english", "")):
+            search = request("los angeles", language, keywords)
+            ranked = matching_algorithm.match_buddies(db, search, use_lookup_tables=True, weights=weights)
+            assert [buddy.id for buddy in ranked] == [buddy_id for buddy_id, _ in scores(language, keywords, weights)]
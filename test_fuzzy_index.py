@@ -0,0 +1,137 @@
+import pandas as pd
+import pytest
+
+from batch_processing import build_fuzzy_index, find_best_buddies, find_best_buddies_batch, fuzzy_request
+from benchmarks import as_search_request, load_api_matcher, make_profiles, make_scenarios, sqlite_session
+from fuzzy_index import FuzzyIndex, trigrams
+from scoring_engine import encode_profiles
+
+matching_algorithm, models = load_api_matcher()
+
+ROWS = [
+    (1, "New York", "City Tour", "Solo Traveler Buddy", "music, food"),
+    (2, "Los Angeles", "Beach Day", "Adventure Buddy", "surfing,beach"),
+    (3, "Paris", "Museum Visit", "Solo Traveler Buddy", "art,museums"),
+    (4, "NYC", "Club Night", "Foodie Buddy", "nightlife"),
+]
+
+
+def test_trigrams_pad_each_word():
+    assert trigrams("la") == {"  l", " la", "la "}
+    assert trigrams("new york") == trigrams("new") | trigrams("york")
+
+
+def test_typos_and_aliases_match():
+    index = FuzzyIndex.build(ROWS)
+    assert index.lookup("destination", "NYC") == {1, 4}
+    assert index.lookup("destination", "new yrok") == {1, 4}
+    assert index.lookup("destination", "Los Angles") == {2}
+    assert index.lookup("destination", "LA") == {2}
+    assert index.lookup("destination", "Tokyo") == set()
+    assert index.lookup("event", "city tours") == {1}
+    assert index.lookup("keywords", "musc") == {1, 3}  # music, and museums at the threshold
+    assert index.match_counts("keywords", ["musc", "fod", "art"]) == {1: 2, 3: 2}
+    assert index.closest("destination", "Pariss") == "Paris"
+    assert sorted(index.spellings("destination", "new york")) == ["NYC", "New York"]
+
+
+def test_threshold_and_removal():
+    index = FuzzyIndex.build(ROWS, threshold=0.5)
+    assert index.lookup("keywords", "musc") == set()
+    assert index.lookup("keywords", "musik") == {1}
+    index.remove(4)
+    assert index.lookup("destination", "nyc") == {1}
+    assert "club night" not in index["event"].gram_counts  # terms no profile holds leave the index
+    index.add(1, "Paris", None, None, "art")
+    assert index.lookup("destination", "paris") == {1, 3}
+    assert index.lookup("destination", "new york") == set()
+
+
+# Lookups walk the distinct values, so a large table of repeated values keeps a small index
+def test_index_size_follows_distinct_values():
+    profiles = make_profiles(5_000, seed=1)
+    index = FuzzyIndex.build(zip(profiles["Buddy_id"], profiles["Destination"], profiles["Event"],
+                                 profiles["Package"], profiles["Keywords"]))
+    assert len(index["destination"]) == profiles["Destination"].nunique()
+    assert len(index["keywords"]) == 12
+    assert len(index.lookup("destination", "tokio")) == (profiles["Destination"] == "Tokyo").sum()
+
+
+def test_fuzzy_batch_requests_match_their_corrected_form():
+    profiles = make_profiles(300, seed=2)
+    encoded = encode_profiles(profiles)
+    fuzzy = build_fuzzy_index(encoded)
+    request = {"destination": "Tokio", "language": "English", "local_language": "Hindi",
+               "keywords": "musik,food,zzz", "event": "Food Festivals", "package": "Foodie Buddy"}
+    corrected = {**request, "destination": "Tokyo", "keywords": "music,food,zzz", "event": "Food Festival"}
+    assert fuzzy_request(request, encoded, fuzzy) == corrected
+    assert find_best_buddies(request, profiles, encoded, fuzzy=fuzzy) == find_best_buddies(corrected, profiles, encoded)
+    scenarios = pd.DataFrame([request, corrected])
+    results = find_best_buddies_batch(scenarios, profiles, encoded=encoded, fuzzy=fuzzy)
+    assert results[0] == results[1] == find_best_buddies(corrected, profiles, encoded)
+
+
+def test_match_buddies_with_fuzzy_index(monkeypatch):
+    db = sqlite_session(models, 1_000, seed=3)
+    fuzzy_index = matching_algorithm.build_fuzzy_index(db)
+
+    def ranked_ids(request, **options):
+        db.expunge_all()
+        return [buddy.id for buddy in matching_algorithm.match_buddies(db, request, **options)]
+
+    # Requiring identical terms ranks like the substring matcher (no value here contains another)
+    requests = [as_search_request(scenario) for _, scenario in make_scenarios(10, seed=4).iterrows()]
+    expected = [ranked_ids(request) for request in requests]
+    monkeypatch.setattr(fuzzy_index, "threshold", 1.0)
+    assert [ranked_ids(request, fuzzy_index=fuzzy_index) for request in requests] == expected
+    assert any(expected)
+    monkeypatch.undo()
+
+    # Misspelled values find the same buddies as the correct ones
+    request = next(request for request, ids in zip(requests, expected) if ids)
+    typo = as_search_request({"destination": request.destination[:-1] + "x" + request.destination[-1],
+                              "language": request.language, "keywords": request.keywords,
+                              "event": request.event, "package": request.package})
+    fuzzy_ids = ranked_ids(request, fuzzy_index=fuzzy_index)
+    assert ranked_ids(typo) == []
+    assert ranked_ids(typo, fuzzy_index=fuzzy_index) == fuzzy_ids
+    assert set(fuzzy_ids) >= set(expected[requests.index(request)])
+
+    # Large id sets are filtered after the query, with the same result
+    monkeypatch.setattr(matching_algorithm, "MAX_IN_IDS", 10)
+    assert ranked_ids(typo, fuzzy_index=fuzzy_index) == fuzzy_ids
+
+    with pytest.raises(ValueError):
+        matching_algorithm.match_buddies(db, request, fuzzy_index=fuzzy_index, use_lookup_tables=True)
+
+
+# Keywords with no non-empty term do not filter: the fuzzy path finds the buddies the plain one does
+def test_empty_keyword_terms_do_not_filter(db):
+    fuzzy_index = matching_algorithm.build_fuzzy_index(db)
+    for keywords in (",", " ", " , "):
+        request = as_search_request({"destination": "Paris", "language": "French", "keywords": keywords,
+                                     "event": "", "package": ""})
+        plain = [buddy.id for buddy in matching_algorithm.match_buddies(db, request)]
+        fuzzy = [buddy.id for buddy in matching_algorithm.match_buddies(db, request, fuzzy_index=fuzzy_index)]
+        assert plain == [7, 8, 9]
+        assert fuzzy == plain
+
+
+# Cache invalidation cannot see which buddies an alias or typo reaches, so fuzzy matches are not cached
+def test_fuzzy_matches_bypass_the_match_cache(db):
+    from match_cache import install_invalidation
+    cache = matching_algorithm.MatchCache()
+    uninstall = install_invalidation(cache, models.Buddy)
+    try:
+        fuzzy_index = matching_algorithm.build_fuzzy_index(db)
+        request = as_search_request({"destination": "LA", "language": "spanish", "keywords": "", "event": "",
+                                     "package": ""})
+        match = lambda: [buddy.id for buddy in matching_algorithm.match_buddies(db, request, cache=cache,
+                                                                                fuzzy_index=fuzzy_index)]
+        assert match() == [1, 3]
+        db.get(models.Buddy, 1).language = "Klingon"
+        db.commit()
+        assert match() == [3]
+        assert len(cache) == 0
+    finally:
+        uninstall()
@@ -0,0 +1,52 @@
+from keyword_index import KeywordIndex, parse_keywords
+
+
+def build_index():
+    return KeywordIndex.build([
+        (1, "shopping,food,art"),
+        (2, "Street  Food, nightlife"),
+        (3, "cannabis,hiking"),
+        (4, None),
+    ])
+
+
+# Keywords are trimmed, lower-cased and whitespace-collapsed; empty terms are dropped
+def test_parse_keywords_normalizes():
+    assert parse_keywords(" Shopping,,Street  Food ") == ["shopping", "street food"]
+    assert parse_keywords(None) == []
+    assert parse_keywords(["Art", " "]) == ["art"]
+
+
+# Synonyms share a posting list, in either direction
+def test_synonym_lookup():
+    index = build_index()
+    assert index.lookup("weed") == {3}
+    assert index.lookup("420 Friendly") == {3}
+    assert index.lookup("music") == {2}
+    assert index.lookup("concert") == {2}
+
+
+# Whole keywords only: "food" does not match "street food"
+def test_matching_and_counts():
+    index = build_index()
+    assert index.matching("food,music") == {1, 2}
+    assert index.matching("food,music", candidates={2, 3}) == {2}
+    assert index.match_counts("art,shopping,nightlife,concert") == {1: 2, 2: 1}
+
+
+# Adding, re-adding and removing profiles keeps the posting lists in step without a rebuild
+def test_incremental_updates():
+    index = build_index()
+    index.add(5, "food,beach")
+    assert index.lookup("food") == {1, 5}
+
+    index.add(1, "beach")
+    assert index.lookup("food") == {5}
+    assert index.lookup("beach") == {1, 5}
+
+    index.remove(5)
+    index.remove(42)
+    assert index.lookup("food") == set()
+    assert "food" not in index.postings
+    assert 5 not in index
+    assert len(index) == 4
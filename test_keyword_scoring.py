@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from batch_processing import find_best_buddies, find_best_buddies_batch
+from benchmarks import as_search_request, load_api_matcher, make_profiles, make_scenarios, sqlite_session
+from keyword_scoring import API_WEIGHTS, BATCH_WEIGHTS, KeywordMatrix, ScoringWeights, load_weights, normalized_terms
+from scoring_engine import encode_profiles, score_profiles
+from sql_scoring import DEFAULT_WEIGHTS, top_scored_ids
+
+matching_algorithm, models = load_api_matcher()
+
+
+def test_weights_configuration(tmp_path):
+    path = tmp_path / "weights.json"
+    path.write_text(json.dumps({"destination": 40, "keywords": 15, "keyword_mode": "any"}))
+    weights = load_weights(path)
+    assert weights == ScoringWeights(destination=40, keywords=15, keyword_mode="any")
+    assert weights.language == 0
+    with pytest.raises(ValueError):
+        ScoringWeights.from_dict({"destinaton": 40})
+    with pytest.raises(ValueError):
+        ScoringWeights(keyword_mode="sum")
+
+
+def test_keyword_matrix_scores():
+    keywords = KeywordMatrix.build([(7, "Art, food"), (8, "food"), (9, None), (10, "art,art")])
+    each = ScoringWeights(keywords=20)
+    any_keyword = ScoringWeights(keywords=10, keyword_mode="any")
+    assert keywords.scores(["art", "food"], each).tolist() == [40, 20, 0, 20]
+    assert keywords.scores(["art", "art"], each).tolist() == [40, 0, 0, 40]
+    assert keywords.scores(["art", "food"], any_keyword).tolist() == [10, 10, 0, 10]
+    assert keywords.scores(["hiking"], each).tolist() == [0, 0, 0, 0]
+    assert keywords.scores_by_id(["food"], each, [8, 10, 99]) == {8: 20, 10: 0, 99: 0}
+
+
+# Added, edited and removed profiles are scored and matched on their current keywords
+def test_keyword_matrix_add_remove():
+    keywords = KeywordMatrix.build([(7, "Art, food"), (8, "food")])
+    keywords.add(11, "Street  Food, art")
+    keywords.add(8, "art")
+    keywords.remove(7)
+    each = ScoringWeights(keywords=20)
+    any_keyword = ScoringWeights(keywords=10, keyword_mode="any")
+    assert keywords.scores_by_id(["art", "street food"], each, [7, 8, 11]) == {7: 0, 8: 20, 11: 40}
+    assert keywords.scores_by_id(["art", "street food"], any_keyword, [7, 8, 11]) == {7: 0, 8: 10, 11: 10}
+    assert keywords.matching_ids(["food"]) == set()
+    assert keywords.matching_ids(["art"]) == {8, 11}
+    assert keywords.matching_ids(["art"], {8}) == {8}
+
+
+# Other weights give the same scores per request and in the batch score matrix
+def test_batch_paths_agree_under_custom_weights():
+    profiles = make_profiles(400, seed=8)
+    scenarios = make_scenarios(25, seed=9)
+    weights = ScoringWeights(destination=50, language=30, keywords=10, event=5, package=5, keyword_mode="any")
+    encoded = encode_profiles(profiles)
+    expected = [find_best_buddies(request, profiles, encoded, weights=weights) for _, request in scenarios.iterrows()]
+    assert find_best_buddies_batch(scenarios, profiles, encoded=encoded, weights=weights) == expected
+    assert find_best_buddies_batch(scenarios, profiles, encoded=encoded, weights=weights, max_cells=500) == expected
+    assert expected != find_best_buddies_batch(scenarios, profiles, encoded=encoded)
+
+    request = scenarios.iloc[0]
+    scores = score_profiles(request, encoded, weights=weights)
+    keyword_hits = [bool(set(request["keywords"].split(",")) & set(value.split(","))) for value in profiles["Keywords"]]
+    manual = (50 * (profiles["Destination"] == request["destination"]) + 30 * (profiles["User Language"] == request["language"])
+              + 10 * np.array(keyword_hits) + 5 * (profiles["Event"] == request["event"])
+              + 5 * (profiles["Package"] == request["package"]))
+    assert scores.tolist() == manual.tolist()
+
+
+# With the keyword matrix, candidates are filtered on the same whole, whitespace-collapsed terms the
+# matrix scores: every buddy that passes the filter gets its keyword points
+def test_keyword_matrix_filters_on_the_scored_terms(db, buddy_model):
+    db.add_all([buddy_model(name=name, destination="Tokyo", language="Japanese", keywords=keywords, event="",
+                            package="") for name, keywords in (("Dojo", "martial arts"), ("Yatai", "Street Food"))])
+    db.commit()
+    keyword_matrix = matching_algorithm.build_keyword_matrix(db)
+    requests = [SimpleNamespace(destination="Tokyo", language="Japanese", keywords=keywords, event="", package="")
+                for keywords in ("art", "street  food", "anime, martial  arts")]
+    expected = [[], [11], [6, 10]]
+    matched = [[buddy.id for buddy in matching_algorithm.match_buddies(db, request, keyword_matrix=keyword_matrix)]
+               for request in requests]
+    assert matched == expected
+    batch = matching_algorithm.match_buddies_batch(db, requests, keyword_matrix=keyword_matrix)
+    assert [[buddy.id for buddy in match.buddies] for match in batch] == expected
+    for request, ids in zip(requests, expected):
+        assert all(keyword_matrix.scores_by_id(normalized_terms(request.keywords), API_WEIGHTS, ids).values())
+    # Without the matrix the keyword filter is still a substring match
+    assert [buddy.id for buddy in matching_algorithm.match_buddies(db, requests[0])] == [10]
+
+    # A buddy added since the build is found once the matrix is told about it
+    db.add(buddy_model(name="Sensei", destination="Tokyo", language="Japanese", keywords="art", event="", package=""))
+    db.commit()
+    keyword_matrix.add(12, "art")
+    assert [buddy.id for buddy in matching_algorithm.match_buddies(db, requests[0], keyword_matrix=keyword_matrix)] \
+        == [12]
+
+
+# Given the same destination and keyword weights, match_buddies ranks the buddies it returns in the
+# same order as find_best_buddies ranks those profiles (language, event and package are left out:
+# the two matchers compare them differently)
+@pytest.mark.parametrize("keyword_mode", ["each", "any"])
+def test_api_and_batch_rank_consistently(keyword_mode):
+    weights = ScoringWeights(destination=50, keywords=10, keyword_mode=keyword_mode)
+    profiles = make_profiles(600, seed=10)
+    db = sqlite_session(models, 600, seed=10)
+    keyword_matrix = matching_algorithm.build_keyword_matrix(db)
+    encoded = encode_profiles(profiles)
+    for _, scenario in make_scenarios(15, seed=11).iterrows():
+        # Language, event and package are filters in match_buddies; leave them out of both sides
+        scenario = scenario.copy()
+        scenario[["language", "local_language", "event", "package"]] = ["", np.nan, np.nan, np.nan]
+        batch_order = [profiles.at[i, "Buddy_id"] for i in
+                       find_best_buddies(scenario, profiles, encoded, top_k=len(profiles), weights=weights)]
+        request = as_search_request(scenario.fillna(""))
+        for options in ({}, {"keyword_matrix": keyword_matrix}):
+            db.expunge_all()
+            api_order = [buddy.id for buddy in matching_algorithm.match_buddies(db, request, weights=weights, **options)]
+            assert api_order and api_order == [i for i in batch_order if i in set(api_order)]
+        if keyword_mode == "each":
+            sql_order = [i for i, _ in top_scored_ids(db, models.Buddy, request, weights=weights)]
+            assert sql_order == api_order
+    db.close()
+
+
+# The presets are the points each matcher has always used
+def test_presets_match_the_historical_points():
+    assert BATCH_WEIGHTS == ScoringWeights(destination=20, language=20, local_language=20, keywords=20, event=10,
+                                           package=10, keyword_mode="each")
+    assert vars(DEFAULT_WEIGHTS) == {field: value for field, value in API_WEIGHTS.as_dict().items()
+                                     if field != "local_language"}
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import urllib.request
+
+import pytest
+
+import test_buddy_algorithm_expanded
+from load_driver import read_corpus, replay, run_suite_under_load, summarize
+from standin_api import start_standin_server
+
+
+@pytest.fixture
+def standin_url():
+    server = start_standin_server()
+    yield "http://%s:%d/api/book_buddy" % server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+# Every assertion of the functional suite holds under concurrent load, over reused connections
+def test_suite_passes_under_load(standin_url):
+    report = run_suite_under_load(test_buddy_algorithm_expanded, standin_url, concurrency=8, rounds=2)
+    assert report["failures"] == []
+    assert report["requests"] == 62
+    assert report["status_codes"] == {200: 12, 404: 48, 422: 2}
+    assert report["connections_opened"] <= 8
+    assert test_buddy_algorithm_expanded.send_buddy_request.__module__ == "test_buddy_algorithm_expanded"
+
+
+def test_replay_corpus(standin_url, tmp_path):
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text("\n".join([
+        json.dumps({"destination": "Los Angeles", "language": "English"}),
+        json.dumps({"payload": {"destination": "Atlantis", "language": "Elvish"}, "note": "no match"}),
+        "",
+    ]))
+    report = asyncio.run(replay(read_corpus(str(corpus)), standin_url, concurrency=4, rounds=5))
+    assert report["status_codes"] == {200: 5, 404: 5}
+    assert report["connections_opened"] <= 4
+    assert report["p50_ms"] <= report["p95_ms"] <= report["p99_ms"]
+
+
+# Requests that still fail on retry are reported as errors instead of aborting the run
+def test_replay_records_dropped_connections():
+    async def drop(reader, writer):
+        await reader.read(1)
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(drop, "127.0.0.1", 0)
+        dropping_url = "http://127.0.0.1:%d/api/book_buddy" % server.sockets[0].getsockname()[1]
+        try:
+            return await replay([{"destination": "Los Angeles", "language": "English"}], dropping_url, rounds=3)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    report = asyncio.run(run())
+    assert report["requests"] == 3
+    assert report["status_codes"] == {"error": 3}
+    assert summarize([(404, 0.2), ("error", 0.1), (200, 0.3)], 1.0)["status_codes"] == {200: 1, 404: 1, "error": 1}
+
+
+# The bulk endpoint answers every item in input order, as the single endpoint would
+def test_bulk_endpoint(standin_url):
+    payloads = [
+        {"destination": "Los Angeles", "language": "English"},
+        {"destination": "Atlantis", "language": "Elvish"},
+        {"destination": "Tokyo"},
+        {"destination": "Paris", "language": "French", "keywords": "art"},
+    ]
+    request = urllib.request.Request(standin_url.replace("book_buddy", "book_buddies"), json.dumps(payloads).encode(),
+                                     {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        responses = json.load(response)
+    assert [item["status"] for item in responses] == [200, 404, 422, 200]
+    assert responses[0]["matches"][0]["name"] == "Test One"
+    assert responses[2]["detail"][0]["loc"] == ["language"]
+    assert [match["name"] for match in responses[3]["matches"]] == ["Alpha Eleven"]
+
+
+def test_summarize_percentiles():
+    samples = [(200, seconds / 1000) for seconds in range(1, 101)]
+    report = summarize(samples, elapsed=2.0)
+    assert (report["p50_ms"], report["p95_ms"], report["p99_ms"]) == pytest.approx((50, 95, 99))
+    assert report["throughput_rps"] == 50
+
+
+# Paged matches: the first page from a request, the next by cursor, only the selected fields
+def test_match_page_endpoint(standin_url):
+    def post(body):
+        request = urllib.request.Request(standin_url.replace("book_buddy", "match_page"), json.dumps(body).encode(),
+                                         {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    status, page = post({"request": {"destination": "e", "language": "English"}, "fields": ["name"], "limit": 4})
+    assert status == 200 and page["total"] == 6 and len(page["matches"]) == 4
+    names = [match["name"] for match in page["matches"]]
+    while page["next_cursor"]:
+        status, page = post({"cursor": page["next_cursor"], "fields": ["name"], "limit": 4})
+        names += [match["name"] for match in page["matches"]]
+    assert len(set(names)) == 6
+    assert post({"cursor": "unknown.4"})[0] == 410
+    status, page = post({"request": {"destination": "Paris"}, "fields": ["password"], "limit": 0})
+    assert status == 422
+    assert [error["loc"] for error in page["detail"]] == [["body", "request", "language"], ["body", "fields"],
+                                                          ["body", "limit"]]
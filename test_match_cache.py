@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+import pytest
+from api_mount import load_api_matcher
+from buddy_lookup import backfill_lookup_tables, create_lookup_tables, sync_lookup_rows
+from match_cache import MatchCache, cache_key, install_invalidation, load_in_order
+
+
+def request(destination, language, keywords="", event="", package=""):
+    return SimpleNamespace(destination=destination, language=language, keywords=keywords, event=event, package=package)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cache(buddy_model):
+    cache = MatchCache(maxsize=8)
+    uninstall = install_invalidation(cache, buddy_model)
+    yield cache
+    uninstall()
+
+
+def test_cache_key_is_canonical():
+    assert cache_key(request("Paris", "French", "Art, food", "City Tour")) == \
+        cache_key(request("paris", "FRENCH", "food,art", "city tour"))
+    # Empty and repeated keywords change what matches and how it scores
+    assert cache_key(request("Paris", "French", "food,")) != cache_key(request("Paris", "French", "food"))
+    assert cache_key(request("Paris", "French", "art,art")) != cache_key(request("Paris", "French", "art"))
+    # The ILIKE language filter is order-sensitive; the lookup-table filter is not
+    assert cache_key(request("Paris", "English,French")) != cache_key(request("Paris", "French,English"))
+    assert cache_key(request("Paris", "English,French"), use_lookup_tables=True) == \
+        cache_key(request("Paris", "french, english"), use_lookup_tables=True)
+    assert cache_key(request(" Paris ", "French"), use_lookup_tables=True) == \
+        cache_key(request("paris", "French"), use_lookup_tables=True)
+    assert cache_key(request(" Paris ", "French")) != cache_key(request("paris", "French"))
+    assert cache_key(request("Paris", "French"), top_k=5) != cache_key(request("Paris", "French"), top_k=10)
+
+
+def test_lru_eviction_and_counters():
+    cache = MatchCache(maxsize=2)
+    keys = [cache_key(request(destination, "English")) for destination in ("Paris", "Tokyo", "Rome")]
+    cache.put(keys[0], [1])
+    cache.put(keys[1], [2])
+    assert cache.get(keys[0]) == [1]  # Paris is now the most recently used
+    cache.put(keys[2], [3])
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == [1] and cache.get(keys[2]) == [3]
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "evictions": 1, "invalidations": 0}
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = MatchCache(ttl=10, clock=clock)
+    key = cache_key(request("Paris", "French"))
+    cache.put(key, [7])
+    clock.now = 9.5
+    assert cache.get(key) == [7]
+    clock.now = 10
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_invalidation_is_per_destination():
+    cache = MatchCache()
+    keys = {destination: cache_key(request(destination, "French")) for destination in ("Paris", "North", "Tokyo")}
+    for value, key in enumerate(keys.values()):
+        cache.put(key, [value])
+    # A buddy in "North Paris Suburbs" matches requests for "Paris" and "North", not "Tokyo"
+    cache.invalidate_destination("North Paris Suburbs")
+    assert cache.get(keys["Paris"]) is None and cache.get(keys["North"]) is None
+    assert cache.get(keys["Tokyo"]) == [2]
+    assert cache.invalidations == 2
+
+
+def test_writes_invalidate_affected_destinations(db, buddy_model, cache):
+    paris, tokyo, delhi = (cache_key(request(destination, "English")) for destination in ("Paris", "Tokyo", "New Delhi"))
+    for key in (paris, tokyo, delhi):
+        cache.put(key, [1])
+
+    db.add(buddy_model(name="Amelie", destination="Paris", language="French", keywords="art", event="", package=""))
+    db.commit()
+    assert cache.get(paris) is None
+    assert cache.get(tokyo) == [1] and cache.get(delhi) == [1]
+
+    # Moving a buddy invalidates both the old and the new destination
+    cache.put(paris, [1])
+    kenji = db.get(buddy_model, 6)
+    kenji.destination = "New Delhi"
+    db.commit()
+    assert cache.get(tokyo) is None and cache.get(delhi) is None
+    assert cache.get(paris) == [1]
+
+    db.delete(db.get(buddy_model, 7))
+    db.commit()
+    assert cache.get(paris) is None
+
+
+def test_load_in_order(db, buddy_model):
+    assert [buddy.id for buddy in load_in_order(db, buddy_model, [7, 1, 9])] == [7, 1, 9]
+    assert [buddy.id for buddy in load_in_order(db, buddy_model, [3, 42, 2])] == [3, 2]
+
+
+# Requests the matcher treats differently never share a cached result
+def test_cached_matches_follow_the_keyword_terms(db):
+    matching_algorithm, _ = load_api_matcher()
+    cache = MatchCache()
+    match = lambda keywords: [buddy.id for buddy in matching_algorithm.match_buddies(
+        db, request("Paris", "English", keywords), cache=cache)]
+    assert match("food,") == [7, 9]  # the empty term matches every Paris buddy speaking English
+    assert match("food") == []
+    assert match(",food") == [7, 9] and cache.hits == 1
+
+
+# Under the lookup tables a padded destination is the same whole value, for the key and for the
+# invalidation a new buddy in that destination triggers
+def test_lookup_table_keys_normalize_destinations(db, buddy_model, cache):
+    matching_algorithm, _ = load_api_matcher()
+    create_lookup_tables(db.get_bind(), buddy_model)
+    backfill_lookup_tables(db, buddy_model)
+    match = lambda destination: [buddy.id for buddy in matching_algorithm.match_buddies(
+        db, request(destination, "French"), use_lookup_tables=True, cache=cache)]
+    assert match(" Paris") == [7, 8]
+    assert match("paris ") == [7, 8] and cache.hits == 1
+
+    amelie = buddy_model(name="Amelie", destination="Paris", language="French", keywords="art", event="", package="")
+    db.add(amelie)
+    db.flush()
+    sync_lookup_rows(db, buddy_model, [amelie])
+    db.commit()
+    assert match(" Paris") == [7, 8, 10]
@@ -0,0 +1,238 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from benchmarks import as_search_request, load_api_matcher, make_scenarios, sqlite_session
+from keyword_scoring import API_WEIGHTS, ScoringWeights
+from stage_metrics import StageMetrics
+
+# The API matcher, mounted against the stand-in Buddy model (see api_mount.load_api_matcher)
+matching_algorithm, models = load_api_matcher()
+
+
+def ranked_ids(db, request, **options):
+    db.expunge_all()
+    return [buddy.id for buddy in matching_algorithm.match_buddies(db, request, **options)]
+
+
+# Keyword matches and partition blocks too large for an IN list are applied to the loaded rows,
+# with the same result as sending them to the database
+def test_large_id_sets_are_filtered_after_the_query(monkeypatch):
+    db = sqlite_session(models, 2_000, seed=4)
+    keyword_index = matching_algorithm.build_keyword_index(db)
+    partitions = matching_algorithm.build_partitions(db)
+    requests = [as_search_request(scenario) for _, scenario in make_scenarios(10, seed=5).iterrows()]
+    for options in ({"keyword_index": keyword_index}, {"keyword_index": keyword_index, "partitions": partitions}):
+        expected = [ranked_ids(db, request, **options) for request in requests]
+        monkeypatch.setattr(matching_algorithm, "MAX_IN_IDS", 10)
+        assert [ranked_ids(db, request, **options) for request in requests] == expected
+        monkeypatch.undo()
+    assert any(expected)
+
+
+# Partitions only narrow the destination substring filter: "Paris" still finds North Paris Suburbs
+def test_partitions_keep_substring_destinations(db):
+    request = SimpleNamespace(destination="Paris", language="English", keywords="art", event="", package="")
+    partitions = matching_algorithm.build_partitions(db)
+    assert ranked_ids(db, request, partitions=partitions) == ranked_ids(db, request) == [7, 9]
+    request.destination = "paris suburbs"
+    assert ranked_ids(db, request, partitions=partitions) == ranked_ids(db, request) == [9]
+
+
+# With top_k, candidates whose upper bound falls below the k-th best score are never scored; the
+# result is always the head of the full ranking, for every keyword path and keyword mode
+def test_top_k_early_termination_matches_full_ranking():
+    db = sqlite_session(models, 2_000, seed=6)
+    scenarios = make_scenarios(40, seed=7)
+    requests = [as_search_request(scenario) for _, scenario in scenarios.iterrows()]
+    scenarios["event"] = scenarios["package"] = ""  # broad requests, so many candidates tie at the top
+    requests += [as_search_request(scenario) for _, scenario in scenarios.iterrows()]
+    option_sets = [
+        {},
+        {"keyword_index": matching_algorithm.build_keyword_index(db)},
+        {"keyword_matrix": matching_algorithm.build_keyword_matrix(db)},
+        {"fuzzy_index": matching_algorithm.build_fuzzy_index(db)},
+    ]
+    for options in option_sets:
+        for weights in (API_WEIGHTS, ScoringWeights(destination=50, language=30, keywords=10, keyword_mode="each")):
+            metrics = StageMetrics()
+            for number, request in enumerate(requests):
+                full = ranked_ids(db, request, weights=weights, **options)
+                top_k = number % 7
+                assert ranked_ids(db, request, weights=weights, top_k=top_k, metrics=metrics, **options) == full[:top_k]
+            if options:
+                assert metrics.as_dict()["counters"]["candidates_pruned"] > 0
+
+
+# The async matcher returns what the sync one does, with every index option
+def test_match_buddies_async_matches_sync(tmp_path):
+    url = f"sqlite:///{tmp_path / 'buddies.db'}"
+    db = sqlite_session(models, 2_000, seed=4, url=url)
+    requests = [as_search_request(scenario) for _, scenario in make_scenarios(10, seed=5).iterrows()]
+    option_sets = [
+        {},
+        {"keyword_index": matching_algorithm.build_keyword_index(db), "partitions": matching_algorithm.build_partitions(db)},
+        {"fuzzy_index": matching_algorithm.build_fuzzy_index(db), "top_k": 5},
+        {"cache": matching_algorithm.MatchCache(maxsize=100)},
+    ]
+    expected = [[ranked_ids(db, request, **options) for request in requests] for options in option_sets]
+    assert any(expected[0])
+    option_sets[-1] = {"cache": matching_algorithm.MatchCache(maxsize=100)}
+
+    async def run():
+        sessions = matching_algorithm.create_async_session_factory(url.replace("sqlite:", "sqlite+aiosqlite:"))
+
+        async def ranked(request, options):
+            async with sessions() as session:
+                return [buddy.id for buddy in await matching_algorithm.match_buddies_async(session, request, **options)]
+
+        results = []
+        for options in option_sets:
+            # Concurrent requests, each served twice so the cached path is exercised too
+            for _ in range(2):
+                results.append(await asyncio.gather(*(ranked(request, options) for request in requests)))
+        await sessions.kw["bind"].dispose()
+        return results
+
+    assert asyncio.run(run()) == [ids for ids in expected for _ in range(2)]
+
+
+# The async session factory works on in-memory SQLite too, whose StaticPool takes no pool sizes
+def test_async_session_factory_on_in_memory_sqlite():
+    async def run():
+        sessions = matching_algorithm.create_async_session_factory("sqlite+aiosqlite://")
+        async with sessions.kw["bind"].begin() as connection:
+            await connection.run_sync(models.Base.metadata.create_all)
+        async with sessions() as session:
+            session.add(models.Buddy(name="Amelie", destination="Paris", language="French", keywords="art",
+                                     event="", package=""))
+            await session.commit()
+            request = SimpleNamespace(destination="Paris", language="French", keywords="art", event="", package="")
+            matched = [buddy.name for buddy in await matching_algorithm.match_buddies_async(session, request)]
+        await sessions.kw["bind"].dispose()
+        return matched
+
+    assert asyncio.run(run()) == ["Amelie"]
+
+
+# Batch matching gives every request what match_buddies gives it, in input order, with one
+# candidate query per destination
+def test_match_buddies_batch_matches_single_requests():
+    db = sqlite_session(models, 2_000, seed=4)
+    requests = [as_search_request(scenario) for _, scenario in make_scenarios(30, seed=5).iterrows()]
+    option_sets = [
+        {},
+        {"keyword_index": matching_algorithm.build_keyword_index(db), "partitions": matching_algorithm.build_partitions(db)},
+        {"fuzzy_index": matching_algorithm.build_fuzzy_index(db), "top_k": 5},
+    ]
+    for options in option_sets:
+        expected = [ranked_ids(db, request, **options) for request in requests]
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.get_bind(), "before_cursor_execute", listener)
+        db.expunge_all()
+        matches = matching_algorithm.match_buddies_batch(db, requests, **options)
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+        assert all(match.ok for match in matches)
+        assert [[buddy.id for buddy in match.buddies] for match in matches] == expected
+        assert len(statements) == len({request.destination.lower() for request in requests})
+    assert any(expected)
+
+
+# % and _ in a request are characters to find, not LIKE wildcards, in the query and in the batch
+# matcher's checks on loaded rows alike
+def test_like_wildcards_in_requests_are_literal(db, buddy_model):
+    db.add(buddy_model(name="Vera", destination="Paris", language="French", keywords="100% vegan", event="", package=""))
+    db.commit()
+
+    def request(destination, keywords):
+        return SimpleNamespace(destination=destination, language="French", keywords=keywords, event="", package="")
+
+    requests = [request("Paris", "100%"), request("Paris", "1_0"), request("Paris", "%"), request("P_ris", ""),
+                request("Paris", "food")]
+    expected = [[10], [], [10], [], [8]]
+    assert [ranked_ids(db, search) for search in requests] == expected
+    matches = matching_algorithm.match_buddies_batch(db, requests)
+    assert [[buddy.id for buddy in match.buddies] for match in matches] == expected
+    assert [i for i, _ in matching_algorithm.match_buddy_scores(db, request("Paris", "100%"))] == [10]
+
+
+# The bulk endpoint answers every payload on its own: validation errors as 422, no matches as 404,
+# matches as 200, in input order
+def test_book_buddies_batch_reports_each_item(db):
+    payloads = [
+        {"destination": "Paris", "language": "French", "keywords": "", "event": "", "package": ""},
+        {"destination": "Paris"},
+        {"destination": "Atlantis", "language": "English", "keywords": "", "event": "", "package": ""},
+        {"destination": "Tokyo", "language": "english", "keywords": "anime", "event": "", "package": ""},
+    ]
+    responses = matching_algorithm.book_buddies_batch(db, payloads)
+    assert [response["status"] for response in responses] == [200, 422, 404, 200]
+    assert [match["name"] for match in responses[0]["matches"]] == ["Marie", "Pierre", "Nadia"]
+    assert {error["loc"][0] for error in responses[1]["detail"]} == {"language", "keywords", "event", "package"}
+    assert [match["id"] for match in responses[3]["matches"]] == [6]
+
+    # A request that fails while matching is reported without failing the rest
+    broken = SimpleNamespace(destination="Paris", language=5, keywords="", event="", package="")
+    matches = matching_algorithm.match_buddies_batch(db, [broken, matching_algorithm.BuddySearchRequest(**payloads[0])])
+    assert not matches[0].ok and "AttributeError" in matches[0].error
+    assert [buddy.name for buddy in matches[1].buddies] == ["Marie", "Pierre", "Nadia"]
+
+
+# Pages rendered from column rows hold what match_buddies ranks, field for field; later pages come
+# from the stored ranking by cursor, without matching again
+def test_match_page_follows_the_ranking(monkeypatch):
+    db = sqlite_session(models, 4_000, seed=8)
+    cursors = matching_algorithm.CursorStore()
+    request = SimpleNamespace(destination="Paris", language="English", keywords="food,art,music,history", event="",
+                              package="")
+    options = {"keyword_index": matching_algorithm.build_keyword_index(db)}
+    expected = [{field: getattr(buddy, field) for field in matching_algorithm.BUDDY_RESPONSE_FIELDS}
+                for buddy in matching_algorithm.match_buddies(db, request, **options)]
+    assert len(expected) > 25
+
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    page = json.loads(matching_algorithm.match_page(db, request, cursors, limit=10, **options))
+    assert page["matches"] == expected[:10] and page["total"] == len(expected)
+    # Ranking reads the scored columns of every candidate; the response fields come for the page only
+    ranking_statement, page_statement = statements
+    assert "buddies.name" not in ranking_statement and "buddies.keywords" not in ranking_statement
+    assert "buddies.name" in page_statement
+    statements.clear()
+    matches = page["matches"]
+    while page["next_cursor"]:
+        page = json.loads(matching_algorithm.match_page(db, cursors=cursors, cursor=page["next_cursor"], limit=10,
+                                                        fields=("name", "id")))
+        matches += page["matches"]
+    assert matches[10:] == [{"name": buddy["name"], "id": buddy["id"]} for buddy in expected[10:]]
+    assert len(statements) == -(-(len(expected) - 10) // 10)  # one primary-key lookup per later page
+
+    # Without orjson the same body comes from the json module
+    monkeypatch.setattr(matching_algorithm, "orjson", None)
+    assert json.loads(matching_algorithm.match_page(db, request, limit=100, **options))["matches"] == expected
+    assert json.loads(matching_algorithm.match_page(db, request, limit=100, **options))["next_cursor"] is None
+
+    with pytest.raises(LookupError, match="expired"):
+        matching_algorithm.match_page(db, cursors=cursors, cursor="nope.10")
+    with pytest.raises(LookupError, match="Malformed"):
+        matching_algorithm.match_page(db, cursors=cursors, cursor="nope")
+    with pytest.raises(ValueError, match="CursorStore"):
+        matching_algorithm.match_page(db, request, limit=10, **options)
+    with pytest.raises(ValueError, match="password"):
+        matching_algorithm.match_page(db, request, fields=("id", "password"))
+
+
+# The request is only formatted into the log at DEBUG; INFO logging never renders it
+def test_request_is_not_formatted_at_info(db, caplog):
+    class Request(SimpleNamespace):
+        def __str__(self):
+            raise AssertionError("request formatted at INFO")
+        __repr__ = __str__
+
+    caplog.set_level("INFO", logger=matching_algorithm.logger.name)
+    ranked_ids(db, Request(destination="Paris", language="English", keywords="art", event="", package=""))
+    assert caplog.records
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from batch_processing import find_best_buddies_batch, preprocess_data
+from benchmarks import make_profiles, make_request
+from scoring_engine import encode_profiles
+
+
+# Any worker count gives the serial results, in scenario order
+def test_parallel_matches_serial():
+    profiles = preprocess_data(make_profiles(3000, seed=8)).sample(frac=1, random_state=8)
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(45)])
+    encoded = encode_profiles(profiles)
+    expected = find_best_buddies_batch(scenarios, profiles, encoded=encoded)
+    for workers in (2, 3):
+        assert find_best_buddies_batch(scenarios, profiles, encoded=encoded, workers=workers) == expected
+    assert find_best_buddies_batch(scenarios, profiles, encoded=encoded, workers=2, max_cells=10_000) == expected
+
+
+# A streamed run starts one pool and shares the profiles once, however many chunks it matches
+def test_stream_reuses_one_pool(monkeypatch):
+    import parallel_eval
+    from batch_processing import iter_scenario_metrics
+    profiles = make_profiles(1000, seed=9)
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(30)])
+    chunks = [scenarios.iloc[start:start + 7] for start in range(0, len(scenarios), 7)]
+    expected = list(iter_scenario_metrics(chunks, profiles))
+
+    shares = []
+    share_profiles = parallel_eval.share_profiles
+    monkeypatch.setattr(parallel_eval, "share_profiles", lambda encoded: shares.append(1) or share_profiles(encoded))
+    assert list(iter_scenario_metrics(chunks, profiles, workers=2)) == expected
+    assert len(shares) == 1
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from batch_processing import build_partitions, find_best_buddies
+from benchmarks import make_profiles, make_request
+from partitions import ProfilePartitions
+from scoring_engine import encode_profiles
+
+
+def build():
+    return ProfilePartitions.build([
+        (1, "Los Angeles", "English,Spanish"),
+        (2, " los  angeles", "English"),
+        (3, "Tokyo", "Japanese"),
+        (4, None, "English"),
+    ])
+
+
+# Destinations are normalized before hashing; unknown destinations have no partition
+def test_candidates_by_destination():
+    partitions = build()
+    assert partitions.candidates("LOS ANGELES") == {1, 2}
+    assert partitions.candidates("Tokyo") == {3}
+    assert partitions.candidates("Atlantis") is None
+
+
+# Language narrows the block, and falls back to the whole destination when nobody speaks it
+def test_candidates_by_language():
+    partitions = build()
+    assert partitions.candidates("Los Angeles", "Spanish") == {1}
+    assert partitions.candidates("Los Angeles", "spanish, english") == {1, 2}
+    assert partitions.candidates("Los Angeles", "Elvish") == {1, 2}
+
+
+# Moving and removing profiles updates their blocks in place
+def test_incremental_updates():
+    partitions = build()
+    partitions.add(3, "Los Angeles", "Japanese")
+    assert partitions.candidates("Tokyo") is None
+    assert partitions.candidates("Los Angeles", "Japanese") == {3}
+    partitions.remove(1)
+    partitions.remove(99)
+    assert partitions.candidates("Los Angeles", "Spanish") == {2, 3}
+    assert len(partitions) == 3
+
+
+# Blocks whose destination contains a substring: what an ILIKE '%destination%' filter can match
+def test_containing():
+    partitions = build()
+    partitions.add(5, "North Los Angeles", "English")
+    assert partitions.containing("Los Angeles") == {1, 2, 5}
+    assert partitions.containing(" LOS   angeles ") == {1, 2, 5}
+    assert partitions.containing("kyo") == {3}
+    assert partitions.containing("Atlantis") == set()
+
+
+# Destination is scored, not filtered, in batch matching: partitions never change the top k. The
+# block alone is scored when its k-th best beats every profile outside it, which the API weights
+# (destination worth more than the rest put together) mostly allow and the batch weights rarely do.
+def test_partitioned_matching_matches_exhaustive():
+    from keyword_scoring import API_WEIGHTS, BATCH_WEIGHTS
+    from stage_metrics import StageMetrics
+    profiles = make_profiles(2000, seed=3)
+    profiles.index = np.random.default_rng(3).permutation(5000)[:2000]
+    encoded = encode_profiles(profiles)
+    for by_language in (False, True):
+        partitions = build_partitions(profiles, by_language=by_language)
+        for weights in (BATCH_WEIGHTS, API_WEIGHTS):
+            metrics = StageMetrics()
+            for seed in range(20):
+                request = make_request(seed=seed)
+                for top_k in (1, 5, 50):
+                    expected = find_best_buddies(request, profiles, encoded, top_k=top_k, weights=weights)
+                    assert find_best_buddies(request, profiles, encoded, partitions, top_k=top_k, weights=weights,
+                                             metrics=metrics) == expected
+            if weights is API_WEIGHTS:
+                assert metrics.counters["candidates_scanned"] < 20 * 3 * len(profiles) / 2
+
+
+# A destination with no partition is scored against every profile
+def test_partitioned_matching_fallback():
+    profiles = make_profiles(500, seed=4)
+    encoded = encode_profiles(profiles)
+    partitions = build_partitions(profiles, by_language=True)
+    request = make_request(seed=5)
+    request["destination"] = "Atlantis"
+    assert find_best_buddies(request, profiles, encoded, partitions) == find_best_buddies(request, profiles, encoded)
+
+
+# Language partitions narrow the block further when the language is worth enough points; profiles
+# outside the block still rank wherever their score puts them
+def test_partitioned_matching_by_language():
+    from keyword_scoring import API_WEIGHTS
+    from stage_metrics import StageMetrics
+    profiles = pd.DataFrame({
+        "Destination": ["Paris", "Paris", "Paris", "Rome"],
+        "User Language": ["French", "English", "French", "French"],
+        "Local Language": ["French"] * 4,
+        "Keywords": ["art"] * 4,
+        "Event": ["City Tour"] * 4,
+        "Package": ["Solo"] * 4,
+    })
+    request = pd.Series({"destination": "Paris", "language": "French", "local_language": "French",
+                         "keywords": "art", "event": "City Tour", "package": "Solo"})
+    partitions = build_partitions(profiles, by_language=True)
+    assert find_best_buddies(request, profiles, partitions=partitions) == [0, 2, 1, 3]
+    metrics = StageMetrics()
+    assert find_best_buddies(request, profiles, partitions=partitions, top_k=2, weights=API_WEIGHTS,
+                             metrics=metrics) == [0, 2]
+    assert metrics.counters["candidates_scanned"] == 2
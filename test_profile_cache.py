@@ -0,0 +1,90 @@
+import os
+
+import pandas as pd
+import pytest
+
+import profile_cache
+from profile_cache import read_excel_cached
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("openpyxl")
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "profiles.xlsx")
+    pd.DataFrame({"Buddy_id": [1, 2], "Destination": ["Paris", "Tokyo"]}).to_excel(path, index=False)
+    return path
+
+
+@pytest.fixture
+def excel_reads(monkeypatch):
+    calls = []
+    read_excel = pd.read_excel
+
+    def counting_read_excel(*args, **kwargs):
+        calls.append(args[0])
+        return read_excel(*args, **kwargs)
+
+    monkeypatch.setattr(profile_cache.pd, "read_excel", counting_read_excel)
+    return calls
+
+
+# The spreadsheet is parsed once; later loads come from the snapshot with the same content
+def test_second_load_uses_snapshot(workbook, tmp_path, excel_reads):
+    cache_dir = str(tmp_path / "cache")
+    first = read_excel_cached(workbook, cache_dir)
+    second = read_excel_cached(workbook, cache_dir)
+    assert len(excel_reads) == 1
+    pd.testing.assert_frame_equal(first, second)
+
+
+# Touching the file without changing it does not trigger a re-parse
+def test_touch_keeps_snapshot(workbook, tmp_path, excel_reads):
+    cache_dir = str(tmp_path / "cache")
+    read_excel_cached(workbook, cache_dir)
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000_000))
+    read_excel_cached(workbook, cache_dir)
+    read_excel_cached(workbook, cache_dir)
+    assert len(excel_reads) == 1
+
+
+# Changed content is re-parsed and replaces the snapshot
+def test_changed_file_is_reparsed(workbook, tmp_path, excel_reads):
+    cache_dir = str(tmp_path / "cache")
+    read_excel_cached(workbook, cache_dir)
+    pd.DataFrame({"Buddy_id": [3], "Destination": ["Rome"]}).to_excel(workbook, index=False)
+    frame = read_excel_cached(workbook, cache_dir)
+    assert len(excel_reads) == 2
+    assert frame["Destination"].tolist() == ["Rome"]
+    assert read_excel_cached(workbook, cache_dir)["Destination"].tolist() == ["Rome"]
+    assert len(excel_reads) == 2
+
+
+# Other read options, or a same-named file elsewhere, get their own snapshot
+def test_snapshot_per_source_and_read_options(workbook, tmp_path, excel_reads):
+    cache_dir = str(tmp_path / "cache")
+    with pd.ExcelWriter(workbook, mode="a") as writer:
+        pd.DataFrame({"Buddy_id": [7], "Destination": ["Lima"]}).to_excel(writer, sheet_name="More", index=False)
+    other = tmp_path / "other"
+    other.mkdir()
+    other_workbook = str(other / "profiles.xlsx")
+    pd.DataFrame({"Buddy_id": [9], "Destination": ["Oslo"]}).to_excel(other_workbook, index=False)
+
+    for _ in range(2):
+        assert read_excel_cached(workbook, cache_dir)["Destination"].tolist() == ["Paris", "Tokyo"]
+        assert read_excel_cached(workbook, cache_dir, sheet_name=1)["Destination"].tolist() == ["Lima"]
+        assert read_excel_cached(workbook, cache_dir, usecols=["Buddy_id"]).columns.tolist() == ["Buddy_id"]
+        assert read_excel_cached(other_workbook, cache_dir)["Destination"].tolist() == ["Oslo"]
+    assert len(excel_reads) == 4
+
+
+# An index read from the sheet (index_col=) is stored with the snapshot and restored from it
+def test_snapshot_keeps_the_index(workbook, tmp_path, excel_reads):
+    cache_dir = str(tmp_path / "cache")
+    first = read_excel_cached(workbook, cache_dir, index_col=0)
+    second = read_excel_cached(workbook, cache_dir, index_col=0)
+    assert len(excel_reads) == 1
+    assert first.index.name == "Buddy_id"
+    pd.testing.assert_frame_equal(first, second)
@@ -0,0 +1,124 @@
+import struct
+
+import numpy as np
+import pytest
+
+from batch_processing import build_partitions, find_best_buddies, find_best_buddies_batch, preprocess_data
+from benchmarks import make_profiles, make_request, make_scenarios
+from keyword_index import SYNONYMS
+from profile_index import SCHEMA_VERSION, IndexFileError, build_index, load_index
+from scoring_engine import encode_profiles
+
+
+@pytest.fixture
+def profiles():
+    profiles = preprocess_data(make_profiles(2_000, seed=13))
+    profiles.loc[::9, "Keywords"] = None
+    profiles.index = np.random.default_rng(13).permutation(5_000)[:2_000]
+    return profiles
+
+
+def test_round_trip(profiles, tmp_path):
+    path = tmp_path / "profiles.idx"
+    encoded = build_index(profiles, path, metadata={"source": "test"})
+    index = load_index(path)
+    assert len(index) == len(profiles)
+    assert index.encoded.index.equals(encoded.index)
+    for column, codes in encoded.codes.items():
+        assert np.array_equal(index.encoded.codes[column], codes)
+        assert not index.encoded.codes[column].flags.writeable  # served from the memory map
+    assert (index.encoded.keyword_matrix != encoded.keyword_matrix).nnz == 0
+    assert index.encoded.vocabulary == encoded.vocabulary
+    assert index.synonyms == SYNONYMS
+    assert index.metadata == {"schema_version": SCHEMA_VERSION, "size": 2_000, "source": "test"}
+
+
+# Matching from the loaded index gives the same results as matching the table it was built from
+@pytest.mark.parametrize("by_language", [False, True])
+def test_loaded_index_matches_like_the_table(profiles, tmp_path, by_language):
+    path = tmp_path / "profiles.idx"
+    build_index(profiles, path, by_language=by_language)
+    index = load_index(path)
+    partitions = build_partitions(profiles, by_language=by_language)
+    for seed in range(20):
+        request = make_request(seed=seed)
+        assert find_best_buddies(request, None, index.encoded, index.partitions) == \
+            find_best_buddies(request, profiles, partitions=partitions)
+        assert find_best_buddies(request, None, index.encoded) == find_best_buddies(request, profiles)
+    scenarios = make_scenarios(30, seed=14)
+    assert find_best_buddies_batch(scenarios, None, encoded=index.encoded) == \
+        find_best_buddies_batch(scenarios, profiles)
+
+
+def test_string_index_labels(tmp_path):
+    profiles = make_profiles(50, seed=15)
+    profiles.index = [f"buddy-{i}" for i in range(50)]
+    build_index(profiles, tmp_path / "profiles.idx")
+    index = load_index(tmp_path / "profiles.idx")
+    assert index.encoded.index.tolist() == profiles.index.tolist()
+    assert index.partitions.candidates("Nowhere") is None
+    assert find_best_buddies(make_request(seed=1), None, index.encoded) == \
+        find_best_buddies(make_request(seed=1), None, encode_profiles(profiles))
+
+
+def test_rejects_bad_files(profiles, tmp_path):
+    path = tmp_path / "profiles.idx"
+    build_index(profiles, path)
+    original = path.read_bytes()
+
+    path.write_bytes(original[:-1] + bytes([original[-1] ^ 0xFF]))
+    with pytest.raises(IndexFileError, match="checksum"):
+        load_index(path)
+    assert len(load_index(path, verify=False)) == 2_000
+
+    path.write_bytes(original[:8] + struct.pack("<I", SCHEMA_VERSION + 1) + original[12:])
+    with pytest.raises(IndexFileError, match="schema version"):
+        load_index(path)
+
+    path.write_bytes(original[:-100])
+    with pytest.raises(IndexFileError, match="truncated"):
+        load_index(path)
+
+    path.write_bytes(b"not an index file")
+    with pytest.raises(IndexFileError, match="not a profile index"):
+        load_index(path)
+
+
+# Raw columns come back from the mapped string heap and arrays, rendered by label
+def test_raw_columns_render_matches(profiles, tmp_path):
+    profiles = profiles.assign(Name=[f"Buddy {i} \N{GREEK SMALL LETTER BETA}" for i in range(len(profiles))])
+    profiles.loc[profiles.index[::5], "Name"] = None
+    path = tmp_path / "profiles.idx"
+    build_index(profiles, path, columns=["Buddy_id", "Name", "Keywords"])
+    index = load_index(path)
+    assert not index.columns["Name"].data.flags.writeable
+
+    matches = find_best_buddies(make_request(seed=3), None, index.encoded, top_k=20)
+    records = index.records(matches, ["Buddy_id", "Name", "Keywords", "Destination"])
+    expected = profiles.loc[matches, ["Buddy_id", "Name", "Keywords", "Destination"]].astype(object)
+    assert records == expected.where(expected.notna(), None).to_dict("records")
+    assert isinstance(records[0]["Buddy_id"], int)
+    with pytest.raises(KeyError):
+        index.records([-1])
+    build_index(profiles, path)
+    with pytest.raises(KeyError, match="Name"):
+        load_index(path).records(matches, ["Name"])
+
+
+# Labels repeated on deleted rows and out of order (a ProfileStore after updates) resolve to the live row
+def test_records_from_a_store_with_updates(tmp_path):
+    from profile_index import write_index
+    from profile_store import ProfileStore
+    profiles = make_profiles(30, seed=16)
+    store = ProfileStore.from_profiles(profiles)
+    store.upsert({**profiles.iloc[4].to_dict(), "Destination": "Lisbon", "Keywords": "surfing"})
+    store.delete(7)
+    write_index(tmp_path / "profiles.idx", store, store.partitions,
+                columns={"Keywords": store.column_values("Keywords")})
+    index = load_index(tmp_path / "profiles.idx")
+    assert index.records([5, 1], ["Destination", "Keywords"]) == [
+        {"Destination": "Lisbon", "Keywords": "surfing"},
+        {"Destination": profiles.loc[0, "Destination"], "Keywords": profiles.loc[0, "Keywords"]},
+    ]
+    with pytest.raises(KeyError, match="7"):
+        index.positions([7])
@@ -0,0 +1,130 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import profile_store
+from batch_processing import build_partitions, find_best_buddies, find_best_buddies_batch
+from benchmarks import make_profiles, make_request, make_scenarios
+from profile_index import load_index, write_index
+from profile_store import ProfileStore, apply_delta_file
+
+
+# Apply random upserts, updates and deletes to a store and to a plain dict of records kept in the
+# order the store should rank ties in (an update moves a profile to the end)
+def churn(store, records, seed, steps=300):
+    rng = np.random.default_rng(seed)
+    fresh = make_profiles(steps, seed=seed + 1).to_dict("records")
+    next_id = max(records) + 1
+    for step in range(steps):
+        action = rng.integers(3)
+        if action == 0:
+            record = dict(fresh[step], Buddy_id=next_id)
+            next_id += 1
+        elif action == 1:
+            record = dict(fresh[step], Buddy_id=int(rng.choice(list(records))))
+            record["Keywords"] = record["Keywords"] + ",brand new keyword" if step % 7 == 0 else record["Keywords"]
+            record["Event"] = "Unseen Event" if step % 11 == 0 else record["Event"]
+        else:
+            buddy_id = int(rng.choice(list(records)))
+            assert store.delete(buddy_id)
+            del records[buddy_id]
+            continue
+        store.upsert(record)
+        records.pop(record["Buddy_id"], None)
+        records[record["Buddy_id"]] = record
+
+
+def as_frame(records):
+    return pd.DataFrame(list(records.values())).set_index("Buddy_id", drop=False)
+
+
+@pytest.mark.parametrize("by_language", [False, True])
+def test_store_ranks_like_a_fresh_table(by_language):
+    profiles = make_profiles(400, seed=3)
+    store = ProfileStore.from_profiles(profiles, by_language=by_language)
+    records = {record["Buddy_id"]: record for record in profiles.to_dict("records")}
+    # Compile a request first so the memo has to notice codes added by the churn
+    find_best_buddies(make_request(seed=0), None, store)
+    churn(store, records, seed=4)
+
+    expected = as_frame(records)
+    assert store.live_count == len(expected)
+    assert sorted(store.to_frame().index) == sorted(expected.index)
+    partitions = build_partitions(expected, by_language=by_language)
+    for seed in range(30):
+        request = make_request(seed=seed)
+        assert find_best_buddies(request, None, store, top_k=10) == find_best_buddies(request, expected, top_k=10)
+        assert find_best_buddies(request, None, store, store.partitions, top_k=10) == \
+            find_best_buddies(request, expected, partitions=partitions, top_k=10)
+    scenarios = make_scenarios(40, seed=5)
+    assert find_best_buddies_batch(scenarios, None, encoded=store, top_k=10) == \
+        find_best_buddies_batch(scenarios, expected, top_k=10)
+
+
+def test_deleted_profiles_are_never_ranked():
+    profiles = make_profiles(6, seed=6)
+    store = ProfileStore.from_profiles(profiles)
+    for buddy_id in [1, 2, 3, 4]:
+        store.delete(buddy_id)
+    assert not store.delete(1)
+    request = make_request(seed=1)
+    assert sorted(find_best_buddies(request, None, store, top_k=5)) == [5, 6]
+    assert sorted(find_best_buddies_batch(make_scenarios(3, seed=1), None, encoded=store)[0]) == [5, 6]
+    assert 1 not in store and 5 in store
+
+
+def test_compaction_keeps_rankings(monkeypatch):
+    monkeypatch.setattr(profile_store, "COMPACT_MIN_DEAD", 10)
+    profiles = make_profiles(40, seed=7)
+    store = ProfileStore.from_profiles(profiles)
+    for buddy_id in range(1, 31):
+        store.delete(buddy_id)
+    assert len(store) < 30  # compacted once the deleted rows outnumbered the live ones
+    assert len(store.dead) < 10
+    expected = profiles[profiles["Buddy_id"] > 30].set_index("Buddy_id", drop=False)
+    partitions = build_partitions(expected)
+    for seed in range(10):
+        request = make_request(seed=seed)
+        assert find_best_buddies(request, None, store) == find_best_buddies(request, expected)
+        assert find_best_buddies(request, None, store, store.partitions) == \
+            find_best_buddies(request, expected, partitions=partitions)
+
+
+def test_apply_delta_file(tmp_path):
+    store = ProfileStore.from_profiles(make_profiles(5, seed=8))
+    path = tmp_path / "deltas.jsonl"
+    changes = [
+        {"op": "upsert", "Buddy_id": 6, "Destination": "Lisbon", "Keywords": "surfing"},
+        {"Buddy_id": 2, "Destination": "Lisbon", "Keywords": "surfing,food"},
+        {"op": "delete", "Buddy_id": 3},
+        {"op": "delete", "Buddy_id": 99},
+    ]
+    path.write_text("\n".join(json.dumps(change) for change in changes) + "\n\n")
+    assert apply_delta_file(store, path) == {"upserts": 2, "deletes": 1, "missing": 1}
+    assert store.profile(2)["Destination"] == "Lisbon"
+    assert sorted(store.partitions.candidates("lisbon")) == [store._rows[6], store._rows[2]]
+    request = {"destination": "Lisbon", "keywords": "surfing"}
+    assert find_best_buddies(request, None, store, store.partitions, top_k=2) == [6, 2]
+
+    path.write_text('{"op": "rename", "Buddy_id": 1}\n')
+    with pytest.raises(ValueError, match="rename"):
+        apply_delta_file(store, path)
+    path.write_text('{"Buddy_id": 1\n')
+    with pytest.raises(ValueError, match=":1:"):
+        apply_delta_file(store, path)
+
+
+# A store with deleted rows can be written out as an index file; the deletions carry over
+def test_store_round_trips_through_index_file(tmp_path):
+    profiles = make_profiles(50, seed=9)
+    store = ProfileStore.from_profiles(profiles)
+    for buddy_id in range(1, 50, 3):
+        store.delete(buddy_id)
+    write_index(tmp_path / "profiles.idx", store, store.partitions)
+    index = load_index(tmp_path / "profiles.idx")
+    for seed in range(10):
+        request = make_request(seed=seed)
+        assert find_best_buddies(request, None, index.encoded, index.partitions) == \
+            find_best_buddies(request, None, store, store.partitions)
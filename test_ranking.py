@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from ranking import rank_by_score
+
+
+def scored(*pairs):
+    return [(SimpleNamespace(id=buddy_id), score) for buddy_id, score in pairs]
+
+
+def ids(ranked):
+    return [buddy.id for buddy, score in ranked]
+
+
+# Equal scores are ordered by buddy id whatever order the database returned them in
+def test_ties_break_on_id():
+    pairs = scored((7, 50), (3, 80), (5, 50), (1, 50), (9, 95))
+    assert ids(rank_by_score(pairs)) == [9, 3, 1, 5, 7]
+    assert ids(rank_by_score(list(reversed(pairs)))) == [9, 3, 1, 5, 7]
+
+
+# Any top_k is a prefix of the full ranking
+def test_top_k_prefix():
+    pairs = scored(*[(i, (i * 37) % 11) for i in range(50)])
+    full = ids(rank_by_score(pairs))
+    for k in (0, 1, 3, 10, 50, 80):
+        assert ids(rank_by_score(pairs, top_k=k)) == full[:k]
@@ -0,0 +1,58 @@
+import gc
+import weakref
+from types import SimpleNamespace
+
+from keyword_index import KeywordIndex
+from request_terms import CompiledRequest, compile_request
+from sql_scoring import request_keywords, top_scored_ids
+
+
+def request(destination, language, keywords="", event="", package=""):
+    return SimpleNamespace(destination=destination, language=language, keywords=keywords, event=event, package=package)
+
+
+def test_compiled_fields_are_normalized_once():
+    compiled = compile_request(request("Los Angeles", "English", "Food, ART,,Nightlife", "City Tour", ""))
+    assert (compiled.destination, compiled.language, compiled.event, compiled.package) == \
+        ("los angeles", "english", "city tour", "")
+    # Empty terms stay in keyword_terms (the old split kept them) but not in keyword_set
+    assert compiled.keyword_terms == ("food", "art", "", "nightlife")
+    assert compiled.keyword_set == {"food", "art", "nightlife"}
+    assert request_keywords(compiled) == request_keywords(request("x", "y", "Food, ART,,Nightlife"))
+
+
+def test_compile_is_memoized():
+    first = compile_request(request("Paris", "French", "art"))
+    assert compile_request(request("Paris", "French", "art")) is first
+    assert compile_request(first) is first
+    assert compile_request(request("Paris", "French", "food")) is not first
+    assert isinstance(first, CompiledRequest)
+
+
+def test_keyword_set_is_synonym_folded():
+    index = KeywordIndex()
+    compiled = compile_request(request("Berlin", "German", "Concert, Cannabis,food"), index.expand)
+    assert compiled.keyword_set == {"music", "weed", "food"}
+    assert compiled.keyword_terms == ("concert", "cannabis", "food")
+
+
+# Memoized requests are kept per index: each index compiles its own, and a dropped index is freed
+def test_memo_does_not_keep_indexes_alive():
+    index = KeywordIndex()
+    first = compile_request(request("Berlin", "German", "concert"), index.expand)
+    assert compile_request(request("Berlin", "German", "concert"), index.expand) is first
+    assert compile_request(request("Berlin", "German", "concert"), KeywordIndex().expand) is not first
+    dropped = weakref.ref(index)
+    del index, first
+    gc.collect()
+    assert dropped() is None
+
+
+# SQL scoring of a compiled request is identical to scoring the raw request
+def test_compiled_request_scores_like_raw(db, buddy_model):
+    for raw in [
+        request("Los Angeles", "English,Spanish", "shopping,food,art", "City Tour", "Solo Traveler Buddy"),
+        request("PARIS", "French", "Art, Nightlife"),
+        request("new delhi", "HINDI", "", "Food Festival"),
+    ]:
+        assert top_scored_ids(db, buddy_model, compile_request(raw)) == top_scored_ids(db, buddy_model, raw)
@@ -0,0 +1,65 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from batch_processing import evaluate_metrics, iter_scenario_metrics, save_metrics_to_csv, stream_metrics_to_csv
+from benchmarks import make_profiles, make_request
+from scenario_stream import iter_scenario_chunks, write_metric_rows
+
+
+@pytest.fixture
+def scenarios():
+    return pd.DataFrame([make_request(seed=s) for s in range(23)])
+
+
+# Streaming CSV and JSONL replays write the same rows as evaluate_metrics + save_metrics_to_csv
+def test_stream_matches_evaluate_metrics(tmp_path, scenarios):
+    profiles = make_profiles(400, seed=2)
+    expected_file = tmp_path / "expected.csv"
+    save_metrics_to_csv(evaluate_metrics(scenarios, profiles), str(expected_file))
+    expected = pd.read_csv(expected_file)
+
+    scenarios.to_csv(tmp_path / "scenarios.csv", index=False)
+    scenarios.to_json(tmp_path / "scenarios.jsonl", orient="records", lines=True)
+    for source in ("scenarios.csv", "scenarios.jsonl"):
+        output_file = tmp_path / f"{source}.metrics.csv"
+        written = stream_metrics_to_csv(str(tmp_path / source), profiles, str(output_file), chunk_size=5, flush_every=4)
+        assert written == len(scenarios)
+        pd.testing.assert_frame_equal(pd.read_csv(output_file), expected)
+
+
+
+# A malformed scenario is logged and skipped; every other scenario is still matched
+def test_bad_scenario_is_isolated(scenarios, caplog):
+    profiles = make_profiles(400, seed=2)
+    expected = evaluate_metrics(scenarios, profiles)
+    scenarios["destination"] = scenarios["destination"].astype(object)
+    scenarios.at[3, "destination"] = {"city": "Paris"}
+    with caplog.at_level(logging.ERROR):
+        result = evaluate_metrics(scenarios, profiles)
+    assert "Error processing scenario 4" in caplog.text
+    pd.testing.assert_frame_equal(result, expected.drop(index=3).reset_index(drop=True))
+
+    rows = list(iter_scenario_metrics([scenarios.iloc[:5], scenarios.iloc[5:]], profiles))
+    assert [row["Scenario"] for row in rows] == [n for n in range(1, len(scenarios) + 1) if n != 4]
+    assert [row["Top Buddy Scores"] for row in rows] == result["Top Buddy Scores"].tolist()
+
+def test_iter_scenario_chunks_sizes(tmp_path, scenarios):
+    scenarios.to_csv(tmp_path / "scenarios.csv", index=False)
+    assert [len(chunk) for chunk in iter_scenario_chunks(str(tmp_path / "scenarios.csv"), 10)] == [10, 10, 3]
+    with pytest.raises(ValueError):
+        next(iter_scenario_chunks(str(tmp_path / "scenarios.txt")))
+
+
+# A run that dies partway leaves every flushed row on disk
+def test_partial_results_survive_a_crash(tmp_path):
+    def rows():
+        for number in range(1, 8):
+            yield {"Scenario": number, "Data Size": 1, "Top Buddy Scores": [number]}
+        raise RuntimeError("worker died")
+
+    output_file = tmp_path / "metrics.csv"
+    with pytest.raises(RuntimeError):
+        write_metric_rows(rows(), str(output_file), flush_every=3)
+    assert pd.read_csv(output_file)["Scenario"].tolist()[:6] == [1, 2, 3, 4, 5, 6]
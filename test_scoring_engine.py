@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+from batch_processing import find_best_buddies, find_best_buddies_batch, preprocess_data, split_data
+from benchmarks import legacy_find_best_buddies, make_profiles, make_request
+from scoring_engine import compact_profiles, encode_profiles, frame_nbytes, score_profiles
+
+
+# Vectorized matcher returns the same top 5 as the iterrows loop on random tables
+def test_matches_legacy_on_random_profiles():
+    for seed in range(20):
+        profiles = make_profiles(300, seed=seed)
+        # Shuffled, non-contiguous index labels like the output of split_data
+        profiles.index = np.random.default_rng(seed).permutation(1000)[:300]
+        encoded = encode_profiles(profiles)
+        for request_seed in range(5):
+            request = make_request(seed=seed * 100 + request_seed)
+            assert find_best_buddies(request, profiles, encoded) == legacy_find_best_buddies(request, profiles)
+
+
+# NaN cells never match, repeated request keywords score repeatedly and keywords are not trimmed
+def test_matches_legacy_on_edge_cases():
+    profiles = pd.DataFrame({
+        "Buddy_id": [1, 2, 3, 4, 5, 6],
+        "Destination": ["Paris", None, "Paris", "Tokyo", "Paris", "Paris"],
+        "User Language": ["French", "French", np.nan, "English", "French", "French"],
+        "Local Language": ["French", "French", "French", None, "French", "French"],
+        "Keywords": ["art,food", "art", None, "food, art", "art,art", ""],
+        "Event": ["City Tour", None, "City Tour", "City Tour", None, "City Tour"],
+        "Package": ["Solo", "Solo", None, "Solo", "Solo", None],
+    }, index=[10, 11, 12, 13, 14, 15])
+    requests = [
+        {"destination": "Paris", "language": "French", "local_language": "French",
+         "keywords": "art,art,food", "event": "City Tour", "package": "Solo"},
+        {"destination": None, "language": np.nan, "local_language": "French",
+         "keywords": np.nan, "event": None, "package": "Solo"},
+        {"destination": "Tokyo", "language": "English", "local_language": None,
+         "keywords": " art,food", "event": "City Tour", "package": "Solo"},
+        {"destination": "Nowhere", "language": "Elvish", "local_language": "Elvish",
+         "keywords": "", "event": "Parade", "package": "Mythical"},
+    ]
+    encoded = encode_profiles(profiles)
+    for request in map(pd.Series, requests):
+        assert find_best_buddies(request, profiles, encoded) == legacy_find_best_buddies(request, profiles)
+
+
+# Columns missing from the profile table contribute nothing
+def test_missing_columns_score_zero():
+    profiles = pd.DataFrame({"Destination": ["Paris", "Rome", "Paris"]})
+    request = pd.Series({"destination": "Paris", "language": "French", "local_language": "French",
+                         "keywords": "art", "event": "City Tour", "package": "Solo"})
+    assert score_profiles(request, encode_profiles(profiles)).tolist() == [20, 0, 20]
+    assert find_best_buddies(request, profiles) == legacy_find_best_buddies(request, profiles)
+
+
+# Batch matrix scoring agrees with per-scenario matching, across chunk boundaries
+def test_batch_matches_single_requests():
+    profiles = make_profiles(500, seed=7)
+    profiles.index = np.random.default_rng(7).permutation(2000)[:500]
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(37)])
+    encoded = encode_profiles(profiles)
+    expected = [find_best_buddies(request, profiles, encoded) for _, request in scenarios.iterrows()]
+    assert find_best_buddies_batch(scenarios, profiles, encoded=encoded) == expected
+    assert find_best_buddies_batch(scenarios, profiles, encoded=encoded, max_cells=1000) == expected
+
+
+# Asking for more matches than there are profiles returns every profile, best first
+def test_batch_k_larger_than_profiles():
+    profiles = make_profiles(3, seed=1)
+    scenarios = pd.DataFrame([make_request(seed=2)])
+    expected = legacy_find_best_buddies(scenarios.iloc[0], profiles)
+    assert find_best_buddies_batch(scenarios, profiles, top_k=10) == [expected]
+
+
+# Top-k is a prefix of the full ranking for every k, with ties in profile order
+def test_top_k_is_stable_prefix():
+    profiles = make_profiles(400, seed=11)
+    encoded = encode_profiles(profiles)
+    request = make_request(seed=12)
+    full = find_best_buddies(request, profiles, encoded, top_k=len(profiles))
+    scores = score_profiles(request, encoded)
+    assert full == profiles.index[np.lexsort((np.arange(len(profiles)), -scores))].tolist()
+    for k in (0, 1, 5, 17, 399):
+        assert find_best_buddies(request, profiles, encoded, top_k=k) == full[:k]
+
+
+# Categorical profiles (after split_data) rank exactly like the raw object columns
+def test_compact_profiles_match_raw():
+    profiles = make_profiles(1000, seed=21)
+    profiles.loc[::7, "Keywords"] = None
+    profiles.loc[::11, "Destination"] = None
+    train, _ = split_data(preprocess_data(profiles))
+    raw_train = profiles.loc[train.index]
+    assert isinstance(train["Destination"].dtype, pd.CategoricalDtype)
+    assert frame_nbytes(train) < frame_nbytes(raw_train)
+    for seed in range(10):
+        request = make_request(seed=seed)
+        assert find_best_buddies(request, train) == legacy_find_best_buddies(request, raw_train)
+
+
+# Mostly-distinct columns are left alone
+def test_compact_profiles_skips_distinct_columns():
+    profiles = pd.DataFrame({"Destination": ["Paris", "Paris", "Rome", "Paris"], "Keywords": ["a", "b", "c", "d"]})
+    compact = compact_profiles(profiles)
+    assert isinstance(compact["Destination"].dtype, pd.CategoricalDtype)
+    assert not isinstance(compact["Keywords"].dtype, pd.CategoricalDtype)
+
+
+# Scenarios compile once per distinct set of values, and a compiled scenario scores like the raw one
+def test_compiled_scenarios_are_memoized():
+    profiles = make_profiles(300, seed=5)
+    encoded = encode_profiles(profiles)
+    request = make_request(seed=6)
+    compiled = encoded.compile(request)
+    assert encoded.compile(request.copy()) is compiled
+    assert encoded.compile(compiled) is compiled
+    assert compiled["destination"] == request["destination"]
+    assert score_profiles(compiled, encoded).tolist() == score_profiles(request, encoded).tolist()
+    assert find_best_buddies(compiled, profiles, encoded) == legacy_find_best_buddies(request, profiles)
+
+
+# Pruned scoring returns exactly the exhaustive top k: random tables, requests, k, weights,
+# partitions and deleted rows
+def test_pruned_scoring_matches_exhaustive():
+    from batch_processing import build_partitions
+    from keyword_scoring import BATCH_WEIGHTS, ScoringWeights
+    from profile_store import ProfileStore
+    from stage_metrics import StageMetrics
+    rng = np.random.default_rng(31)
+    weight_sets = [
+        BATCH_WEIGHTS,
+        ScoringWeights(destination=50, language=30, keywords=10, event=5, package=5, keyword_mode="any"),
+        ScoringWeights(destination=1, keywords=7, package=3),
+        ScoringWeights(destination=20, language=-5, keywords=20),
+    ]
+    metrics = StageMetrics()
+    for seed in range(12):
+        profiles = make_profiles(int(rng.integers(1, 600)), seed=seed)
+        store = ProfileStore.from_profiles(profiles)
+        for buddy_id in rng.choice(profiles["Buddy_id"], size=len(profiles) // 4, replace=False):
+            store.delete(int(buddy_id))
+        for encoded, partitions in ((encode_profiles(profiles), build_partitions(profiles)), (store, store.partitions)):
+            for request_seed in range(10):
+                request = make_request(seed=seed * 100 + request_seed)
+                for options in ({}, {"partitions": partitions}):
+                    k = int(rng.integers(0, 30))
+                    weights = weight_sets[request_seed % len(weight_sets)]
+                    assert find_best_buddies(request, None, encoded, top_k=k, weights=weights, prune=True,
+                                             metrics=metrics, **options) == \
+                        find_best_buddies(request, None, encoded, top_k=k, weights=weights, **options)
+    # Most rows never needed their keyword points
+    counters = metrics.as_dict()["counters"]
+    assert counters["candidates_keyword_scored"] < counters["candidates_scanned"] / 2
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+
+import pytest
+
+import shared_profiles
+from batch_processing import build_partitions, find_best_buddies
+from benchmarks import make_profiles, make_request
+from profile_index import IndexFileError
+from profile_store import ProfileStore
+from shared_profiles import SharedProfiles, publish_profiles, publish_store
+
+COLUMNS = ["Buddy_id", "Destination", "Keywords"]
+
+
+def top_matches(index, seeds=range(5)):
+    results = []
+    for seed in seeds:
+        matches = find_best_buddies(make_request(seed=seed), None, index.encoded, index.partitions, top_k=5)
+        results.append(index.records(matches, COLUMNS))
+    return results
+
+
+def expected_matches(profiles, seeds=range(5)):
+    table = profiles.set_index("Buddy_id", drop=False)
+    partitions = build_partitions(table)
+    return [table.loc[find_best_buddies(make_request(seed=seed), table, partitions=partitions, top_k=5), COLUMNS]
+            .to_dict("records") for seed in seeds]
+
+
+def test_readers_follow_published_generations(tmp_path):
+    with pytest.raises(IndexFileError, match="published"):
+        SharedProfiles(tmp_path).current()
+
+    first, second = make_profiles(300, seed=1), make_profiles(400, seed=2)
+    assert publish_profiles(tmp_path, first.set_index("Buddy_id", drop=False), columns=COLUMNS) == 1
+    shared = SharedProfiles(tmp_path, verify=True)
+    index = shared.current()
+    assert shared.current() is index  # nothing swapped, nothing reloaded
+    assert shared.generation == 1
+    assert top_matches(index) == expected_matches(first)
+
+    # The previous generation stays readable for whoever still holds it, even once its file is removed
+    publish_profiles(tmp_path, second.set_index("Buddy_id", drop=False), columns=COLUMNS, keep=1)
+    assert shared_profiles.generations(tmp_path) == [2]
+    assert shared.current() is not index and shared.generation == 2
+    assert top_matches(shared.current()) == expected_matches(second)
+    assert top_matches(index) == expected_matches(first)
+
+
+# A ProfileStore publishes as it stands: updated and deleted profiles render from their live rows
+def test_publish_store(tmp_path):
+    profiles = make_profiles(200, seed=3)
+    store = ProfileStore.from_profiles(profiles)
+    store.upsert({**store.profile(10), "Destination": "Lisbon", "Keywords": "surfing"})
+    store.delete(11)
+    publish_store(tmp_path, store, columns=["Keywords"])
+    index = SharedProfiles(tmp_path).current()
+    request = {"destination": "Lisbon", "keywords": "surfing"}
+    assert find_best_buddies(request, None, index.encoded, index.partitions, top_k=1) == [10]
+    assert index.records([10], ["Destination", "Keywords"]) == [{"Destination": "Lisbon", "Keywords": "surfing"}]
+    for seed in range(5):
+        assert find_best_buddies(make_request(seed=seed), None, index.encoded, top_k=10) == \
+            find_best_buddies(make_request(seed=seed), None, store, top_k=10)
+
+
+def _worker_matches(directory):
+    index = SharedProfiles(directory).current()
+    mapped = [line for line in open("/proc/self/maps") if line.rstrip().endswith(".idx")]
+    return index.metadata["generation"], top_matches(index), bool(mapped)
+
+
+# Worker processes read the same generation file, memory-mapped rather than copied
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc to inspect mappings")
+def test_worker_processes_share_the_generation_file(tmp_path):
+    profiles = make_profiles(500, seed=4)
+    publish_profiles(tmp_path, profiles.set_index("Buddy_id", drop=False), columns=COLUMNS)
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        results = pool.map(_worker_matches, [str(tmp_path)] * 2)
+    assert results == [(1, expected_matches(profiles), True)] * 2
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from ranking import rank_by_score
+from sql_scoring import match_filters, top_scored_ids
+
+
+def request(destination, language, keywords="", event="", package=""):
+    return SimpleNamespace(destination=destination, language=language, keywords=keywords, event=event, package=package)
+
+
+# The Python scoring loop from match_buddies, run over the same filtered rows
+def python_scores(db, model, search, top_k=None):
+    keywords = search.keywords.lower().split(",")
+    scored = []
+    for buddy in db.query(model).filter(*match_filters(model, search)).all():
+        score = 0
+        if search.destination.lower() in buddy.destination.lower():
+            score += 50
+        if search.language.lower() in buddy.language.lower():
+            score += 30
+        if search.keywords:
+            for keyword in keywords:
+                if keyword.strip() in buddy.keywords.lower():
+                    score += 10
+                    break
+        if search.event and search.event.lower() in buddy.event.lower():
+            score += 5
+        if search.package and search.package.lower() in buddy.package.lower():
+            score += 5
+        scored.append((buddy, score))
+    return [(buddy.id, score) for buddy, score in rank_by_score(scored, top_k)]
+
+
+REQUESTS = [
+    request("Los Angeles", "English,Spanish", "shopping,food,art", "City Tour", "Solo Traveler Buddy"),
+    request("Los Angeles", "English", "food, art"),
+    request("los angeles", "ENGLISH", "", "", ""),
+    request("New Delhi", "Hindi", "culture,shopping,history", "Cultural Tour", "Shopping Enthusiast Buddy"),
+    request("Paris", "French", "art,nightlife"),
+    request("Paris", "French", "", "City Tour"),
+    request("Atlantis", "Elvish", "magic", "Dragon Parade", "Mythical Explorer"),
+]
+
+
+# SQL CASE scoring returns the same buddies, scores and order as scoring in Python
+def test_sql_scores_match_python_loop(db, buddy_model):
+    for search in REQUESTS:
+        assert top_scored_ids(db, buddy_model, search) == python_scores(db, buddy_model, search)
+        assert top_scored_ids(db, buddy_model, search, top_k=2) == python_scores(db, buddy_model, search, top_k=2)
+
+
+def test_sql_scores_values(db, buddy_model):
+    assert top_scored_ids(db, buddy_model, REQUESTS[0]) == [(1, 100), (3, 100)]
+    assert top_scored_ids(db, buddy_model, REQUESTS[4], top_k=1) == [(7, 90)]
+    assert top_scored_ids(db, buddy_model, REQUESTS[6]) == []
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from batch_processing import evaluate_metrics, find_best_buddies
+from benchmarks import make_profiles, make_request
+from stage_metrics import NO_METRICS, StageMetrics
+
+
+def test_stage_timings_and_counters():
+    metrics = StageMetrics()
+    for _ in range(3):
+        with metrics.stage("score"):
+            pass
+    metrics.count("candidates_scanned", 40)
+    metrics.count("candidates_scanned", 2)
+    snapshot = metrics.as_dict()
+    assert snapshot["stages"]["score"]["calls"] == 3
+    assert snapshot["stages"]["score"]["max_s"] <= snapshot["stages"]["score"]["total_s"]
+    assert snapshot["counters"] == {"candidates_scanned": 42}
+    metrics.reset()
+    assert metrics.as_dict() == {"stages": {}, "counters": {}}
+
+
+def test_disabled_metrics_record_nothing():
+    with NO_METRICS.stage("score"):
+        NO_METRICS.count("candidates_scanned", 10)
+    assert NO_METRICS.as_dict() == {"stages": {}, "counters": {}}
+    # One shared timer; nothing is allocated per call
+    assert NO_METRICS.stage("score") is NO_METRICS.stage("topk")
+
+
+def test_prometheus_export():
+    metrics = StageMetrics()
+    metrics.observe("filter", 0.25)
+    metrics.count("candidates returned", 5)
+    text = metrics.to_prometheus()
+    assert '# TYPE buddy_match_stage_seconds_total counter' in text
+    assert 'buddy_match_stage_calls_total{stage="filter"} 1' in text
+    assert 'buddy_match_stage_seconds_total{stage="filter"} 0.25' in text
+    assert 'buddy_match_candidates_returned_total 5' in text
+    assert text.endswith("\n")
+
+
+# The batch matchers report every stage they run and how many candidates went in and out
+def test_batch_matchers_report_stages(capsys):
+    profiles = make_profiles(200, seed=3)
+    metrics = StageMetrics()
+    assert len(find_best_buddies(make_request(seed=4), profiles, metrics=metrics)) == 5
+    snapshot = metrics.as_dict()
+    assert set(snapshot["stages"]) == {"preprocess", "filter", "score", "topk"}
+    assert snapshot["counters"] == {"candidates_scanned": 200, "candidates_returned": 5}
+
+    metrics.reset()
+    scenarios = pd.DataFrame([make_request(seed=s) for s in range(4)])
+    evaluate_metrics(scenarios, profiles, metrics=metrics)
+    snapshot = metrics.as_dict()
+    assert {"preprocess", "score", "topk", "serialize"} <= set(snapshot["stages"])
+    assert snapshot["counters"] == {"candidates_scanned": 800, "candidates_returned": 20}